@@ -0,0 +1,626 @@
+﻿import asyncio
+import base64
+import hashlib
+import io
+import ssl
+import struct
+import threading
+from http.client import parse_headers
+
+from django.conf import settings
+from websocket.WebsocketServer import WebsocketServer, InstIdTracking
+from websocket.WebsocketClient import WebsocketClient
+from websocket.Broadcast import BroadcastMessage, encodeFrame
+from websocket.Compression import RSV1, negotiateDeflate
+from common.logger import Logger
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+######################################################
+##
+##      Parsed upgrade request, mirrors the fields
+##       of the select backend HTTP request object
+##
+######################################################
+
+class AsyncHttpRequest(object):
+
+    mCommand = ""
+    mPath = ""
+    mHeaders = None
+
+    def __init__(self, pHeaderBuffer):
+
+        lRequestLine, lSeparator, lHeaders = pHeaderBuffer.partition(b'\r\n')
+
+        lParts = lRequestLine.decode('latin-1').split()
+
+        if len(lParts) != 3:
+            raise NameError("Invalid request line")
+
+        self.mCommand = lParts[0]
+        self.mPath = lParts[1]
+        self.mHeaders = parse_headers(io.BytesIO(lHeaders))
+
+        return
+
+    @property
+    def command(self):
+        return self.mCommand
+
+    @property
+    def path(self):
+        return self.mPath
+
+    @property
+    def headers(self):
+        return self.mHeaders
+
+
+######################################################
+##
+##   asyncio transport for a websocket client, the
+##   websocket class handlers ( handleMessage ... )
+##        are used unchanged on top of it
+##
+######################################################
+
+class AsyncWebsocketTransport(object):
+
+    mReader = None
+    mWriter = None
+    mLoop = None
+    mSendQueue = None
+    mWriterTask = None
+    mClosing = False
+    mCloseFrame = None
+    mDroppedFrames = 0
+    mDeflate = None
+
+    def __init__(self, pServer, pReader, pWriter):
+
+        super().__init__(pServer, None, pWriter.get_extra_info('peername'))
+
+        self.handshaked = False
+        self.mReader = pReader
+        self.mWriter = pWriter
+        self.mLoop = pServer.loop
+        self.mSendQueue = asyncio.Queue(pServer.sendQueueSize)
+        self.mClosing = False
+        self.mDroppedFrames = 0
+
+        return
+
+    ######################################################
+	##
+	##      Connection life cycle : handshake, read
+	##            loop, close notification
+	##
+	######################################################
+
+    async def serve(self):
+
+        try:
+
+            if await asyncio.wait_for(self._handshake(), self.server.handshakeTimeout) == False:
+                return
+
+            self.handshaked = True
+            self.mWriterTask = self.mLoop.create_task(self._writeService())
+
+            self.handleConnected()
+
+            await self._readService()
+
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ssl.SSLError):
+            pass
+
+        except Exception as lException:
+            Logger("websocket").Write(self.server.mServiceAlias + " -> Client error : " + str(lException))
+
+        finally:
+
+            if self.handshaked == True:
+
+                self.handshaked = False
+
+                try:
+                    self.handleClose()
+                except Exception as lException:
+                    Logger("websocket").Write(self.server.mServiceAlias + " -> Close handler error : " + str(lException))
+
+            if self.mWriterTask is not None:
+
+                # a close frame ( the echo of the client one ... ) is
+                # written by the writer task, give it the time to
+                if self.mClosing == True:
+
+                    try:
+                        await asyncio.wait_for(self.mWriterTask, self.server.closeTimeout)
+                    except Exception:
+                        pass
+
+                self.mWriterTask.cancel()
+
+            self.mWriter.close()
+
+        return
+
+    async def _handshake(self):
+
+        lHeaderBuffer = await self.mReader.readuntil(b'\r\n\r\n')
+
+        try:
+            self.request = AsyncHttpRequest(lHeaderBuffer[:-4])
+        except Exception:
+            self.request = None
+
+        if self.request is None or self.request.headers.get('Upgrade', '').lower() != 'websocket' or self.request.headers.get('Sec-WebSocket-Key') is None:
+
+            self.mWriter.write(b'HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n')
+            await self.mWriter.drain()
+
+            return False
+
+        lAccept = base64.b64encode(hashlib.sha1(self.request.headers['Sec-WebSocket-Key'].strip().encode('ascii') + WEBSOCKET_GUID).digest())
+        lExtensions = b''
+
+        self.mDeflate = self.server.negotiateCompression(self.request.headers.get('Sec-WebSocket-Extensions'))
+
+        if self.mDeflate is not None:
+            lExtensions = b'Sec-WebSocket-Extensions: ' + self.mDeflate.responseHeader.encode('ascii') + b'\r\n'
+
+        self.mWriter.write(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + lAccept + b'\r\n' + lExtensions + b'\r\n')
+
+        await self.mWriter.drain()
+
+        return True
+
+    ######################################################
+	##
+	##                 Frames reading
+	##
+	######################################################
+
+    async def _readFrame(self):
+
+        lHeader = await self.mReader.readexactly(2)
+
+        lFin = lHeader[0] & 0x80
+        lRsv = lHeader[0] & 0x70
+        lOpcode = lHeader[0] & 0x0F
+        lMasked = lHeader[1] & 0x80
+        lLength = lHeader[1] & 0x7F
+
+        if lLength == 126:
+            lLength = struct.unpack("!H", await self.mReader.readexactly(2))[0]
+        elif lLength == 127:
+            lLength = struct.unpack("!Q", await self.mReader.readexactly(8))[0]
+
+        if lLength > self.server.maxPayloadSize:
+            raise NameError("Frame too large : " + str(lLength))
+
+        # client frames must be masked
+        if lMasked == 0:
+            raise NameError("Unmasked client frame")
+
+        # RSV1 only flags the first frame of a compressed message
+        if lRsv != 0 and (lRsv != RSV1 or self.mDeflate is None or lOpcode == OPCODE_CONTINUATION or lOpcode >= OPCODE_CLOSE):
+            raise NameError("Invalid RSV bits")
+
+        lMask = await self.mReader.readexactly(4)
+        lPayload = await self.mReader.readexactly(lLength)
+
+        return (lFin, lRsv, lOpcode, unmaskPayload(lPayload, lMask))
+
+    async def _readService(self):
+
+        lFragmentOpcode = None
+        lFragments = bytearray()
+        lCompressed = False
+
+        while True:
+
+            lFin, lRsv, lOpcode, lPayload = await self._readFrame()
+
+            if lOpcode == OPCODE_CLOSE:
+                self.close()
+                return
+
+            if lOpcode == OPCODE_PING:
+                self.enqueueFrame(OPCODE_PONG, encodeFrame(lPayload, OPCODE_PONG)[1])
+                continue
+
+            if lOpcode == OPCODE_PONG:
+                continue
+
+            if lOpcode == OPCODE_CONTINUATION:
+
+                if lFragmentOpcode is None:
+                    raise NameError("Unexpected continuation frame")
+
+                lFragments += lPayload
+
+                if len(lFragments) > self.server.maxPayloadSize:
+                    raise NameError("Message too large")
+
+                if lFin == 0:
+                    continue
+
+                lOpcode = lFragmentOpcode
+                lPayload = bytes(lFragments)
+
+                lFragmentOpcode = None
+                lFragments.clear()
+
+            elif lFin == 0:
+
+                lFragmentOpcode = lOpcode
+                lFragments += lPayload
+                lCompressed = lRsv != 0
+
+                continue
+
+            else:
+                lCompressed = lRsv != 0
+
+            if lCompressed == True:
+                lPayload = self.mDeflate.decompress(lPayload, self.server.maxPayloadSize)
+                lCompressed = False
+
+            if lOpcode == OPCODE_TEXT:
+                self.data = lPayload.decode('utf-8')
+            else:
+                self.data = bytearray(lPayload)
+
+            self.handleMessage()
+
+    ######################################################
+	##
+	##      Bounded send queue, drained by one writer
+	##           task waiting on socket backpressure
+	##
+	######################################################
+
+    def enqueueFrame(self, pOpcode, pFrame):
+
+        if threading.get_ident() != self.server.loopThreadId:
+            self.mLoop.call_soon_threadsafe(self.enqueueFrame, pOpcode, pFrame)
+            return True
+
+        if pOpcode == OPCODE_CLOSE:
+            return self._queueClose(pFrame)
+
+        if self._admit(pOpcode) == False:
+            return False
+
+        self._put(pOpcode, pFrame)
+
+        return True
+
+    # the frame is picked once admitted, a compressor with context
+    # must never produce a frame which is then dropped
+    def enqueueMessage(self, pMessage):
+
+        if threading.get_ident() != self.server.loopThreadId:
+            self.mLoop.call_soon_threadsafe(self.enqueueMessage, pMessage)
+            return True
+
+        if self._admit(pMessage.opcode) == False:
+            return False
+
+        self._put(pMessage.opcode, pMessage.frameFor(self.mDeflate))
+
+        return True
+
+    def _admit(self, pOpcode):
+
+        if self.mClosing == True:
+            return False
+
+        if pOpcode < OPCODE_CLOSE and self.server.outboundGuard.admit(self, self.mSendQueue.qsize()) == False:
+            return False
+
+        if self.mSendQueue.full():
+            self.mDroppedFrames += 1
+            return False
+
+        return True
+
+    def _put(self, pOpcode, pFrame):
+        self.mSendQueue.put_nowait((pOpcode, pFrame))
+        return
+
+    ######################################################
+	##
+	##   The close frame is kept out of the bounded queue
+	##   so it is never dropped, the writer sends it once
+	##       the frames queued before it are written
+	##
+	######################################################
+
+    def _queueClose(self, pFrame):
+
+        if self.mClosing == True:
+            return False
+
+        self.mClosing = True
+        self.mCloseFrame = pFrame
+
+        # wakes an idle writer, a full queue means it is busy
+        if self.mSendQueue.full() == False:
+            self.mSendQueue.put_nowait(None)
+
+        return True
+
+    async def _writeService(self):
+
+        while True:
+
+            if self.mCloseFrame is not None and self.mSendQueue.empty():
+
+                self.mWriter.write(self.mCloseFrame)
+                await self.mWriter.drain()
+                self.mWriter.close()
+
+                return
+
+            lEntry = await self.mSendQueue.get()
+
+            if lEntry is None:
+                continue
+
+            self.mWriter.write(lEntry[1])
+            await self.mWriter.drain()
+
+    ######################################################
+	##
+	##      Same sending surface as the select backend
+	##
+	######################################################
+
+    def sendMessage(self, pData):
+
+        self.enqueueMessage(BroadcastMessage(pData))
+
+        return
+
+    def close(self, pStatus = 1000, pReason = u''):
+
+        lPayload = struct.pack("!H", pStatus) + pReason.encode('utf-8')
+        self.enqueueFrame(OPCODE_CLOSE, encodeFrame(lPayload, OPCODE_CLOSE)[1])
+
+        return
+
+    def abort(self):
+        self.mWriter.transport.abort()
+        return
+
+    @property
+    def sendQueueDepth(self):
+        return self.mSendQueue.qsize()
+
+    @property
+    def droppedFrames(self):
+        return self.mDroppedFrames
+
+    @property
+    def permessageDeflate(self):
+        return self.mDeflate
+
+
+######################################################
+##
+##           Unmask a client frame payload
+##
+######################################################
+
+def unmaskPayload(pPayload, pMask):
+
+    lLength = len(pPayload)
+
+    if lLength == 0:
+        return b''
+
+    lKey = (pMask * (lLength // 4 + 1))[:lLength]
+
+    return (int.from_bytes(pPayload, 'big') ^ int.from_bytes(lKey, 'big')).to_bytes(lLength, 'big')
+
+
+######################################################
+##
+##   asyncio backend, same surface as WebsocketServer
+##
+######################################################
+
+class AsyncWebsocketServer(WebsocketServer):
+
+    mHost = ''
+    mSslContext = None
+    mLoop = None
+    mLoopThreadId = None
+    mServer = None
+    mClientClass = None
+    mConnections = None
+    mSendQueueSize = 1024
+    mHandshakeTimeout = 10.0
+    mCloseTimeout = 2.0
+    mMaxPayloadSize = 33554432
+    mReusePort = False
+
+    # permessage-deflate, see settings.WEBSOCKET_COMPRESSION*
+    mCompression = False
+    mCompressionLevel = 6
+    mCompressionThreshold = 128
+    mServerContextTakeover = False
+    mClientContextTakeover = True
+    mCompressionWindowBits = 15
+
+    def __init__(self, pPort = None, pBindedHost = '', pCertfile = None, pKeyfile = None, pWebsocketClass = WebsocketClient, pReusePort = False):
+
+        WebsocketServer.__init__(self, pPort, pBindedHost, True)
+
+        self.mHost = pBindedHost if pBindedHost != '' else None
+        self.mConnections = set()
+        self.mReusePort = pReusePort
+        self.mSendQueueSize = int(getattr(settings, 'WEBSOCKET_SEND_QUEUE_SIZE', 1024))
+        self.mCloseTimeout = float(getattr(settings, 'WEBSOCKET_CLOSE_TIMEOUT', 2.0))
+
+        self.mCompression = bool(getattr(settings, 'WEBSOCKET_COMPRESSION', False))
+        self.mCompressionLevel = int(getattr(settings, 'WEBSOCKET_COMPRESSION_LEVEL', 6))
+        self.mCompressionThreshold = int(getattr(settings, 'WEBSOCKET_COMPRESSION_THRESHOLD', 128))
+        self.mCompressionWindowBits = int(getattr(settings, 'WEBSOCKET_COMPRESSION_WINDOW_BITS', 15))
+
+        # without server context takeover a broadcast is compressed once
+        self.mServerContextTakeover = bool(getattr(settings, 'WEBSOCKET_COMPRESSION_SERVER_CONTEXT_TAKEOVER', False))
+        self.mClientContextTakeover = bool(getattr(settings, 'WEBSOCKET_COMPRESSION_CLIENT_CONTEXT_TAKEOVER', True))
+
+        if pCertfile is not None:
+            self.mSslContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.mSslContext.load_cert_chain(pCertfile, pKeyfile)
+
+        # keeps the instId index up to date when set after connect
+        if issubclass(pWebsocketClass, InstIdTracking) == False:
+            pWebsocketClass = type('Tracked' + pWebsocketClass.__name__, (InstIdTracking, pWebsocketClass), {})
+
+        self.mClientClass = type('Async' + pWebsocketClass.__name__, (AsyncWebsocketTransport, pWebsocketClass), {})
+
+        return
+
+    ######################################################
+	##
+	##    Run the event loop, called by start() thread
+	##
+	######################################################
+
+    def serveforever(self):
+        asyncio.run(self._serve())
+        return
+
+    async def _serve(self):
+
+        self.mLoop = asyncio.get_running_loop()
+        self.mLoopThreadId = threading.get_ident()
+
+        self.mServer = await asyncio.start_server(self._onAccept, self.mHost, self.mPort, ssl=self.mSslContext, backlog=1024, reuse_port=self.mReusePort)
+
+        Logger("websocket").Write(self.mServiceAlias + " -> asyncio backend listening on port : " + str(self.mPort))
+
+        async with self.mServer:
+
+            try:
+                await self.mServer.serve_forever()
+
+            # close() stops serve_forever() by cancelling it
+            except asyncio.CancelledError:
+                pass
+
+            # leaving the block waits for every connection
+            self._abortClients()
+
+            # let every client run its close handlers before the loop ends
+            for lI in range(100):
+
+                if len(self.mConnections) == 0:
+                    break
+
+                await asyncio.sleep(0.01)
+
+        return
+
+    ######################################################
+	##
+	##   Since Python 3.12.1 a cancelled serve_forever()
+	##   and the server context manager wait for every
+	##   connection to be closed, clients are aborted
+	##        along with the listening socket
+	##
+	######################################################
+
+    def _shutdown(self):
+
+        self.mServer.close()
+        self._abortClients()
+
+        return
+
+    def _abortClients(self):
+
+        for lClient in list(self.mConnections):
+            lClient.abort()
+
+        # connections still in the TLS handshake are not tracked yet
+        if hasattr(self.mServer, 'abort_clients'):
+            self.mServer.abort_clients()
+
+        return
+
+    async def _onAccept(self, pReader, pWriter):
+
+        lClient = self.mClientClass(self, pReader, pWriter)
+
+        self.mConnections.add(lClient)
+
+        try:
+            await lClient.serve()
+        finally:
+            self.mConnections.discard(lClient)
+
+        return
+
+    def negotiateCompression(self, pHeader):
+
+        if self.mCompression == False:
+            return None
+
+        return negotiateDeflate(pHeader, self.mCompressionLevel, self.mCompressionThreshold, self.mServerContextTakeover, self.mClientContextTakeover, self.mCompressionWindowBits)
+
+    def close(self):
+
+        if self.mLoop is None or self.mServer is None:
+            return
+
+        self.mLoop.call_soon_threadsafe(self._shutdown)
+
+        return
+
+    ######################################################
+	##
+	##                 Class properties
+	##
+	######################################################
+
+    @property
+    def loop(self):
+        return self.mLoop
+
+    @property
+    def loopThreadId(self):
+        return self.mLoopThreadId
+
+    @property
+    def sendQueueSize(self):
+        return self.mSendQueueSize
+
+    @property
+    def handshakeTimeout(self):
+        return self.mHandshakeTimeout
+
+    @property
+    def closeTimeout(self):
+        return self.mCloseTimeout
+
+    @property
+    def maxPayloadSize(self):
+        return self.mMaxPayloadSize
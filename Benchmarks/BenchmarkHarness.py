@@ -0,0 +1,116 @@
+﻿######################################################
+##
+##   Benchmark harness : best-of-N timings, JSON
+##   results and comparison with a stored baseline
+##
+######################################################
+
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+
+# relative slowdown reported as a regression
+DEFAULT_TOLERANCE = 0.15
+
+######################################################
+##
+##   Time pNumber calls of pFunction, pRepeat times,
+##   best and median are reported per call ( the
+##       garbage collector is off while timing )
+##
+######################################################
+
+def measure(pFunction, pNumber, pRepeat = 5):
+
+    lTimes = sorted(lTime / pNumber for lTime in timeit.repeat(pFunction, number=pNumber, repeat=pRepeat))
+
+    return {
+        'best_ns' : lTimes[0] * 1e9,
+        'median_ns' : lTimes[ len(lTimes) // 2 ] * 1e9,
+        'number' : pNumber,
+        'repeat' : pRepeat,
+    }
+
+######################################################
+##
+##   Run every ( name, function, number ) case of the
+##    given generators, cases are built lazily so
+##     large fixtures do not live at the same time
+##
+######################################################
+
+def runCases(pCaseGenerators, pFilter = None, pRepeat = 5, pOutput = sys.stdout):
+
+    lResults = {}
+
+    for lGenerator in pCaseGenerators:
+
+        for lName, lFunction, lNumber in lGenerator:
+
+            if pFilter is not None and pFilter not in lName:
+                continue
+
+            lResults[ lName ] = measure(lFunction, lNumber, pRepeat)
+
+            if pOutput is not None:
+                pOutput.write("%-56s %12.1f ns %12.1f ns\n" % (lName, lResults[ lName ]['best_ns'], lResults[ lName ]['median_ns']))
+                pOutput.flush()
+
+    return lResults
+
+def getEnvironment():
+
+    return {
+        'python' : platform.python_version(),
+        'implementation' : platform.python_implementation(),
+        'platform' : platform.platform(),
+        'machine' : platform.machine(),
+        'cpu_count' : os.cpu_count(),
+        'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def saveResults(pPath, pResults):
+
+    with open(pPath, 'w') as lFile:
+        json.dump({ 'environment' : getEnvironment(), 'results' : pResults }, lFile, indent=2, sort_keys=True)
+
+    return
+
+def loadResults(pPath):
+
+    with open(pPath, 'r') as lFile:
+        return json.load(lFile)['results']
+
+######################################################
+##
+##   Compare best timings with the baseline, return
+##   ( name, baseline ns, current ns, ratio ) of the
+##            cases slower than tolerated
+##
+######################################################
+
+def compareResults(pResults, pBaseline, pTolerance = DEFAULT_TOLERANCE, pOutput = sys.stdout):
+
+    lRegressions = []
+
+    for lName in sorted(pResults.keys()):
+
+        lBase = pBaseline.get(lName, None)
+
+        if lBase is None:
+            continue
+
+        lRatio = pResults[ lName ]['best_ns'] / lBase['best_ns'] if lBase['best_ns'] > 0 else 1.0
+
+        if lRatio > 1.0 + pTolerance:
+            lRegressions.append((lName, lBase['best_ns'], pResults[ lName ]['best_ns'], lRatio))
+
+        if pOutput is not None:
+            pOutput.write("%-56s %12.1f -> %12.1f ns  %+6.1f%%%s\n" % (
+                lName, lBase['best_ns'], pResults[ lName ]['best_ns'], (lRatio - 1.0) * 100.0,
+                "  REGRESSION" if lRatio > 1.0 + pTolerance else ""))
+
+    return lRegressions
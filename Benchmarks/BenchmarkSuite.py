@@ -0,0 +1,86 @@
+﻿######################################################
+##
+##   Benchmark suite entry point :
+##
+##   python Benchmarks/BenchmarkSuite.py
+##       [--suite vauban|channel|all] [--filter text]
+##       [--quick] [--output results.json]
+##       [--baseline baseline.json] [--save-baseline]
+##       [--tolerance 0.15]
+##
+##   Exits with 1 when a case is slower than the
+##          baseline beyond the tolerance
+##
+######################################################
+
+import argparse
+import os
+import sys
+
+from BenchmarkHarness import runCases, saveResults, loadResults, compareResults, DEFAULT_TOLERANCE
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def getCaseGenerators(pSuite, pScale):
+
+    lGenerators = []
+
+    if pSuite in ('vauban', 'all'):
+        import VaubanBenchmark
+        lGenerators.append(VaubanBenchmark.cases(pScale))
+
+    # offline : settings and SharedVar are stand-ins
+    if pSuite in ('channel', 'all'):
+        import ChannelBenchmark
+        import ChannelResolverBenchmark
+        lGenerators.append(ChannelBenchmark.cases(pScale))
+        lGenerators.append(ChannelResolverBenchmark.cases(pScale))
+
+    return lGenerators
+
+
+def main(pArgs = None):
+
+    lParser = argparse.ArgumentParser(description="Vauban and websocket benchmarks")
+    lParser.add_argument('--suite', choices=('vauban', 'channel', 'all'), default='all')
+    lParser.add_argument('--filter', default=None, help="only run cases whose name contains this text")
+    lParser.add_argument('--quick', action='store_true', help="10x fewer iterations, for smoke runs")
+    lParser.add_argument('--repeat', type=int, default=5)
+    lParser.add_argument('--output', default=None, help="write results to this JSON file")
+    lParser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    lParser.add_argument('--save-baseline', action='store_true', help="store results as the new baseline")
+    lParser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+
+    lArgs = lParser.parse_args(pArgs)
+
+    print("%-56s %15s %15s" % ("case", "best", "median"))
+
+    lResults = runCases(getCaseGenerators(lArgs.suite, 0.1 if lArgs.quick else 1.0), lArgs.filter, lArgs.repeat)
+
+    if lArgs.output is not None:
+        saveResults(lArgs.output, lResults)
+
+    if lArgs.save_baseline == True:
+        saveResults(lArgs.baseline, lResults)
+        print("baseline saved to " + lArgs.baseline)
+        return 0
+
+    if os.path.exists(lArgs.baseline) == False:
+        print("no baseline at " + lArgs.baseline + ", run with --save-baseline to create one")
+        return 0
+
+    print("")
+    print("compared with " + lArgs.baseline)
+
+    lRegressions = compareResults(lResults, loadResults(lArgs.baseline), lArgs.tolerance)
+
+    if len(lRegressions) > 0:
+        print("%d regression(s) over %.0f%%" % (len(lRegressions), lArgs.tolerance * 100.0))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+﻿######################################################
+##
+##   Channel benchmarks : join / leave and fan-out
+##   at several channel sizes, with an in-memory
+##        SharedVar and fake client sockets
+##
+######################################################
+
+from OfflineModules import installOfflineModules, MemorySharedVar
+
+# django settings and SharedVar are stand-ins, the suite runs offline
+installOfflineModules()
+
+from websocket.ChannelHandler.Channel import ChannelHandler, ChannelRegistry
+from websocket.WebsocketServer import WebsocketServer
+
+SIZES = (10, 1000, 10000)
+
+######################################################
+##
+##   Client socket whose send queue drops frames, so
+##    only the fan-out itself is measured
+##
+######################################################
+
+class NullQueue(object):
+
+    def append(self, pItem):
+        return
+
+    def __len__(self):
+        return 0
+
+
+class FakeSocket(object):
+
+    def __init__(self, pServer):
+
+        self.socketId = 0
+        self.server = pServer
+        self.sendq = NullQueue()
+
+    def setSocketId(self, pSocketId):
+        self.socketId = pSocketId
+
+
+def createServer():
+
+    MemorySharedVar.mStore.clear()
+
+    lServer = WebsocketServer(pDisableInit=True)
+
+    # one notification per join / leave, no timer thread
+    ChannelHandler.setNotifyWindow(0)
+
+    return lServer
+
+def fillChannel(pServer, pChannelName, pSize):
+
+    lHandler = ChannelRegistry.get(pChannelName)
+    lSockets = []
+
+    # members are added directly, joining one by one would
+    # notify the whole channel each time
+    for lI in range(pSize):
+
+        lSocket = FakeSocket(pServer)
+        pServer.mClientStack.register(lSocket)
+        lHandler.mClientStack.add(lSocket.socketId)
+        lSockets.append(lSocket)
+
+    lHandler.mClientStack.flush()
+
+    return lHandler, lSockets
+
+######################################################
+##
+##        ( name, function, number ) cases
+##
+######################################################
+
+def cases(pScale = 1.0):
+
+    lServer = createServer()
+    lPayload = b'\x00' * 64
+
+    for lSize in SIZES:
+
+        lChannelName = 'BENCHMARK_' + str(lSize)
+        lHandler, lSockets = fillChannel(lServer, lChannelName, lSize)
+
+        lJoiner = FakeSocket(lServer)
+        lServer.mClientStack.register(lJoiner)
+
+        def lJoinLeave(pHandler = lHandler, pSocket = lJoiner):
+            pHandler.tryJoin(pSocket)
+            pHandler.leaveChannel(pSocket)
+
+        yield ('channel.tryJoin+leaveChannel.' + str(lSize), lJoinLeave, max(1, int(20000 * pScale) // lSize))
+
+        yield ('server.sendToChannel.' + str(lSize), lambda pSender = lSockets[0], pChannelName = lChannelName: lServer.sendToChannel(lPayload, pSender, pChannelName), max(1, int(50000 * pScale) // lSize))
+
+        ChannelRegistry.reset()
+        lServer.mClientStack.clear()
+
+    return
@@ -0,0 +1,58 @@
+﻿######################################################
+##
+##   ChannelResolver micro benchmark : former linear
+##      scan of Channel.__members__ vs lookup tables
+##
+######################################################
+
+from OfflineModules import installOfflineModules
+
+# the channel enum comes from the project, or the offline stand-in
+installOfflineModules()
+
+from common.constants.Network import Channel
+from websocket.ChannelHandler.Channel import ChannelResolver
+
+
+def linearGetIdFromString(pStr):
+
+    from common.constants.Network import Opcodes, Channel, NetworkFlags
+
+    for lKey, lChannel in Channel.__members__.items():
+        if lKey == pStr:
+            return lChannel.value
+
+    return 0
+
+def linearGetNameFromId(pId):
+
+    from common.constants.Network import Opcodes, Channel, NetworkFlags
+
+    for lKey, lChannel in Channel.__members__.items():
+        if lChannel.value == pId:
+            return lKey
+
+    return ''
+
+
+def cases(pScale = 1.0):
+
+    ChannelResolver.reload()
+
+    # worst case for the linear scan : last declared channel
+    lName, lChannel = list(Channel.__members__.items())[-1]
+    lNumber = max(1, int(200000 * pScale))
+
+    yield ('resolver.getIdFromString.linear', lambda: linearGetIdFromString(lName), lNumber)
+    yield ('resolver.getIdFromString.table', lambda: ChannelResolver.getIdFromString(lName), lNumber)
+    yield ('resolver.getNameFromId.linear', lambda: linearGetNameFromId(lChannel.value), lNumber)
+    yield ('resolver.getNameFromId.table', lambda: ChannelResolver.getNameFromId(lChannel.value), lNumber)
+
+    return
+
+
+if __name__ == '__main__':
+
+    from BenchmarkHarness import runCases
+
+    runCases([ cases() ])
@@ -0,0 +1,246 @@
+﻿######################################################
+##
+##   Stand-ins for the project modules the benchmarks
+##   and tests/conftest.py import, so both run without
+##   the Django project, its settings or the shared
+##                    store
+##
+######################################################
+
+import fnmatch
+import importlib.util
+import os
+import pickle
+import struct
+import sys
+import types
+from collections import deque
+from enum import Enum
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def installModule(pName, pAttributes = None, pPath = None):
+
+    lModule = types.ModuleType(pName)
+
+    if pPath is not None:
+        lModule.__path__ = pPath
+
+    for lKey, lValue in (pAttributes or {}).items():
+        setattr(lModule, lKey, lValue)
+
+    sys.modules[ pName ] = lModule
+
+    lParent, lSeparator, lChild = pName.rpartition('.')
+
+    if lParent != '' and lParent in sys.modules:
+        setattr(sys.modules[ lParent ], lChild, lModule)
+
+    return lModule
+
+def isMissing(pName):
+
+    try:
+        return importlib.util.find_spec(pName) is None
+    except (ImportError, ValueError):
+        return True
+
+######################################################
+##
+##   In-process SharedVar, values are pickled like
+##    the shared store so callers never alias them
+##
+######################################################
+
+class MemorySharedVar(object):
+
+    mStore = {}
+
+    def __init__(self, pNamespace):
+        self.mNamespace = pNamespace
+
+    def get(self, pKey, pSubKey):
+
+        lValue = self.mStore.get((self.mNamespace, pKey, pSubKey), None)
+
+        return pickle.loads(lValue) if lValue is not None else None
+
+    def set(self, pKey, pSubKey, pValue):
+        self.mStore[ (self.mNamespace, pKey, pSubKey) ] = pickle.dumps(pValue)
+
+    def removePattern(self, pKey, pPattern):
+
+        for lKey in list(self.mStore.keys()):
+            if lKey[0] == self.mNamespace and lKey[1] == pKey and fnmatch.fnmatch(str(lKey[2]), pPattern):
+                del self.mStore[ lKey ]
+
+
+class Connections(object):
+
+    def close_all(self):
+        return
+
+
+class OfflineSettings(object):
+
+    WEBSOCKET_DEFAULT_PORT = 9000
+    WEBSOCKET_SERVER_CAPACITY = 0
+    WEBSOCKET_NOTIFICATION_WINDOW_MS = 0
+    WEBSOCKET_METRICS = False
+
+
+class NullLogger(object):
+
+    def __init__(self, pName):
+        return
+
+    def Write(self, pMessage):
+        return
+
+
+class ScheduledObject(object):
+
+    isRepeated = False
+
+    def __init__(self, pFunction, pDelay):
+        self.mFunction = pFunction
+        self.mDelay = pDelay
+
+
+class Opcodes(Enum):
+    SMSG_CHANNEL_NOTIFICATION = 10
+    SMSG_SERVER_NOTIFICATION = 11
+
+
+class Channel(Enum):
+    GLOBAL = 0
+    LOBBY = 1
+    GAME = 2
+
+
+class NetworkFlags(object):
+    FLAG_NEW_CLIENT_CONNECTED = 1
+    FLAG_CLIENT_DISCONNECTED = 2
+    FLAG_SERVER_IS_FULL = 3
+
+
+class Packet(object):
+
+    def __init__(self, opcode, channel):
+        self.mBytes = bytearray([ opcode.value ])
+
+    def WriteByte(self, pValue):
+        self.mBytes.append(pValue)
+
+    def WriteInt32(self, pValue):
+        self.mBytes += struct.pack('<i', pValue)
+
+    def WriteUint32(self, pValue):
+        self.mBytes += struct.pack('<I', pValue)
+
+    @property
+    def deflate(self):
+        return bytes(self.mBytes)
+
+
+class WebsocketClient(object):
+
+    def __init__(self, pServer, pSocket, pAddress):
+
+        self.server = pServer
+        self.client = pSocket
+        self.address = pAddress
+        self.handshaked = False
+        self.sendq = deque()
+        self.data = None
+        self.socketId = 0
+        self.instId = None
+
+    def setSocketId(self, pSocketId):
+        self.socketId = pSocketId
+
+    def handleConnected(self):
+        self.server.onClientConnect(self)
+
+    def handleClose(self):
+        self.server.onClientDisconnect(self)
+
+    def handleMessage(self):
+        return
+
+    def sendMessage(self, pData):
+        self.sendq.append(pData)
+
+    def close(self):
+        self.handshaked = False
+
+
+class SimpleWebSocketServer(object):
+
+    def __init__(self, *pArgs, **pKwargs):
+        return
+
+
+class SimpleSSLWebSocketServer(SimpleWebSocketServer):
+    pass
+
+
+class ChannelEventHandler(object):
+
+    def sendEvent(self, *pArgs):
+        return
+
+
+class DeciboxAPI(object):
+
+    def checkAccess(self, pCardId, pPort):
+        return True
+
+######################################################
+##
+##   Modules are only stood in for when they can not
+##   be imported ( outside the project ). pForceOffline
+##   also replaces the settings and the shared store
+##     of a project install ( benchmarks default )
+##
+######################################################
+
+def installOfflineModules(pForceOffline = True):
+
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+
+    if isMissing('DeciboxApi'):
+        installModule('DeciboxApi', { 'DeciboxAPI' : DeciboxAPI })
+
+    if pForceOffline == True or isMissing('django'):
+        installModule('django', pPath=[])
+        installModule('django.conf', { 'settings' : OfflineSettings })
+        installModule('django.db', { 'connections' : Connections(), 'close_old_connections' : lambda: None })
+        installModule('django.core', pPath=[])
+        installModule('django.core.wsgi', { 'get_wsgi_application' : lambda: None })
+
+    if isMissing('common'):
+        installModule('common', pPath=[])
+        installModule('common.utils', { 'SharedVar' : MemorySharedVar })
+        installModule('common.logger', { 'Logger' : NullLogger })
+        installModule('common.ScheduledTask', { 'ScheduledObject' : ScheduledObject })
+        installModule('common.constants', pPath=[])
+        installModule('common.constants.Network', { 'Opcodes' : Opcodes, 'Channel' : Channel, 'NetworkFlags' : NetworkFlags })
+
+    elif pForceOffline == True:
+        import common
+        installModule('common.utils', { 'SharedVar' : MemorySharedVar })
+
+    # the repository root is the websocket package, Channel.py
+    # lives in its ChannelHandler sub-package in the project
+    if isMissing('websocket'):
+        installModule('websocket', pPath=[ ROOT ])
+        installModule('websocket.Packet', { 'Packet' : Packet })
+        installModule('websocket.WebsocketClient', { 'WebsocketClient' : WebsocketClient })
+        installModule('websocket.Dependency', pPath=[])
+        installModule('websocket.Dependency.websocket_server', { 'SimpleWebSocketServer' : SimpleWebSocketServer, 'SimpleSSLWebSocketServer' : SimpleSSLWebSocketServer })
+        installModule('websocket.ChannelHandler', pPath=[ ROOT ])
+        installModule('websocket.ChannelHandler.ChannelEventHandler', { 'ChannelEventHandler' : ChannelEventHandler })
+
+    return
@@ -0,0 +1,152 @@
+﻿######################################################
+##
+##   Vauban packet benchmarks : frame encoding per
+##    opcode and enrollment decoding, against a fake
+##                  serial port
+##
+######################################################
+
+import io
+import os
+import random
+import sys
+from contextlib import redirect_stdout
+
+from OfflineModules import installOfflineModules
+
+# DeciboxApi is only needed by the access checks
+installOfflineModules()
+
+from Packet import VaubanPacket, VaubanOpcodes, VaubanOpcodeHandler, VaubanFrameParser, encodeVaubanFrame, decodeVaubanFrame
+
+######################################################
+##
+##   In-memory stand-in for serial.Serial, written
+##    bytes are counted, read() serves fed bytes
+##
+######################################################
+
+class FakeSerialPort(object):
+
+    is_open = True
+
+    def __init__(self):
+
+        self.mInput = bytearray()
+        self.mBytesWritten = 0
+
+    def write(self, pData):
+        self.mBytesWritten += len(pData)
+        return len(pData)
+
+    def feed(self, pData):
+        self.mInput += pData
+
+    def read(self, pSize = 1):
+
+        lData = bytes(self.mInput[:pSize])
+        del self.mInput[:pSize]
+
+        return lData
+
+    @property
+    def in_waiting(self):
+        return len(self.mInput)
+
+
+class FakeVaubanDevice(object):
+
+    def __init__(self, pDeviceId = 0x12):
+
+        self.deviceId = pDeviceId
+        self.device = FakeSerialPort()
+        self.interface = '/dev/fake0'
+        self.parser = VaubanFrameParser()
+        self.metrics = None
+
+
+######################################################
+##
+##   Payload pushed for each opcode, same fields as
+##              VaubanOpcodeHandler
+##
+######################################################
+
+PAYLOADS = {
+    VaubanOpcodes.MSG_SEND_BIP : ((1, 1), (500, 2), (2, 1)),
+    VaubanOpcodes.MSG_SEND_LED : ((255, 2), (128, 2), (0, 2), (500, 2), (3, 1)),
+    VaubanOpcodes.MSG_SEND_ENROLLMENT : ((1, 1),),
+    VaubanOpcodes.MSG_SEND_FINGERPRINT_DEFINE : ((1, 1),),
+    VaubanOpcodes.MSG_SEND_POLLING : (),
+}
+
+def buildEnrollmentStream(pDeviceId, pCount, pSeed = 42):
+
+    lRandom = random.Random(pSeed)
+    lStream = bytearray()
+
+    for lI in range(pCount):
+        lCardId = b'%08X' % lRandom.getrandbits(32)
+        lStream += encodeVaubanFrame(pDeviceId, ord('E'), b'S' + lCardId)
+
+    return bytes(lStream)
+
+######################################################
+##
+##   ( name, function, number ) cases, frames are
+##   built from the device ID each call ( packet,
+##     pushData() and finalizePacket() )
+##
+######################################################
+
+def cases(pScale = 1.0):
+
+    lDevice = FakeVaubanDevice()
+    lHandler = VaubanOpcodeHandler()
+
+    for lOpcode, lFields in PAYLOADS.items():
+
+        def lBuild(pOpcode = lOpcode, pFields = lFields):
+
+            lPacket = VaubanPacket(device=lDevice, opcode=pOpcode)
+
+            for lValue, lSize in pFields:
+                lPacket.pushData(lValue, lSize)
+
+            return lPacket.finalizePacket()
+
+        yield ('vauban.finalizePacket.' + lOpcode.name, lBuild, int(20000 * pScale) or 1)
+
+    # enrollment answers read back from the fake serial port
+    lDevice.device.feed(buildEnrollmentStream(lDevice.deviceId, 256))
+    lFrames = lDevice.parser.feed(lDevice.device.read(lDevice.device.in_waiting))
+    lLegacyPackets = [ lDevice.parser.toLegacyPacket(lFrame) for lFrame in lFrames ]
+    lCursor = [0]
+
+    # decodePacket() and handlingEnrollementPacket() print on every call
+    lNull = io.StringIO()
+
+    def lLegacyDecode():
+
+        lCursor[0] = (lCursor[0] + 1) % len(lLegacyPackets)
+
+        with redirect_stdout(lNull):
+            lResult = lHandler.handlingEnrollementPacket(VaubanPacket(packet=lLegacyPackets[ lCursor[0] ]))
+
+        lNull.seek(0)
+        lNull.truncate()
+
+        return lResult
+
+    def lFrameDecode():
+        lCursor[0] = (lCursor[0] + 1) % len(lFrames)
+        return lHandler.handlingEnrollementPacket(decodeVaubanFrame(lFrames[ lCursor[0] ]))
+
+    lStream = buildEnrollmentStream(lDevice.deviceId, 64)
+    lParser = VaubanFrameParser()
+
+    yield ('vauban.decodePacket+handlingEnrollementPacket', lLegacyDecode, int(10000 * pScale) or 1)
+    yield ('vauban.decodeVaubanFrame+handlingEnrollementPacket', lFrameDecode, int(20000 * pScale) or 1)
+    yield ('vauban.parser.feed.64frames', lambda: lParser.feed(lStream), int(500 * pScale) or 1)
+
+    return
@@ -0,0 +1,549 @@
+﻿######################################################
+##
+##   Simulated Vauban readers behind pseudo
+##   terminals : polling replies, enrollment ( 'E' )
+##    frames and line noise, for load tests of the
+##          gateway without hardware
+##
+##   python Benchmarks/VaubanSimulator.py
+##       [--readers 150] [--rate 1.0] [--noise 0.01]
+##       [--duration 10] [--backend-latency 0.02]
+##
+######################################################
+
+import argparse
+import heapq
+import os
+import pty
+import random
+import selectors
+import sys
+import time
+import tty
+from collections import deque
+from threading import Thread, Lock, Event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Packet import VaubanOpcodes, VaubanFrameParser, encodeVaubanFrame, decodeVaubanFrame
+from VaubanMetrics import VaubanTimingStats
+
+NOISE_XOR = 'xor'
+NOISE_TRUNCATE = 'truncate'
+NOISE_GARBAGE = 'garbage'
+
+######################################################
+##
+##   One reader : the master side of a pty, the
+##      gateway opens the slave side interface
+##
+######################################################
+
+class SimulatedReader(object):
+
+    mDeviceId = 0
+    mMaster = -1
+    mSlave = -1
+    mInterface = ""
+    mParser = None
+    mOutput = None
+    mAccessPending = None
+
+    mPollsAnswered = 0
+    mEnrollmentsSent = 0
+    mRequestsAnswered = 0
+    mRepliesReceived = 0
+
+    def __init__(self, pDeviceId):
+
+        self.mDeviceId = pDeviceId
+        self.mMaster, self.mSlave = pty.openpty()
+
+        # raw mode : no echo, no line discipline on the frames
+        tty.setraw(self.mSlave)
+        os.set_blocking(self.mMaster, False)
+
+        self.mInterface = os.ttyname(self.mSlave)
+        self.mParser = VaubanFrameParser()
+        self.mOutput = bytearray()
+
+        # emission time of enrollments waiting for an access reply
+        self.mAccessPending = deque()
+
+        return
+
+    def close(self):
+
+        os.close(self.mMaster)
+        os.close(self.mSlave)
+
+        return
+
+    @property
+    def deviceId(self):
+        return self.mDeviceId
+
+    @property
+    def interface(self):
+        return self.mInterface
+
+
+######################################################
+##
+##   Every reader is served by one selector thread,
+##    spontaneous enrollments follow a Poisson
+##         process of pEnrollmentRate / s
+##
+######################################################
+
+class VaubanSimulator(object):
+
+    mReaders = None
+    mByFd = None
+    mRandom = None
+    mCards = None
+    mEnrollmentRate = 1.0
+    mEnrollmentDelay = 0.05
+    mNoiseRate = 0.0
+    mAnswerPolls = True
+
+    mSelector = None
+    mSchedule = None
+    mStopEvent = None
+    mRunThread = None
+    mLock = None
+
+    mFramesSent = 0
+    mBytesSent = 0
+    mNoise = None
+    mAccessLatency = None
+
+    def __init__(self, pReaderCount, pEnrollmentRate = 1.0, pNoiseRate = 0.0, pEnrollmentDelay = 0.05, pCardCount = 1000, pAnswerPolls = True, pFirstDeviceId = 1, pSeed = 42):
+
+        if pReaderCount <= 0:
+            raise NameError("Invalid reader count : " + str(pReaderCount))
+
+        self.mRandom = random.Random(pSeed)
+
+        # a bounded card pool, so the access cache gets hits
+        self.mCards = [ b'%08X' % self.mRandom.getrandbits(32) for lI in range(max(1, pCardCount)) ]
+
+        self.mEnrollmentRate = pEnrollmentRate
+        self.mEnrollmentDelay = pEnrollmentDelay
+        self.mNoiseRate = pNoiseRate
+        self.mAnswerPolls = pAnswerPolls
+
+        self.mReaders = [ SimulatedReader(pFirstDeviceId + lI) for lI in range(pReaderCount) ]
+        self.mByFd = { lReader.mMaster : lReader for lReader in self.mReaders }
+
+        self.mSelector = selectors.DefaultSelector()
+        self.mSchedule = []
+        self.mStopEvent = Event()
+        self.mLock = Lock()
+        self.mNoise = { NOISE_XOR : 0, NOISE_TRUNCATE : 0, NOISE_GARBAGE : 0 }
+        self.mAccessLatency = VaubanTimingStats(65536)
+
+        return
+
+    ######################################################
+	##
+	##            Start simulator async thread
+	##
+	######################################################
+
+    def start(self):
+
+        lNow = time.monotonic()
+
+        for lReader in self.mReaders:
+
+            self.mSelector.register(lReader.mMaster, selectors.EVENT_READ)
+
+            if self.mEnrollmentRate > 0:
+                heapq.heappush(self.mSchedule, (lNow + self.mRandom.expovariate(self.mEnrollmentRate), lReader.mDeviceId, lReader, None))
+
+        self.mStopEvent.clear()
+
+        self.mRunThread = Thread(target=self._simulationService)
+        self.mRunThread.daemon = True
+        self.mRunThread.start()
+
+        return
+
+    def stop(self):
+
+        self.mStopEvent.set()
+
+        if self.mRunThread is not None:
+            self.mRunThread.join()
+            self.mRunThread = None
+
+        return
+
+    def close(self):
+
+        self.stop()
+        self.mSelector.close()
+
+        for lReader in self.mReaders:
+            lReader.close()
+
+        return
+
+    def _simulationService(self):
+
+        while self.mStopEvent.is_set() == False:
+
+            lNow = time.monotonic()
+
+            # spontaneous and requested enrollments due now
+            while len(self.mSchedule) > 0 and self.mSchedule[0][0] <= lNow:
+
+                lDue, lDeviceId, lReader, lCard = heapq.heappop(self.mSchedule)
+
+                self.sendEnrollment(lReader, lCard)
+
+                if lCard is None:
+                    heapq.heappush(self.mSchedule, (lNow + self.mRandom.expovariate(self.mEnrollmentRate), lDeviceId, lReader, None))
+
+            lTimeout = 0.1 if len(self.mSchedule) == 0 else min(0.1, max(0.0, self.mSchedule[0][0] - time.monotonic()))
+
+            for lKey, lEvents in self.mSelector.select(lTimeout):
+
+                lReader = self.mByFd[ lKey.fd ]
+
+                if lEvents & selectors.EVENT_READ:
+                    self._onReadable(lReader)
+
+                if lEvents & selectors.EVENT_WRITE:
+                    self._flush(lReader)
+
+        return
+
+    ######################################################
+	##
+	##       Requests written by the gateway
+	##
+	######################################################
+
+    def _onReadable(self, pReader):
+
+        try:
+            lData = os.read(pReader.mMaster, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            # slave side not opened yet or closed
+            return
+
+        for lFrame in pReader.mParser.feed(lData):
+
+            try:
+                lRequest = decodeVaubanFrame(lFrame)
+            except NameError:
+                continue
+
+            lOpcode = ord(lRequest.opcode)
+
+            if lOpcode == VaubanOpcodes.MSG_SEND_POLLING.value:
+
+                if self.mAnswerPolls == True:
+                    pReader.mPollsAnswered += 1
+                    self.send(pReader, ord('P'), b'')
+
+            elif lOpcode == VaubanOpcodes.MSG_SEND_ENROLLMENT.value:
+
+                pReader.mRequestsAnswered += 1
+                lCard = self.mRandom.choice(self.mCards)
+
+                heapq.heappush(self.mSchedule, (time.monotonic() + self.mEnrollmentDelay, pReader.mDeviceId, pReader, lCard))
+
+            # led reply of the access check, the buzzer follows
+            elif lOpcode == VaubanOpcodes.MSG_SEND_LED.value:
+
+                pReader.mRepliesReceived += 1
+
+                if len(pReader.mAccessPending) > 0:
+
+                    lLatency = time.monotonic() - pReader.mAccessPending.popleft()
+
+                    with self.mLock:
+                        self.mAccessLatency.record(lLatency)
+
+        return
+
+    ######################################################
+	##
+	##   Queue a frame to the gateway, noise is added
+	##    at pNoiseRate per frame. Return False when
+	##   the noise makes the frame undecodable ( XOR,
+	##     truncation ), garbage before STX is not
+	##
+	######################################################
+
+    def send(self, pReader, pOpcode, pPayload):
+
+        lFrame = encodeVaubanFrame(pReader.mDeviceId, pOpcode, pPayload)
+        lNoise = None
+
+        if self.mNoiseRate > 0 and self.mRandom.random() < self.mNoiseRate:
+            lNoise = self.addNoise(lFrame)
+
+        pReader.mOutput += lFrame
+
+        self.mFramesSent += 1
+        self.mBytesSent += len(lFrame)
+
+        self._flush(pReader)
+
+        return lNoise is None or lNoise == NOISE_GARBAGE
+
+    def sendEnrollment(self, pReader, pCard = None):
+
+        if pCard is None:
+            pCard = self.mRandom.choice(self.mCards)
+
+        pReader.mEnrollmentsSent += 1
+
+        lSentAt = time.monotonic()
+
+        # a corrupted enrollment never gets a reply, replies are
+        # matched in order with the pending ones
+        if self.send(pReader, ord('E'), b'S' + pCard) == True:
+            pReader.mAccessPending.append(lSentAt)
+
+        return
+
+    # corrupt pFrame in place, return the kind of noise
+    def addNoise(self, pFrame):
+
+        lKind = self.mRandom.choice((NOISE_XOR, NOISE_TRUNCATE, NOISE_GARBAGE))
+        self.mNoise[ lKind ] += 1
+
+        if lKind == NOISE_XOR:
+
+            # flip a low bit between STX and the control frame
+            lIndex = self.mRandom.randrange(1, len(pFrame) - 3)
+            pFrame[ lIndex ] ^= 0x01
+
+        elif lKind == NOISE_TRUNCATE:
+            del pFrame[ self.mRandom.randrange(2, len(pFrame)): ]
+
+        else:
+            pFrame[0:0] = bytes(self.mRandom.choice(b'0123456789ABCDEF\xff\x00') for lI in range(self.mRandom.randrange(1, 8)))
+
+        return lKind
+
+    def _flush(self, pReader):
+
+        if len(pReader.mOutput) == 0:
+            return
+
+        try:
+            lWritten = os.write(pReader.mMaster, pReader.mOutput)
+        except (BlockingIOError, InterruptedError):
+            lWritten = 0
+
+        del pReader.mOutput[:lWritten]
+
+        # gateway lagging behind, wait for the pty to drain
+        lEvents = selectors.EVENT_READ | (selectors.EVENT_WRITE if len(pReader.mOutput) > 0 else 0)
+
+        if self.mSelector.get_key(pReader.mMaster).events != lEvents:
+            self.mSelector.modify(pReader.mMaster, lEvents)
+
+        return
+
+    ######################################################
+	##
+	##                 Statistics
+	##
+	######################################################
+
+    def getStats(self):
+
+        with self.mLock:
+            lLatency = self.mAccessLatency.getStats()
+
+        return {
+            'readers' : len(self.mReaders),
+            'frames_sent' : self.mFramesSent,
+            'bytes_sent' : self.mBytesSent,
+            'polls_answered' : sum(lReader.mPollsAnswered for lReader in self.mReaders),
+            'enrollments_sent' : sum(lReader.mEnrollmentsSent for lReader in self.mReaders),
+            'enrollment_requests' : sum(lReader.mRequestsAnswered for lReader in self.mReaders),
+            'access_replies' : sum(lReader.mRepliesReceived for lReader in self.mReaders),
+            'noise' : dict(self.mNoise),
+            'access_latency' : lLatency,
+        }
+
+    @property
+    def readers(self):
+        return self.mReaders
+
+
+######################################################
+##
+##    Stand-in for the access backend, even card IDs
+##              are granted
+##
+######################################################
+
+class FakeAccessClient(object):
+
+    def __init__(self, pLatency = 0.02):
+        self.mLatency = pLatency
+
+    def checkAccess(self, pCardId, pInterface):
+
+        time.sleep(self.mLatency)
+
+        return int(pCardId[-1], 16) % 2 == 0
+
+
+######################################################
+##
+##   Simulator child process, the pty and select()
+##   load stays off the gateway process : interfaces
+##   are sent back, then 'start', 'stop' and 'close'
+##   commands ( ptys stay open until the gateway has
+##             closed its devices )
+##
+######################################################
+
+def simulatorProcess(pConnection, pReaders, pRate, pNoise):
+
+    lSimulator = VaubanSimulator(pReaders, pRate, pNoise)
+
+    pConnection.send([ (lReader.interface, lReader.deviceId) for lReader in lSimulator.readers ])
+
+    pConnection.recv()
+    lSimulator.start()
+
+    pConnection.recv()
+    lSimulator.stop()
+
+    pConnection.send(lSimulator.getStats())
+
+    pConnection.recv()
+    lSimulator.close()
+
+    return
+
+
+######################################################
+##
+##   End to end run : one VaubanDevice per simulated
+##   reader, frames go through _readService and the
+##   processPacket -> access check pipeline, led
+##      replies close the latency measurement
+##
+######################################################
+
+def run(pReaders = 150, pRate = 1.0, pNoise = 0.0, pDuration = 10.0, pBackendLatency = 0.02, pWorkers = 8, pPollRate = 0.0):
+
+    from multiprocessing import Process, Pipe
+
+    from Packet import VaubanDevice, VaubanOpcodeHandler
+    from VaubanAccess import VaubanAccessDispatcher
+    from VaubanPollingScheduler import VaubanPollingScheduler
+
+    lConnection, lChildConnection = Pipe()
+
+    lProcess = Process(target=simulatorProcess, args=(lChildConnection, pReaders, pRate, pNoise))
+    lProcess.daemon = True
+    lProcess.start()
+
+    lDispatcher = VaubanAccessDispatcher(pWorkers=pWorkers, pMaxPending=max(pWorkers, 4 * pWorkers), pClient=FakeAccessClient(pBackendLatency))
+    lHandler = VaubanOpcodeHandler(pAccessDispatcher=lDispatcher)
+    lDevices = []
+    lCallbacks = [0]
+    lCallbackLock = Lock()
+
+    for lInterface, lDeviceId in lConnection.recv():
+
+        lDevice = VaubanDevice(lInterface, lDeviceId)
+        lDevice.enableMetrics()
+
+        def lCallback(pPacket, pDevice = lDevice):
+
+            with lCallbackLock:
+                lCallbacks[0] += 1
+
+            lHandler.processPacket(pPacket, pDevice)
+
+        lDevice.startReadService(lCallback, True)
+        lDevices.append(lDevice)
+
+    lScheduler = None
+
+    if pPollRate > 0:
+
+        lScheduler = VaubanPollingScheduler(pRate=pPollRate)
+
+        for lDevice in lDevices:
+            lScheduler.registerDevice(lDevice)
+
+    lConnection.send('start')
+
+    if lScheduler is not None:
+        lScheduler.start()
+
+    lStart = time.monotonic()
+    time.sleep(pDuration)
+
+    if lScheduler is not None:
+        lScheduler.stop()
+
+    lConnection.send('stop')
+    lStats = lConnection.recv()
+    lElapsed = time.monotonic() - lStart
+
+    # let the read threads drain what is still buffered
+    time.sleep(0.5)
+
+    for lDevice in lDevices:
+        lDevice.stopReadService()
+        lDevice.device.close()
+
+    lDispatcher.shutdown()
+
+    lConnection.send('close')
+    lProcess.join()
+
+    lLinks = [ lDevice.metrics.getStats() for lDevice in lDevices ]
+    lFramesIn = sum(lLink['frames_in'] for lLink in lLinks)
+
+    print("%d readers, %.1fs : %d frames sent ( %.0f frames/s, %.0f B/s ), noise %s" % (
+        pReaders, lElapsed, lStats['frames_sent'], lStats['frames_sent'] / lElapsed, lStats['bytes_sent'] / lElapsed, lStats['noise']))
+
+    print("gateway : %d frames decoded ( %.0f frames/s ), %d callbacks, %d xor failures, %d frames dropped, %d bytes dropped" % (
+        lFramesIn, lFramesIn / lElapsed, lCallbacks[0],
+        sum(lLink['xor_failures'] for lLink in lLinks), sum(lLink['frames_dropped'] for lLink in lLinks), sum(lLink['bytes_dropped'] for lLink in lLinks)))
+
+    print("access : %d enrollments, %d replies, latency p50 %.1f ms p99 %.1f ms max %.1f ms" % (
+        lStats['enrollments_sent'], lStats['access_replies'],
+        lStats['access_latency']['p50_ms'], lStats['access_latency']['p99_ms'], lStats['access_latency']['max_ms']))
+
+    print("dispatcher : %s" % lDispatcher.getStats())
+
+    if pPollRate > 0:
+        print("polling : %d polls answered" % lStats['polls_answered'])
+
+    return lStats, lLinks
+
+
+if __name__ == '__main__':
+
+    lParser = argparse.ArgumentParser(description="Simulated Vauban readers load test")
+    lParser.add_argument('--readers', type=int, default=150)
+    lParser.add_argument('--rate', type=float, default=1.0, help="enrollments per reader per second")
+    lParser.add_argument('--noise', type=float, default=0.0, help="probability of corrupting a frame")
+    lParser.add_argument('--duration', type=float, default=10.0)
+    lParser.add_argument('--backend-latency', type=float, default=0.02)
+    lParser.add_argument('--workers', type=int, default=8)
+    lParser.add_argument('--poll-rate', type=float, default=0.0, help="polls per second, 0 disables polling")
+
+    lArgs = lParser.parse_args()
+
+    run(lArgs.readers, lArgs.rate, lArgs.noise, lArgs.duration, lArgs.backend_latency, lArgs.workers, lArgs.poll_rate)
@@ -0,0 +1,526 @@
+﻿######################################################
+##
+##   WebSocket load generator and latency profiler :
+##   one server process built by createWebsocketServer
+##   and client processes opening many connections,
+##   clients are joined to channels on connect and
+##     sendToChannel broadcasts carry their send
+##    time, so every client measures the fan-out
+##
+##   python Benchmarks/WebsocketLoad.py
+##       [--connections 10000] [--processes 4]
+##       [--channels 10] [--rounds 20] [--interval 0.5]
+##       [--backend select|asyncio] [--ssl cert key]
+##       [--output results.json]
+##
+######################################################
+
+import argparse
+import asyncio
+import base64
+import os
+import resource
+import ssl
+import struct
+import time
+from multiprocessing import Process, Pipe
+from threading import Thread, Lock
+
+# broadcast payload : magic, round, send time ( time.monotonic()
+# is system wide on Linux, so it can be compared across processes )
+LOAD_MAGIC = b'LDT1'
+LOAD_HEADER = struct.Struct('>4sId')
+
+######################################################
+##
+##                    Helpers
+##
+######################################################
+
+def raiseFileLimit():
+
+    lSoft, lHard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if lHard == resource.RLIM_INFINITY or lHard > lSoft:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (lHard, lHard))
+
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+def readRss():
+
+    with open('/proc/self/status', 'r') as lFile:
+        for lLine in lFile:
+            if lLine.startswith('VmRSS:'):
+                return int(lLine.split()[1]) * 1024
+
+    return 0
+
+def percentiles(pValues):
+
+    lValues = sorted(pValues)
+    lCount = len(lValues)
+
+    if lCount == 0:
+        return { 'count' : 0, 'p50_ms' : 0.0, 'p90_ms' : 0.0, 'p99_ms' : 0.0, 'max_ms' : 0.0 }
+
+    return {
+        'count' : lCount,
+        'p50_ms' : lValues[ lCount // 2 ] * 1000.0,
+        'p90_ms' : lValues[ min(lCount - 1, (lCount * 90) // 100) ] * 1000.0,
+        'p99_ms' : lValues[ min(lCount - 1, (lCount * 99) // 100) ] * 1000.0,
+        'max_ms' : lValues[-1] * 1000.0,
+    }
+
+def channelName(pIndex):
+    return 'LOAD_' + str(pIndex)
+
+
+######################################################
+##
+##   Server process : joins every accepted client to
+##    channel socketId % pChannels, then broadcasts
+##           when asked by the coordinator
+##
+######################################################
+
+def serverProcess(pConnection, pOptions):
+
+    raiseFileLimit()
+
+    from django.conf import settings
+
+    if pOptions.backend is not None:
+        settings.WEBSOCKET_BACKEND = pOptions.backend
+
+    from websocket.WebsocketServer import createWebsocketServer
+    from websocket.ChannelHandler.Channel import ChannelHandler, ChannelRegistry
+
+    lCertfile, lKeyfile = pOptions.ssl if pOptions.ssl is not None else (None, None)
+
+    lRssStart = readRss()
+    lServer = createWebsocketServer(pOptions.port, pOptions.host, lCertfile, lKeyfile)
+
+    if pOptions.notify_window_ms is not None:
+        ChannelHandler.setNotifyWindow(pOptions.notify_window_ms)
+
+    lCounters = { 'rejected' : 0 }
+    lLock = Lock()
+    lConnect = lServer.onClientConnect
+
+    def lJoinOnConnect(pSocket):
+
+        lConnect(pSocket)
+
+        # over WEBSOCKET_SERVER_CAPACITY
+        if lServer.clientList.get(pSocket.socketId) is not pSocket:
+
+            with lLock:
+                lCounters['rejected'] += 1
+
+            return
+
+        ChannelRegistry.get(channelName(pSocket.socketId % pOptions.channels)).tryJoin(pSocket)
+
+        return
+
+    lServer.onClientConnect = lJoinOnConnect
+
+    lThread = Thread(target=lServer.serveforever)
+    lThread.daemon = True
+    lThread.start()
+
+    lRssIdle = readRss()
+
+    pConnection.send('ready')
+
+    lExpected = pConnection.recv()
+
+    # wait for the select / asyncio loop to accept every handshaked client
+    lDeadline = time.monotonic() + 30.0
+
+    while len(lServer.clientList) < lExpected and time.monotonic() < lDeadline:
+        time.sleep(0.1)
+
+    # join notifications settle before memory is read
+    time.sleep(pOptions.settle)
+
+    lConnections = len(lServer.clientList)
+    lRssLoaded = readRss()
+
+    lPadding = b'\x00' * max(0, pOptions.payload - LOAD_HEADER.size)
+    lCallTimes = []
+    lRecipients = 0
+
+    for lRound in range(pOptions.rounds):
+
+        for lIndex in range(pOptions.channels):
+
+            lHandler = ChannelRegistry.find(channelName(lIndex))
+
+            if lHandler is None:
+                continue
+
+            lMembers = lHandler.getMemberList()
+
+            if len(lMembers) == 0:
+                continue
+
+            lSender = lServer.clientList.get(lMembers[0])
+
+            if lSender is None:
+                continue
+
+            lStart = time.perf_counter()
+            lServer.sendToChannel(LOAD_HEADER.pack(LOAD_MAGIC, lRound, time.monotonic()) + lPadding, lSender, channelName(lIndex))
+            lCallTimes.append(time.perf_counter() - lStart)
+
+            lRecipients += len(lMembers) - 1
+
+        time.sleep(pOptions.interval)
+
+    lStats = {
+        'backend' : type(lServer).__name__,
+        'capacity' : lServer.capacity,
+        'connections' : lConnections,
+        'rejected' : lCounters['rejected'],
+        'rss_start' : lRssStart,
+        'rss_idle' : lRssIdle,
+        'rss_loaded' : lRssLoaded,
+        'memory_per_connection' : float(lRssLoaded - lRssIdle) / lConnections if lConnections > 0 else 0.0,
+        'expected_deliveries' : lRecipients,
+        'send_to_channel' : percentiles(lCallTimes),
+        'broadcast' : lServer.broadcastStats.getStats() if hasattr(lServer, 'broadcastStats') else None,
+        'outbound' : lServer.outboundGuard.getStats(),
+        'handshake' : lServer.handshakeStats.getStats() if getattr(lServer, 'handshakeStats', None) is not None else None,
+    }
+
+    pConnection.send(lStats)
+    pConnection.recv()
+
+    return
+
+
+######################################################
+##
+##         Minimal asyncio websocket client
+##
+######################################################
+
+class LoadClientStats(object):
+
+    def __init__(self):
+
+        self.connectTimes = []
+        self.failures = {}
+        self.latencies = []
+        self.received = 0
+        self.other = 0
+        self.closed = 0
+
+    def addFailure(self, pException):
+        lName = type(pException).__name__
+        self.failures[ lName ] = self.failures.get(lName, 0) + 1
+
+
+def encodeClientFrame(pOpcode, pPayload):
+
+    # client frames are masked, a zero mask keeps the payload as is
+    lLength = len(pPayload)
+
+    if lLength < 126:
+        lHeader = struct.pack('>BB', 0x80 | pOpcode, 0x80 | lLength)
+    elif lLength < 65536:
+        lHeader = struct.pack('>BBH', 0x80 | pOpcode, 0x80 | 126, lLength)
+    else:
+        lHeader = struct.pack('>BBQ', 0x80 | pOpcode, 0x80 | 127, lLength)
+
+    return lHeader + b'\x00\x00\x00\x00' + pPayload
+
+async def openConnection(pHost, pPort, pSslContext):
+
+    lStart = time.monotonic()
+
+    lReader, lWriter = await asyncio.open_connection(pHost, pPort, ssl=pSslContext, server_hostname=pHost if pSslContext is not None else None)
+
+    lKey = base64.b64encode(os.urandom(16)).decode()
+
+    lWriter.write((
+        "GET / HTTP/1.1\r\n"
+        "Host: %s:%d\r\n"
+        "Upgrade: websocket\r\n"
+        "Connection: Upgrade\r\n"
+        "Sec-WebSocket-Key: %s\r\n"
+        "Sec-WebSocket-Version: 13\r\n\r\n" % (pHost, pPort, lKey)).encode())
+
+    lHeader = await lReader.readuntil(b'\r\n\r\n')
+
+    if b' 101 ' not in lHeader.split(b'\r\n', 1)[0]:
+        lWriter.close()
+        raise ConnectionError("upgrade refused")
+
+    return lReader, lWriter, time.monotonic() - lStart
+
+async def readService(pReader, pWriter, pStats):
+
+    try:
+
+        while True:
+
+            lHead = await pReader.readexactly(2)
+            lOpcode = lHead[0] & 0x0F
+            lLength = lHead[1] & 0x7F
+
+            if lLength == 126:
+                lLength = struct.unpack('>H', await pReader.readexactly(2))[0]
+            elif lLength == 127:
+                lLength = struct.unpack('>Q', await pReader.readexactly(8))[0]
+
+            if lHead[1] & 0x80:
+                await pReader.readexactly(4)
+
+            lPayload = await pReader.readexactly(lLength)
+
+            if lOpcode == 0x2 and lPayload[:4] == LOAD_MAGIC:
+                pStats.latencies.append(time.monotonic() - LOAD_HEADER.unpack_from(lPayload)[2])
+                pStats.received += 1
+
+            elif lOpcode == 0x8:
+                break
+
+            elif lOpcode == 0x9:
+                pWriter.write(encodeClientFrame(0xA, lPayload))
+
+            else:
+                pStats.other += 1
+
+    except (asyncio.IncompleteReadError, ConnectionError, OSError):
+        pass
+
+    pStats.closed += 1
+
+    return
+
+async def clientMain(pConnection, pOptions, pCount):
+
+    lLoop = asyncio.get_running_loop()
+    lStats = LoadClientStats()
+    lWriters = []
+    lReaders = []
+    lSlots = asyncio.Semaphore(pOptions.concurrency)
+
+    lSslContext = None
+
+    if pOptions.ssl is not None:
+        lSslContext = ssl.create_default_context()
+        lSslContext.check_hostname = False
+        lSslContext.verify_mode = ssl.CERT_NONE
+
+    async def lConnect():
+
+        async with lSlots:
+
+            try:
+                lReader, lWriter, lElapsed = await asyncio.wait_for(openConnection(pOptions.host, pOptions.port, lSslContext), pOptions.timeout)
+            except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as lException:
+                lStats.addFailure(lException)
+                return
+
+        lStats.connectTimes.append(lElapsed)
+        lWriters.append(lWriter)
+        lReaders.append(asyncio.ensure_future(readService(lReader, lWriter, lStats)))
+
+        return
+
+    # pOptions.connect_rate is shared by every client process
+    lRate = pOptions.connect_rate / pOptions.processes if pOptions.connect_rate > 0 else 0
+    lTasks = []
+    lStart = time.monotonic()
+
+    for lI in range(pCount):
+
+        if lRate > 0:
+            await asyncio.sleep(max(0.0, lStart + lI / lRate - time.monotonic()))
+
+        lTasks.append(asyncio.ensure_future(lConnect()))
+
+    await asyncio.gather(*lTasks)
+
+    await lLoop.run_in_executor(None, pConnection.send, {
+        'connected' : len(lStats.connectTimes),
+        'failures' : dict(lStats.failures),
+        'elapsed' : time.monotonic() - lStart,
+        'connect_times' : lStats.connectTimes,
+    })
+
+    # broadcasts run on the server, report when asked
+    await lLoop.run_in_executor(None, pConnection.recv)
+
+    await lLoop.run_in_executor(None, pConnection.send, {
+        'latencies' : lStats.latencies,
+        'received' : lStats.received,
+        'other' : lStats.other,
+        'closed' : lStats.closed,
+    })
+
+    await lLoop.run_in_executor(None, pConnection.recv)
+
+    for lWriter in lWriters:
+        lWriter.close()
+
+    for lReader in lReaders:
+        lReader.cancel()
+
+    return
+
+def clientProcess(pConnection, pOptions, pCount):
+
+    raiseFileLimit()
+    asyncio.run(clientMain(pConnection, pOptions, pCount))
+
+    return
+
+
+######################################################
+##
+##                   Coordinator
+##
+######################################################
+
+def run(pOptions):
+
+    lServerConnection, lChildConnection = Pipe()
+
+    lServer = Process(target=serverProcess, args=(lChildConnection, pOptions))
+    lServer.daemon = True
+    lServer.start()
+
+    if lServerConnection.recv() != 'ready':
+        raise NameError("Server process failed to start")
+
+    lClients = []
+
+    for lI in range(pOptions.processes):
+
+        lCount = pOptions.connections // pOptions.processes + (1 if lI < pOptions.connections % pOptions.processes else 0)
+        lConnection, lChildConnection = Pipe()
+
+        lProcess = Process(target=clientProcess, args=(lChildConnection, pOptions, lCount))
+        lProcess.daemon = True
+        lProcess.start()
+
+        lClients.append((lProcess, lConnection))
+
+    lConnectReports = [ lConnection.recv() for lProcess, lConnection in lClients ]
+    lConnected = sum(lReport['connected'] for lReport in lConnectReports)
+    lConnectElapsed = max(lReport['elapsed'] for lReport in lConnectReports)
+    lFailures = {}
+
+    for lReport in lConnectReports:
+        for lName, lCount in lReport['failures'].items():
+            lFailures[ lName ] = lFailures.get(lName, 0) + lCount
+
+    lServerConnection.send(lConnected)
+    lServerStats = lServerConnection.recv()
+
+    # in-flight broadcasts reach the clients
+    time.sleep(max(1.0, pOptions.interval * 2))
+
+    for lProcess, lConnection in lClients:
+        lConnection.send('report')
+
+    lReports = [ lConnection.recv() for lProcess, lConnection in lClients ]
+
+    for lProcess, lConnection in lClients:
+        lConnection.send('close')
+        lProcess.join(10)
+
+    lServerConnection.send('close')
+    lServer.join(10)
+
+    lReceived = sum(lReport['received'] for lReport in lReports)
+
+    lResults = {
+        'options' : {
+            'connections' : pOptions.connections, 'processes' : pOptions.processes, 'channels' : pOptions.channels,
+            'rounds' : pOptions.rounds, 'interval' : pOptions.interval, 'payload' : pOptions.payload,
+            'ssl' : pOptions.ssl is not None, 'connect_rate' : pOptions.connect_rate,
+        },
+        'connected' : lConnected,
+        'connect_failures' : lFailures,
+        'connect_rate' : lConnected / lConnectElapsed if lConnectElapsed > 0 else 0.0,
+        'connect_latency' : percentiles([ lTime for lReport in lConnectReports for lTime in lReport['connect_times'] ]),
+        'fanout_latency' : percentiles([ lLatency for lReport in lReports for lLatency in lReport['latencies'] ]),
+        'delivered' : lReceived,
+        'other_frames' : sum(lReport['other'] for lReport in lReports),
+        'delivery_ratio' : float(lReceived) / lServerStats['expected_deliveries'] if lServerStats['expected_deliveries'] > 0 else 0.0,
+        'dropped_by_server' : sum(lReport['closed'] for lReport in lReports),
+        'server' : lServerStats,
+    }
+
+    printResults(lResults)
+
+    if pOptions.output is not None:
+        from BenchmarkHarness import saveResults
+        saveResults(pOptions.output, lResults)
+
+    return lResults
+
+def printResults(pResults):
+
+    lServer = pResults['server']
+
+    # rejected clients complete the upgrade before the server full notification
+    print("%s : %d / %d upgraded in %.0f conn/s, connect p50 %.1f ms p99 %.1f ms, failures %s, %d registered, %d rejected by server" % (
+        lServer['backend'], pResults['connected'], pResults['options']['connections'], pResults['connect_rate'],
+        pResults['connect_latency']['p50_ms'], pResults['connect_latency']['p99_ms'], pResults['connect_failures'], lServer['connections'], lServer['rejected']))
+
+    print("fan-out : %d / %d delivered ( %.1f%% ), latency p50 %.1f ms p90 %.1f ms p99 %.1f ms max %.1f ms" % (
+        pResults['delivered'], lServer['expected_deliveries'], pResults['delivery_ratio'] * 100.0,
+        pResults['fanout_latency']['p50_ms'], pResults['fanout_latency']['p90_ms'], pResults['fanout_latency']['p99_ms'], pResults['fanout_latency']['max_ms']))
+
+    # join / leave notifications compete with broadcasts for the send queues
+    print("outbound : %d other frames received, %d frames dropped by the queue guard, %d slow consumers, %d evictions" % (
+        pResults['other_frames'], lServer['outbound']['dropped'], lServer['outbound']['slow_consumers'], lServer['outbound']['evictions']))
+
+    print("sendToChannel call : p50 %.2f ms p99 %.2f ms max %.2f ms" % (
+        lServer['send_to_channel']['p50_ms'], lServer['send_to_channel']['p99_ms'], lServer['send_to_channel']['max_ms']))
+
+    print("memory : %.1f MB idle, %.1f MB loaded, %.1f KB per connection ( user space RSS only )" % (
+        lServer['rss_idle'] / 1048576.0, lServer['rss_loaded'] / 1048576.0, lServer['memory_per_connection'] / 1024.0))
+
+    if lServer['capacity'] > 0:
+        print("WEBSOCKET_SERVER_CAPACITY %d : ~%.0f MB at full capacity" % (
+            lServer['capacity'], (lServer['rss_idle'] + lServer['memory_per_connection'] * lServer['capacity']) / 1048576.0))
+
+    if lServer['handshake'] is not None:
+        print("tls handshakes : %s" % lServer['handshake'])
+
+    return
+
+
+if __name__ == '__main__':
+
+    lParser = argparse.ArgumentParser(description="WebSocket server load generator")
+    lParser.add_argument('--host', default='127.0.0.1')
+    lParser.add_argument('--port', type=int, default=9300)
+    lParser.add_argument('--backend', choices=('select', 'asyncio'), default=None, help="overrides settings.WEBSOCKET_BACKEND")
+    lParser.add_argument('--ssl', nargs=2, metavar=('CERTFILE', 'KEYFILE'), default=None)
+    lParser.add_argument('--connections', type=int, default=10000)
+    lParser.add_argument('--processes', type=int, default=4, help="client processes")
+    lParser.add_argument('--concurrency', type=int, default=256, help="pending connects per client process")
+    lParser.add_argument('--connect-rate', type=float, default=0.0, help="connects per second, 0 = as fast as possible")
+    lParser.add_argument('--timeout', type=float, default=30.0)
+    lParser.add_argument('--channels', type=int, default=10)
+    lParser.add_argument('--notify-window-ms', type=float, default=None, help="overrides settings.WEBSOCKET_NOTIFICATION_WINDOW_MS")
+    lParser.add_argument('--settle', type=float, default=5.0, help="seconds between the last connect and the first broadcast, raise it for large channels : every join notifies the whole channel")
+    lParser.add_argument('--rounds', type=int, default=20)
+    lParser.add_argument('--interval', type=float, default=0.5)
+    lParser.add_argument('--payload', type=int, default=64)
+    lParser.add_argument('--output', default=None)
+
+    lArgs = lParser.parse_args()
+
+    if raiseFileLimit() < lArgs.connections // max(1, lArgs.processes) + 64:
+        print("warning : open file limit below the connections per client process")
+
+    run(lArgs)
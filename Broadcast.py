@@ -0,0 +1,175 @@
+﻿######################################################
+##
+##     Encode-once websocket broadcast helpers
+##
+######################################################
+
+import struct
+from threading import Lock
+
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+
+######################################################
+##
+##   Build a final, unmasked server frame exactly like
+##       WebSocket.sendMessage() does per client
+##
+######################################################
+
+def encodeFrame(pPayload, pOpcode = None, pRsv = 0):
+
+    if isinstance(pPayload, str):
+        pPayload = pPayload.encode('utf-8')
+
+        if pOpcode is None:
+            pOpcode = OPCODE_TEXT
+
+    if pOpcode is None:
+        pOpcode = OPCODE_BINARY
+
+    lLength = len(pPayload)
+
+    lFirst = 0x80 | pRsv | pOpcode
+
+    if lLength <= 125:
+        lHeader = struct.pack("!BB", lFirst, lLength)
+    elif lLength <= 65535:
+        lHeader = struct.pack("!BBH", lFirst, 126, lLength)
+    else:
+        lHeader = struct.pack("!BBQ", lFirst, 127, lLength)
+
+    return (pOpcode, lHeader + bytes(pPayload))
+
+######################################################
+##
+##   Queue an already framed message on a client, the
+##      same immutable buffer is shared by everyone
+##
+######################################################
+
+def enqueueFrame(pSocket, pOpcode, pFrame, pGuard = None):
+
+    # the asyncio transport applies the server guard itself
+    lEnqueue = getattr(pSocket, 'enqueueFrame', None)
+
+    if lEnqueue is not None:
+        return lEnqueue(pOpcode, pFrame)
+
+    if pGuard is not None and pOpcode < OPCODE_CLOSE and pGuard.admit(pSocket, len(pSocket.sendq)) == False:
+        return False
+
+    pSocket.sendq.append((pOpcode, pFrame))
+
+    return True
+
+######################################################
+##
+##   One broadcast message : framed raw once, and
+##    compressed once per group of connections which
+##      negotiated the same deflate parameters
+##
+######################################################
+
+class BroadcastMessage(object):
+
+    mOpcode = OPCODE_BINARY
+    mPayload = b''
+    mFrame = b''
+    mCompressedFrames = None
+
+    def __init__(self, pPayload, pOpcode = None):
+
+        self.mOpcode, self.mFrame = encodeFrame(pPayload, pOpcode)
+        self.mPayload = pPayload.encode('utf-8') if isinstance(pPayload, str) else pPayload
+        self.mCompressedFrames = {}
+
+        return
+
+    # pDeflate is the PerMessageDeflate of the recipient, or None
+    def frameFor(self, pDeflate):
+
+        if pDeflate is None or len(self.mPayload) < pDeflate.threshold:
+            return self.mFrame
+
+        lKey = pDeflate.sharedKey
+
+        # compressor with context : must compress in send order
+        if lKey is None:
+            return pDeflate.encodeFrame(self.mPayload, self.mOpcode)
+
+        lFrame = self.mCompressedFrames.get(lKey, None)
+
+        if lFrame is None:
+            lFrame = pDeflate.encodeFrame(self.mPayload, self.mOpcode)
+            self.mCompressedFrames[ lKey ] = lFrame
+
+        return lFrame
+
+    @property
+    def opcode(self):
+        return self.mOpcode
+
+    @property
+    def frame(self):
+        return self.mFrame
+
+def enqueueMessage(pSocket, pMessage, pGuard = None):
+
+    # the asyncio transport picks its frame on the loop thread
+    lEnqueue = getattr(pSocket, 'enqueueMessage', None)
+
+    if lEnqueue is not None:
+        return lEnqueue(pMessage)
+
+    return enqueueFrame(pSocket, pMessage.opcode, pMessage.frame, pGuard)
+
+######################################################
+##
+##                Broadcast statistics
+##
+######################################################
+
+class BroadcastStats(object):
+
+    mLock = None
+    mBroadcasts = 0
+    mRecipients = 0
+    mBytesSent = 0
+    mFramesEncoded = 0
+    mLastRecipients = 0
+    mMaxRecipients = 0
+
+    def __init__(self):
+        self.mLock = Lock()
+        return
+
+    def record(self, pRecipients, pFrameSize):
+
+        with self.mLock:
+
+            self.mBroadcasts += 1
+            self.mFramesEncoded += 1
+            self.mRecipients += pRecipients
+            self.mBytesSent += pRecipients * pFrameSize
+            self.mLastRecipients = pRecipients
+
+            if pRecipients > self.mMaxRecipients:
+                self.mMaxRecipients = pRecipients
+
+        return
+
+    def getStats(self):
+
+        with self.mLock:
+
+            return {
+                'broadcasts' : self.mBroadcasts,
+                'frames_encoded' : self.mFramesEncoded,
+                'recipients' : self.mRecipients,
+                'bytes_sent' : self.mBytesSent,
+                'last_recipients' : self.mLastRecipients,
+                'max_recipients' : self.mMaxRecipients,
+                'avg_recipients' : float(self.mRecipients) / self.mBroadcasts if self.mBroadcasts > 0 else 0.0,
+            }
@@ -5,15 +5,324 @@
 ######################################################
 
 from common.utils import SharedVar
+from websocket.Metrics import NULL_METRIC
+from threading import RLock, Timer
+from enum import Enum
 import pickle
 
+######################################################
+##
+##    Multi-entry variant of SMSG_CHANNEL_NOTIFICATION,
+##   used unless common.constants.Network defines its
+##                    own value
+##
+######################################################
+
+class ChannelOpcodes(Enum):
+
+    SMSG_CHANNEL_NOTIFICATION_BATCH = 0xC1
+
+######################################################
+##
+##     Set-backed channel membership, one instance
+##      per channel and a socket -> channels index
+##
+######################################################
+
+class ChannelMembership(object):
+
+    mInstances = {}
+    mSocketChannels = {}
+    mLock = RLock()
+
+    # SharedVar only stores whole values, so bursts of joins / leaves
+    # are coalesced in one write every mSaveInterval seconds
+    mSaveInterval = 0.05
+
+    # several processes writing the same key : merge local changes
+    # into the stored value instead of overwriting it
+    mMergeOnFlush = False
+
+    # SharedVar has no compare-and-set, the read-merge-write of every
+    # writer is serialized by this lock ( acquire / release ) shared by
+    # all the processes, see ChannelRegistry.setConsistencyMode()
+    mStoreLock = None
+
+    mChannelName = ""
+    mMembers = None
+    mAdded = None
+    mRemoved = None
+    mSaveTimer = None
+
+    def __init__(self, pChannelName, pMembers = None):
+
+        self.mChannelName = pChannelName
+        self.mMembers = set()
+        self.mAdded = set()
+        self.mRemoved = set()
+
+        if pMembers is not None:
+            for lSocketId in pMembers:
+                self._add(lSocketId)
+
+        return
+
+    ######################################################
+	##
+	##   Return the live membership of a channel, loaded
+	##          from SharedVar on first access
+	##
+	######################################################
+
+    @classmethod
+    def get(cls, pChannelName):
+
+        with cls.mLock:
+
+            lMembership = cls.mInstances.get(pChannelName, None)
+
+            if lMembership is None:
+
+                lMembers = SharedVar('Core').get("Channel", pChannelName)
+
+                lMembership = ChannelMembership(pChannelName, lMembers)
+                cls.mInstances[ pChannelName ] = lMembership
+
+                if lMembers is None:
+                    lMembership.flush()
+
+            return lMembership
+
+    @classmethod
+    def channelsOf(cls, pSocketId):
+
+        with cls.mLock:
+            return tuple(cls.mSocketChannels.get(pSocketId, ()))
+
+    @classmethod
+    def reset(cls):
+
+        with cls.mLock:
+
+            for lMembership in cls.mInstances.values():
+                lMembership.cancelSave()
+
+            cls.mInstances.clear()
+            cls.mSocketChannels.clear()
+
+        return
+
+    @classmethod
+    def discard(cls, pChannelName):
+
+        with cls.mLock:
+
+            lMembership = cls.mInstances.pop(pChannelName, None)
+
+            if lMembership is None:
+                return
+
+            if lMembership.mSaveTimer is not None:
+                lMembership.cancelSave()
+                lMembership.flush()
+
+        return
+
+    ######################################################
+	##
+	##     Replace local members by the SharedVar ones
+	##
+	######################################################
+
+    def reload(self):
+
+        lMembers = SharedVar('Core').get("Channel", self.mChannelName)
+        lMembers = set() if lMembers is None else set(lMembers)
+
+        with self.mLock:
+
+            # changes not flushed yet win over the stored value
+            self._replace((lMembers | self.mAdded) - self.mRemoved)
+
+        return
+
+    def _replace(self, pMembers):
+
+        with self.mLock:
+
+            for lSocketId in self.mMembers - pMembers:
+
+                lChannels = self.mSocketChannels.get(lSocketId, None)
+
+                if lChannels is not None:
+
+                    lChannels.discard(self.mChannelName)
+
+                    if len(lChannels) == 0:
+                        del self.mSocketChannels[ lSocketId ]
+
+            for lSocketId in pMembers - self.mMembers:
+                self.mSocketChannels.setdefault(lSocketId, set()).add(self.mChannelName)
+
+            self.mMembers = pMembers
+
+        return
+
+    ######################################################
+	##
+	##             O(1) add / remove / lookup
+	##
+	######################################################
+
+    def _add(self, pSocketId):
+
+        if pSocketId in self.mMembers:
+            return False
+
+        self.mMembers.add(pSocketId)
+        self.mSocketChannels.setdefault(pSocketId, set()).add(self.mChannelName)
+
+        return True
+
+    def add(self, pSocketId):
+
+        with self.mLock:
+
+            if self._add(pSocketId) == False:
+                return False
+
+            self.mRemoved.discard(pSocketId)
+            self.mAdded.add(pSocketId)
+
+        return True
+
+    def remove(self, pSocketId):
+
+        with self.mLock:
+
+            if pSocketId not in self.mMembers:
+                return False
+
+            self.mMembers.discard(pSocketId)
+            self.mAdded.discard(pSocketId)
+            self.mRemoved.add(pSocketId)
+
+            lChannels = self.mSocketChannels.get(pSocketId, None)
+
+            if lChannels is not None:
+
+                lChannels.discard(self.mChannelName)
+
+                if len(lChannels) == 0:
+                    del self.mSocketChannels[ pSocketId ]
+
+        return True
+
+    def snapshot(self):
+
+        with self.mLock:
+            return tuple(self.mMembers)
+
+    def __contains__(self, pSocketId):
+        return pSocketId in self.mMembers
+
+    def __len__(self):
+        return len(self.mMembers)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    ######################################################
+	##
+	##            Persistence to SharedVar
+	##
+	######################################################
+
+    def save(self):
+
+        if self.mSaveInterval <= 0:
+            self.flush()
+            return
+
+        with self.mLock:
+
+            if self.mSaveTimer is not None:
+                return
+
+            self.mSaveTimer = Timer(self.mSaveInterval, self.flush)
+            self.mSaveTimer.daemon = True
+            self.mSaveTimer.start()
+
+        return
+
+    # the stored value stays a list, as readers of the
+    # Channel key expect ; read-merge-write is done under
+    # the lock so two local flushes never interleave
+    def flush(self):
+
+        with self.mLock:
+
+            self.mSaveTimer = None
+
+            if self.mMergeOnFlush == False or self.mStoreLock is None:
+                self._store()
+                return
+
+            with self.mStoreLock:
+                self._store()
+
+        return
+
+    def _store(self):
+
+        lMembers = set(self.mMembers)
+
+        if self.mMergeOnFlush == True:
+
+            lStored = SharedVar('Core').get('Channel', str(self.mChannelName))
+            lMembers = ((set() if lStored is None else set(lStored)) | self.mAdded) - self.mRemoved
+
+            self._replace(lMembers)
+
+        self.mAdded = set()
+        self.mRemoved = set()
+
+        SharedVar('Core').set('Channel', str(self.mChannelName), list(lMembers))
+
+        return
+
+    def cancelSave(self):
+
+        with self.mLock:
+
+            if self.mSaveTimer is not None:
+                self.mSaveTimer.cancel()
+                self.mSaveTimer = None
+
+        return
+
+
 class ChannelHandler(object):
     
     mClientStack = list()
     mCurrentChannel = ""
+    mChannelId = 0
     mCallback = None
     mEventListener = None
 
+    # join / leave notifications are coalesced over this window ( seconds ),
+    # 0 sends one packet per event as soon as it happens
+    mNotifyWindow = 0.0
+    mNotifyLock = None
+    mNotifyTimer = None
+    mNotifyServer = None
+    mNotifySequence = 0
+    mPendingEvents = None
+    mPendingJoins = None
+
+    mJoinCounter = NULL_METRIC
+    mLeaveCounter = NULL_METRIC
+
     ######################################################
 	##
 	##                  Constructor
@@ -26,13 +335,18 @@ class ChannelHandler(object):
 
         self.mEventListener = ChannelEventHandler()
 
-        self.mClientStack = SharedVar('Core').get("Channel", pChannelName)
+        self.mClientStack = ChannelMembership.get(pChannelName)
         self.mCurrentChannel = pChannelName
+        self.mChannelId = ChannelResolver.getIdFromString(pChannelName)
+
+        self.mNotifyLock = RLock()
+        self.mPendingEvents = []
+        self.mPendingJoins = {}
+
+        # handlers built directly ( ChannelHandler(name).tryJoin ) must be
+        # seen by the registry lookups, the first one becomes the live one
+        ChannelRegistry.register(self)
 
-        if self.mClientStack == None:
-            self.mClientStack = list()
-            SharedVar('Core').set('Channel', pChannelName, self.mClientStack)
-            
         return
 
     ######################################################
@@ -63,12 +377,24 @@ class ChannelHandler(object):
 
         from common.constants.Network import NetworkFlags
 
-        if self.canJoin(pSocket) == True : 
-            
-            self.mClientStack.append(pSocket.socketId)
-            self.save()     
+        # checked with the registry lock, so the channel can not be
+        # released between the check and the add
+        with ChannelRegistry.mLock:
+
+            lHandler = None if ChannelRegistry.isLive(self) == True else ChannelRegistry.get(self.mCurrentChannel)
+            lAdded = self.mClientStack.add(pSocket.socketId) if lHandler is None else False
 
-            self.mEventListener.sendEvent(ChannelResolver().getIdFromString(self.mCurrentChannel), 'onChannelUpdate', pSocket)
+        # handler obtained before the channel was released, or built
+        # directly while another one was live
+        if lHandler is not None:
+            return lHandler.tryJoin(pSocket)
+
+        if lAdded == True :
+
+            self.mJoinCounter.inc()
+            self.save()
+
+            self.mEventListener.sendEvent(self.mChannelId, 'onChannelUpdate', pSocket)
             self.notify(pSocket, NetworkFlags.FLAG_NEW_CLIENT_CONNECTED)
 
             return True
@@ -102,55 +428,374 @@ class ChannelHandler(object):
 	######################################################
 
     def getMemberList(self):
-        return self.mClientStack
+        return self.mClientStack.snapshot()
 
     def save(self):
-        SharedVar('Core').set('Channel', str(self.mCurrentChannel), self.mClientStack)
+        self.mClientStack.save()
         return 
     
     def notify(self, pSocket, pEvent):
 
+        from common.constants.Network import NetworkFlags
+
+        if self.mNotifyWindow <= 0:
+            pSocket.server.sendToChannel(self.buildNotification(pEvent), pSocket, self.mCurrentChannel)
+            return
+
+        with self.mNotifyLock:
+
+            self.mNotifySequence += 1
+            self.mPendingEvents.append((self.mNotifySequence, pSocket.socketId, pEvent))
+            self.mNotifyServer = pSocket.server
+
+            if pEvent == NetworkFlags.FLAG_NEW_CLIENT_CONNECTED:
+                self.mPendingJoins[ pSocket.socketId ] = self.mNotifySequence
+
+            if self.mNotifyTimer is None:
+                self.mNotifyTimer = Timer(self.mNotifyWindow, self.flushNotifications)
+                self.mNotifyTimer.daemon = True
+                self.mNotifyTimer.start()
+
+        return
+
+    ######################################################
+	##
+	##     Send the events coalesced during the window
+	##
+	######################################################
+
+    def flushNotifications(self):
+
+        with self.mNotifyLock:
+
+            lEvents = self.mPendingEvents
+            lJoins = self.mPendingJoins
+            lServer = self.mNotifyServer
+
+            self.mPendingEvents = []
+            self.mPendingJoins = {}
+            self.mNotifyTimer = None
+
+        lEvents = self.coalesceNotifications(lEvents)
+
+        if len(lEvents) > 0:
+            lServer.sendChannelNotifications(self, lEvents, lJoins)
+
+        return
+
+    ######################################################
+	##
+	##   Only the last ( sequence, socket id, event ) of
+	##   a socket is kept, none when it joined and left
+	##   ( or left and came back ) in the window or when
+	##   it no longer matches the membership. A member
+	##   only gets the events not older than its join
+	##     sequence, see memberGetsEvent()
+	##
+	######################################################
+
+    def coalesceNotifications(self, pEvents):
+
+        from common.constants.Network import NetworkFlags
+
+        lCounts = {}
+        lLast = {}
+
+        for lSequence, lSocketId, lEvent in pEvents:
+            lCounts[ lSocketId ] = lCounts.get(lSocketId, 0) + 1
+            lLast[ lSocketId ] = (lSequence, lEvent)
+
+        lResult = []
+
+        for lSocketId, (lSequence, lEvent) in sorted(lLast.items(), key=lambda lItem: lItem[1][0]):
+
+            if lCounts[ lSocketId ] % 2 == 0:
+                continue
+
+            if (lEvent == NetworkFlags.FLAG_NEW_CLIENT_CONNECTED) != (lSocketId in self.mClientStack):
+                continue
+
+            lResult.append((lSequence, lSocketId, lEvent))
+
+        return lResult
+
+    # pJoinSequence is 0 for members who did not join in the window
+    @staticmethod
+    def memberGetsEvent(pMemberId, pJoinSequence, pSequence, pSocketId):
+        return pMemberId != pSocketId and pJoinSequence <= pSequence
+
+    def buildNotification(self, pEvent):
+
         from websocket.Packet import Packet
-        from common.constants.Network import Opcodes, Channel, NetworkFlags
+        from common.constants.Network import Opcodes, Channel
 
         lPacket = Packet(opcode=Opcodes.SMSG_CHANNEL_NOTIFICATION, channel=Channel.GLOBAL)
-        
-        lPacket.WriteByte(ChannelResolver().getIdFromString(self.mCurrentChannel))
+
+        lPacket.WriteByte(self.mChannelId)
         lPacket.WriteInt32(pEvent)
 
-        pSocket.server.sendToChannel(lPacket.deflate, pSocket, self.mCurrentChannel)
+        return lPacket.deflate
+
+    ######################################################
+	##
+	##     One packet for many ( socket id, event ) pairs,
+	##   only for clients flagged supportsBatchNotification
+	##
+	######################################################
+
+    def buildBatchNotification(self, pEvents):
+
+        from websocket.Packet import Packet
+        from common.constants.Network import Channel
+
+        lPacket = Packet(opcode=self.getBatchOpcode(), channel=Channel.GLOBAL)
+
+        lPacket.WriteByte(self.mChannelId)
+        lPacket.WriteUint32(len(pEvents))
+
+        for lSocketId, lEvent in pEvents:
+            lPacket.WriteInt32(lEvent)
+            lPacket.WriteUint32(lSocketId)
+
+        return lPacket.deflate
+
+    @staticmethod
+    def getBatchOpcode():
+
+        from common.constants.Network import Opcodes
+
+        return getattr(Opcodes, 'SMSG_CHANNEL_NOTIFICATION_BATCH', ChannelOpcodes.SMSG_CHANNEL_NOTIFICATION_BATCH)
+
+    @classmethod
+    def bindMetrics(cls, pMetrics):
+
+        cls.mJoinCounter = pMetrics.counter('websocket_channel_joins_total', 'Channel joins')
+        cls.mLeaveCounter = pMetrics.counter('websocket_channel_leaves_total', 'Channel leaves')
+
+        if pMetrics.enabled == True:
+            pMetrics.gauge('websocket_channels', 'Channels with a live handler', pCallback=lambda: len(ChannelRegistry.channels()))
 
         return
 
+    @classmethod
+    def setNotifyWindow(cls, pMilliseconds):
+        cls.mNotifyWindow = max(0.0, float(pMilliseconds) / 1000.0)
+        return
+
     def leaveChannel(self, pSocket):
 
         from common.constants.Network import NetworkFlags
 
-        self.mEventListener.sendEvent(ChannelResolver().getIdFromString(self.mCurrentChannel), 'onChannelUpdate', pSocket)
+        if ChannelRegistry.isLive(self) == False:
+
+            lHandler = ChannelRegistry.find(self.mCurrentChannel)
+
+            if lHandler is not None:
+                lHandler.leaveChannel(pSocket)
+
+            return
+
+        if self.isAlreadyMember(pSocket) == False:
+            return
+
+        self.mEventListener.sendEvent(self.mChannelId, 'onChannelUpdate', pSocket)
         
         self.notify(pSocket, NetworkFlags.FLAG_CLIENT_DISCONNECTED)
 
         self.mClientStack.remove(pSocket.socketId)
+        self.mLeaveCounter.inc()
         self.save()
 
+        if len(self.mClientStack) == 0:
+            ChannelRegistry.release(self.mCurrentChannel)
+
+        return
+
+    def refresh(self):
+        self.mClientStack.reload()
+        return
+
+    ######################################################
+	##
+	##    Leave every channel of a socket, only visits
+	##           the channels it is a member of
+	##
+	######################################################
+
+    @staticmethod
+    def leaveAllChannels(pSocket):
+
+        for lChannelName in ChannelMembership.channelsOf(pSocket.socketId):
+            ChannelRegistry.get(lChannelName).leaveChannel(pSocket)
+
         return
 
+######################################################
+##
+##     Process wide registry, one live handler per
+##                     channel
+##
+######################################################
+
+class ChannelRegistry(object):
+
+    # local  : in-process membership is authoritative
+    # shared : SharedVar is the source of truth ( multi-process )
+    CONSISTENCY_LOCAL = 'local'
+    CONSISTENCY_SHARED = 'shared'
+
+    mHandlers = {}
+    mLock = RLock()
+    mConsistencyMode = 'local'
+
+    @classmethod
+    def get(cls, pChannelName):
+
+        with cls.mLock:
+
+            lHandler = cls.mHandlers.get(pChannelName, None)
+
+            # registers itself
+            if lHandler is None:
+                lHandler = ChannelHandler(pChannelName)
+
+            elif cls.mConsistencyMode == cls.CONSISTENCY_SHARED:
+                lHandler.refresh()
+
+        return lHandler
+
+    ######################################################
+	##
+	##   Live handler of a channel or None, never
+	##   creates one ( lookups by names coming from
+	##                   clients )
+	##
+	######################################################
+
+    @classmethod
+    def find(cls, pChannelName):
+
+        with cls.mLock:
+
+            lHandler = cls.mHandlers.get(pChannelName, None)
+
+            if lHandler is not None and cls.mConsistencyMode == cls.CONSISTENCY_SHARED:
+                lHandler.refresh()
+
+        return lHandler
+
+    ######################################################
+	##
+	##   Called by every new handler, it becomes the live
+	##     one unless the channel already has one
+	##
+	######################################################
+
+    @classmethod
+    def register(cls, pHandler):
+
+        with cls.mLock:
+            lHandler = cls.mHandlers.setdefault(pHandler.mCurrentChannel, pHandler)
+
+        return lHandler is pHandler
+
+    @classmethod
+    def isLive(cls, pHandler):
+
+        with cls.mLock:
+            return cls.mHandlers.get(pHandler.mCurrentChannel, None) is pHandler
+
+    ######################################################
+	##
+	##       Tear down the handler of an empty channel
+	##
+	######################################################
+
+    @classmethod
+    def release(cls, pChannelName):
+
+        with cls.mLock:
+
+            lHandler = cls.mHandlers.get(pChannelName, None)
+
+            if lHandler is not None and len(lHandler.mClientStack) > 0:
+                return False
+
+            cls.mHandlers.pop(pChannelName, None)
+            ChannelMembership.discard(pChannelName)
+
+        return True
+
+    @classmethod
+    def reset(cls):
+
+        with cls.mLock:
+
+            cls.mHandlers.clear()
+            ChannelMembership.reset()
+
+        return
+
+    # pStoreLock ( multiprocessing.Lock created before forking, or any
+    # object with acquire / release ) is shared by every process writing
+    # the memberships, without it only local flushes are serialized
+    @classmethod
+    def setConsistencyMode(cls, pMode, pStoreLock = None):
+
+        if pMode not in (cls.CONSISTENCY_LOCAL, cls.CONSISTENCY_SHARED):
+            raise NameError("Invalid consistency mode : " + str(pMode))
+
+        with cls.mLock:
+
+            cls.mConsistencyMode = pMode
+
+            # other processes must see every change right away
+            if pMode == cls.CONSISTENCY_SHARED:
+                ChannelMembership.mSaveInterval = 0
+                ChannelMembership.mMergeOnFlush = True
+                ChannelMembership.mStoreLock = pStoreLock
+
+        return
+
+    @classmethod
+    def channels(cls):
+
+        with cls.mLock:
+            return tuple(cls.mHandlers.keys())
+
+######################################################
+##
+##   Channel name <-> id resolver, lookup tables are
+##    built once, call reload() if the enum changes
+##
+######################################################
+
 class ChannelResolver(object):
 
-     def getIdFromString(self, pStr):
-         from common.constants.Network import Opcodes, Channel, NetworkFlags
-         
-         for lKey, lChannel in Channel.__members__.items():  
-            if lKey == pStr:
-                return lChannel.value
+    mNameToId = {}
+    mIdToName = {}
+
+    @classmethod
+    def reload(cls):
+
+        from common.constants.Network import Channel
+
+        cls.mNameToId = { lKey : lChannel.value for lKey, lChannel in Channel.__members__.items() }
+        cls.mIdToName = {}
+
+        # keep the first name of aliased values, like the former linear scan
+        for lKey, lChannel in Channel.__members__.items():
+            cls.mIdToName.setdefault(lChannel.value, lKey)
+
+        return
 
-         return 0
+    @classmethod
+    def getIdFromString(cls, pStr):
+        return cls.mNameToId.get(pStr, 0)
 
-     def getNameFromId(self, pId):
-         from common.constants.Network import Opcodes, Channel, NetworkFlags
+    @classmethod
+    def getNameFromId(cls, pId):
+        return cls.mIdToName.get(pId, '')
 
-         for lKey, lChannel in Channel.__members__.items():  
-            if lChannel.value == pId:
-                return lKey
 
-         return ''
+ChannelResolver.reload()
@@ -0,0 +1,168 @@
+﻿######################################################
+##
+##      Thread-safe websocket client registry
+##
+######################################################
+
+from threading import Lock
+
+######################################################
+##
+##   socket id -> client, split in lock-striped
+##   buckets so lookups from broadcast threads do
+##    not contend with connects / disconnects
+##
+######################################################
+
+class ClientRegistry(object):
+
+    mStripeCount = 16
+    mStripes = None
+    mStripeLocks = None
+
+    # id allocation and capacity accounting
+    mIdLock = None
+    mIdIterator = 0
+    mIdStride = 1
+    mCount = 0
+
+    def __init__(self, pStripeCount = 16):
+
+        if pStripeCount <= 0:
+            raise NameError("Invalid stripe count : " + str(pStripeCount))
+
+        self.mStripeCount = pStripeCount
+        self.mStripes = [ {} for lI in range(pStripeCount) ]
+        self.mStripeLocks = [ Lock() for lI in range(pStripeCount) ]
+        self.mIdLock = Lock()
+
+        return
+
+    ######################################################
+	##
+	##   Ids are pLast + pStride, pLast + 2 * pStride ...
+	##     ( one sequence per worker when sharded )
+	##
+	######################################################
+
+    def setIdSequence(self, pLast, pStride):
+
+        if pStride <= 0:
+            raise NameError("Invalid id stride : " + str(pStride))
+
+        with self.mIdLock:
+            self.mIdIterator = pLast
+            self.mIdStride = pStride
+
+        return
+
+    ######################################################
+	##
+	##    Allocate an id and store the client, return
+	##    None when pCapacity ( 0 = unlimited ) is hit
+	##
+	######################################################
+
+    def register(self, pSocket, pCapacity = 0):
+
+        with self.mIdLock:
+
+            if pCapacity != 0 and self.mCount >= pCapacity:
+                return None
+
+            self.mIdIterator += self.mIdStride
+            self.mCount += 1
+
+            lSocketId = self.mIdIterator
+
+        pSocket.setSocketId(lSocketId)
+
+        lIndex = lSocketId % self.mStripeCount
+
+        with self.mStripeLocks[ lIndex ]:
+            self.mStripes[ lIndex ][ lSocketId ] = pSocket
+
+        return lSocketId
+
+    def unregister(self, pSocketId):
+
+        lIndex = pSocketId % self.mStripeCount
+
+        with self.mStripeLocks[ lIndex ]:
+            lSocket = self.mStripes[ lIndex ].pop(pSocketId, None)
+
+        if lSocket is not None:
+            with self.mIdLock:
+                self.mCount -= 1
+
+        return lSocket
+
+    def get(self, pSocketId, pDefault = None):
+
+        # a single dict read, atomic under the GIL
+        return self.mStripes[ pSocketId % self.mStripeCount ].get(pSocketId, pDefault)
+
+    ######################################################
+	##
+	##   Copy of every client, safe to iterate while
+	##       other threads connect or disconnect
+	##
+	######################################################
+
+    def snapshot(self):
+
+        lSockets = []
+
+        for lIndex in range(self.mStripeCount):
+            with self.mStripeLocks[ lIndex ]:
+                lSockets.extend(self.mStripes[ lIndex ].values())
+
+        return lSockets
+
+    def clear(self):
+
+        for lIndex in range(self.mStripeCount):
+            with self.mStripeLocks[ lIndex ]:
+                self.mStripes[ lIndex ].clear()
+
+        with self.mIdLock:
+            self.mCount = 0
+
+        return
+
+    ######################################################
+	##
+	##     Read-only dict surface for existing callers
+	##
+	######################################################
+
+    def __len__(self):
+        return self.mCount
+
+    def __contains__(self, pSocketId):
+        return pSocketId in self.mStripes[ pSocketId % self.mStripeCount ]
+
+    def __getitem__(self, pSocketId):
+
+        lSocket = self.get(pSocketId)
+
+        if lSocket is None:
+            raise KeyError(pSocketId)
+
+        return lSocket
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [ lSocket.socketId for lSocket in self.snapshot() ]
+
+    def values(self):
+        return self.snapshot()
+
+    def items(self):
+        return [ (lSocket.socketId, lSocket) for lSocket in self.snapshot() ]
+
+    @property
+    def lastId(self):
+        return self.mIdIterator
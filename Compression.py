@@ -0,0 +1,245 @@
+﻿######################################################
+##
+##         permessage-deflate ( RFC 7692 )
+##
+######################################################
+
+import zlib
+
+from websocket.Broadcast import encodeFrame
+
+DEFLATE_EXTENSION = 'permessage-deflate'
+DEFLATE_TRAILER = b'\x00\x00\xff\xff'
+
+RSV1 = 0x40
+
+# zlib refuses 8 bits raw deflate windows
+MIN_WINDOW_BITS = 9
+MAX_WINDOW_BITS = 15
+
+######################################################
+##
+##    Negotiated state of one connection, the server
+##   side compressor is stateless when server context
+##   takeover is off so frames can be shared between
+##        connections with the same parameters
+##
+######################################################
+
+class PerMessageDeflate(object):
+
+    mLevel = 6
+    mMemLevel = 8
+    mThreshold = 128
+    mServerNoContextTakeover = True
+    mClientNoContextTakeover = False
+    mServerWindowBits = MAX_WINDOW_BITS
+    mClientWindowBits = MAX_WINDOW_BITS
+
+    mCompressor = None
+    mDecompressor = None
+
+    # outbound payload bytes before / after compression
+    mRawBytes = 0
+    mCompressedBytes = 0
+
+    def __init__(self, pLevel = 6, pThreshold = 128, pServerNoContextTakeover = True, pClientNoContextTakeover = False, pServerWindowBits = MAX_WINDOW_BITS, pClientWindowBits = MAX_WINDOW_BITS):
+
+        self.mLevel = pLevel
+        self.mThreshold = pThreshold
+        self.mServerNoContextTakeover = pServerNoContextTakeover
+        self.mClientNoContextTakeover = pClientNoContextTakeover
+        self.mServerWindowBits = max(MIN_WINDOW_BITS, pServerWindowBits)
+        self.mClientWindowBits = max(MIN_WINDOW_BITS, pClientWindowBits)
+
+        return
+
+    ######################################################
+	##
+	##   Compress a message payload, the trailing empty
+	##          stored block is not sent
+	##
+	######################################################
+
+    def compress(self, pPayload):
+
+        if self.mServerNoContextTakeover == True:
+            lCompressor = zlib.compressobj(self.mLevel, zlib.DEFLATED, -self.mServerWindowBits, self.mMemLevel)
+        else:
+
+            if self.mCompressor is None:
+                self.mCompressor = zlib.compressobj(self.mLevel, zlib.DEFLATED, -self.mServerWindowBits, self.mMemLevel)
+
+            lCompressor = self.mCompressor
+
+        lData = lCompressor.compress(pPayload) + lCompressor.flush(zlib.Z_SYNC_FLUSH)
+
+        if lData.endswith(DEFLATE_TRAILER):
+            lData = lData[:-4]
+
+        return lData
+
+    def decompress(self, pPayload, pMaxSize):
+
+        # a full window inflates any smaller one
+        if self.mClientNoContextTakeover == True or self.mDecompressor is None:
+            lDecompressor = zlib.decompressobj(-MAX_WINDOW_BITS)
+        else:
+            lDecompressor = self.mDecompressor
+
+        if self.mClientNoContextTakeover == False:
+            self.mDecompressor = lDecompressor
+
+        lData = lDecompressor.decompress(bytes(pPayload) + DEFLATE_TRAILER, pMaxSize + 1)
+
+        if len(lData) > pMaxSize or len(lDecompressor.unconsumed_tail) > 0:
+            raise NameError("Inflated message too large")
+
+        return lData
+
+    ######################################################
+	##
+	##   Final frame for a message, sent raw under the
+	##             compression threshold
+	##
+	######################################################
+
+    def encodeFrame(self, pPayload, pOpcode = None):
+
+        if isinstance(pPayload, str):
+            pPayload = pPayload.encode('utf-8')
+
+            if pOpcode is None:
+                pOpcode = 0x1
+
+        if len(pPayload) < self.mThreshold:
+            return encodeFrame(pPayload, pOpcode)[1]
+
+        lData = self.compress(pPayload)
+
+        self.mRawBytes += len(pPayload)
+        self.mCompressedBytes += len(lData)
+
+        return encodeFrame(lData, pOpcode, RSV1)[1]
+
+    ######################################################
+	##
+	##    Connections sharing this key produce the same
+	##     bytes for a message, None when the server
+	##            compressor keeps a context
+	##
+	######################################################
+
+    @property
+    def sharedKey(self):
+
+        if self.mServerNoContextTakeover == False:
+            return None
+
+        return (self.mLevel, self.mMemLevel, self.mServerWindowBits)
+
+    @property
+    def threshold(self):
+        return self.mThreshold
+
+    @property
+    def responseHeader(self):
+
+        lParams = [ DEFLATE_EXTENSION ]
+
+        if self.mServerNoContextTakeover == True:
+            lParams.append('server_no_context_takeover')
+
+        if self.mClientNoContextTakeover == True:
+            lParams.append('client_no_context_takeover')
+
+        if self.mServerWindowBits < MAX_WINDOW_BITS:
+            lParams.append('server_max_window_bits=' + str(self.mServerWindowBits))
+
+        if self.mClientWindowBits < MAX_WINDOW_BITS:
+            lParams.append('client_max_window_bits=' + str(self.mClientWindowBits))
+
+        return '; '.join(lParams)
+
+    @property
+    def compressionRatio(self):
+        return float(self.mCompressedBytes) / self.mRawBytes if self.mRawBytes > 0 else 0.0
+
+
+######################################################
+##
+##   Pick the first acceptable offer of a client
+##    Sec-WebSocket-Extensions header, None when
+##          nothing can be accepted
+##
+######################################################
+
+def negotiateDeflate(pHeader, pLevel = 6, pThreshold = 128, pServerContextTakeover = False, pClientContextTakeover = True, pWindowBits = MAX_WINDOW_BITS):
+
+    if pHeader is None:
+        return None
+
+    pWindowBits = max(MIN_WINDOW_BITS, min(MAX_WINDOW_BITS, pWindowBits))
+
+    for lOffer in pHeader.split(','):
+
+        lParts = [ lPart.strip() for lPart in lOffer.split(';') ]
+
+        if lParts[0] != DEFLATE_EXTENSION:
+            continue
+
+        lParams = {}
+        lValid = True
+
+        for lPart in lParts[1:]:
+
+            lName, lSeparator, lValue = lPart.partition('=')
+            lName = lName.strip()
+            lValue = lValue.strip().strip('"')
+
+            if lName in lParams:
+                lValid = False
+                break
+
+            lParams[ lName ] = lValue
+
+        if lValid == False:
+            continue
+
+        lServerNoContextTakeover = pServerContextTakeover == False
+        lClientNoContextTakeover = pClientContextTakeover == False
+        lServerWindowBits = pWindowBits
+        lClientWindowBits = MAX_WINDOW_BITS
+
+        for lName, lValue in lParams.items():
+
+            if lName == 'server_no_context_takeover' and lValue == '':
+                lServerNoContextTakeover = True
+
+            elif lName == 'client_no_context_takeover' and lValue == '':
+                lClientNoContextTakeover = True
+
+            elif lName == 'server_max_window_bits' and lValue.isdigit() and MIN_WINDOW_BITS <= int(lValue) <= MAX_WINDOW_BITS:
+                lServerWindowBits = min(lServerWindowBits, int(lValue))
+
+            # the client may only be limited when it says so, and never
+            # above its offer ( RFC 7692 7.1.2.2 ) : a client offering
+            # pWindowBits or less already limits itself, the parameter
+            # is left out of the answer
+            elif lName == 'client_max_window_bits' and (lValue == '' or (lValue.isdigit() and MIN_WINDOW_BITS - 1 <= int(lValue) <= MAX_WINDOW_BITS)):
+
+                lOffered = int(lValue) if lValue != '' else MAX_WINDOW_BITS
+
+                if pWindowBits < lOffered:
+                    lClientWindowBits = pWindowBits
+
+            else:
+                lValid = False
+                break
+
+        if lValid == False:
+            continue
+
+        return PerMessageDeflate(pLevel, pThreshold, lServerNoContextTakeover, lClientNoContextTakeover, lServerWindowBits, lClientWindowBits)
+
+    return None
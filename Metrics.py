@@ -0,0 +1,374 @@
+﻿######################################################
+##
+##    Lightweight metrics registry, Prometheus text
+##                    exposition
+##
+######################################################
+
+import bisect
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+# seconds, tuned for in-process fan-out calls
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+######################################################
+##
+##    Handed out while the registry is disabled, so
+##      instrumented code pays one no-op call
+##
+######################################################
+
+class NullMetric(object):
+
+    enabled = False
+
+    def inc(self, pAmount = 1):
+        return
+
+    def dec(self, pAmount = 1):
+        return
+
+    def set(self, pValue):
+        return
+
+    def observe(self, pValue):
+        return
+
+NULL_METRIC = NullMetric()
+
+
+class Metric(object):
+
+    enabled = True
+
+    mType = 'untyped'
+    mName = ""
+    mHelp = ""
+    mLabels = None
+    mLock = None
+    mCallback = None
+
+    def __init__(self, pName, pHelp, pLabels = None, pCallback = None):
+
+        self.mName = pName
+        self.mHelp = pHelp
+        self.mLabels = pLabels if pLabels is not None else {}
+        self.mLock = Lock()
+        self.mCallback = pCallback
+
+        return
+
+    def formatLabels(self, pExtra = None):
+
+        lLabels = list(self.mLabels.items())
+
+        if pExtra is not None:
+            lLabels.append(pExtra)
+
+        if len(lLabels) == 0:
+            return ""
+
+        return "{" + ",".join('%s="%s"' % (lKey, str(lValue).replace('\\', '\\\\').replace('"', '\\"')) for lKey, lValue in lLabels) + "}"
+
+    def render(self):
+        return [ self.mName + self.formatLabels() + " " + formatValue(self.value) ]
+
+    @property
+    def value(self):
+        return self.mCallback()
+
+
+class Counter(Metric):
+
+    mType = 'counter'
+    mValue = 0
+
+    def inc(self, pAmount = 1):
+
+        with self.mLock:
+            self.mValue += pAmount
+
+        return
+
+    @property
+    def value(self):
+
+        if self.mCallback is not None:
+            return self.mCallback()
+
+        return self.mValue
+
+
+class Gauge(Metric):
+
+    mType = 'gauge'
+    mValue = 0
+
+    def set(self, pValue):
+        self.mValue = pValue
+        return
+
+    def inc(self, pAmount = 1):
+
+        with self.mLock:
+            self.mValue += pAmount
+
+        return
+
+    def dec(self, pAmount = 1):
+
+        with self.mLock:
+            self.mValue -= pAmount
+
+        return
+
+    @property
+    def value(self):
+
+        if self.mCallback is not None:
+            return self.mCallback()
+
+        return self.mValue
+
+
+class Histogram(Metric):
+
+    mType = 'histogram'
+    mBuckets = None
+    mCounts = None
+    mSum = 0.0
+    mCount = 0
+
+    def __init__(self, pName, pHelp, pLabels = None, pBuckets = DEFAULT_BUCKETS):
+
+        Metric.__init__(self, pName, pHelp, pLabels)
+
+        self.mBuckets = tuple(sorted(pBuckets))
+        self.mCounts = [0] * (len(self.mBuckets) + 1)
+
+        return
+
+    def observe(self, pValue):
+
+        lIndex = bisect.bisect_left(self.mBuckets, pValue)
+
+        with self.mLock:
+            self.mCounts[ lIndex ] += 1
+            self.mSum += pValue
+            self.mCount += 1
+
+        return
+
+    def render(self):
+
+        with self.mLock:
+            lCounts = list(self.mCounts)
+            lSum = self.mSum
+            lCount = self.mCount
+
+        lLines = []
+        lCumulative = 0
+
+        for lBound, lBucketCount in zip(self.mBuckets + (float('inf'),), lCounts):
+            lCumulative += lBucketCount
+            lLines.append(self.mName + "_bucket" + self.formatLabels(('le', formatValue(lBound))) + " " + str(lCumulative))
+
+        lLines.append(self.mName + "_sum" + self.formatLabels() + " " + formatValue(lSum))
+        lLines.append(self.mName + "_count" + self.formatLabels() + " " + str(lCount))
+
+        return lLines
+
+
+def formatValue(pValue):
+
+    if pValue == float('inf'):
+        return "+Inf"
+
+    if isinstance(pValue, bool):
+        return "1" if pValue else "0"
+
+    if isinstance(pValue, int):
+        return str(pValue)
+
+    return repr(float(pValue))
+
+
+######################################################
+##
+##   Process-wide registry, metrics requested while
+##          disabled are NULL_METRIC
+##
+######################################################
+
+class MetricsRegistry(object):
+
+    mInstance = None
+
+    mLock = None
+    mEnabled = False
+    mMetrics = None
+
+    def __init__(self, pEnabled = False):
+
+        self.mLock = Lock()
+        self.mEnabled = pEnabled
+        self.mMetrics = {}
+
+        return
+
+    @classmethod
+    def getInstance(cls):
+
+        if cls.mInstance is None:
+            cls.mInstance = MetricsRegistry()
+
+        return cls.mInstance
+
+    # must be called before instrumented objects are created
+    def setEnabled(self, pEnabled):
+        self.mEnabled = pEnabled
+        return
+
+    def _register(self, pClass, pName, pHelp, pLabels, *pArgs):
+
+        if self.mEnabled == False:
+            return NULL_METRIC
+
+        lKey = (pName, tuple(sorted((pLabels or {}).items())))
+
+        with self.mLock:
+
+            lMetric = self.mMetrics.get(lKey, None)
+
+            if lMetric is None:
+                lMetric = pClass(pName, pHelp, pLabels, *pArgs)
+                self.mMetrics[ lKey ] = lMetric
+
+            elif type(lMetric) is not pClass:
+                raise NameError("Metric " + pName + " already registered as " + lMetric.mType)
+
+        return lMetric
+
+    def counter(self, pName, pHelp, pLabels = None, pCallback = None):
+        return self._register(Counter, pName, pHelp, pLabels, pCallback)
+
+    def gauge(self, pName, pHelp, pLabels = None, pCallback = None):
+        return self._register(Gauge, pName, pHelp, pLabels, pCallback)
+
+    def histogram(self, pName, pHelp, pLabels = None, pBuckets = DEFAULT_BUCKETS):
+        return self._register(Histogram, pName, pHelp, pLabels, pBuckets)
+
+    ######################################################
+	##
+	##    Wrap a callable to observe its duration, the
+	##     callable is returned as is when disabled
+	##
+	######################################################
+
+    def timed(self, pFunction, pHistogram):
+
+        if pHistogram.enabled == False:
+            return pFunction
+
+        def lTimed(*pArgs, **pKwargs):
+
+            lStart = time.perf_counter()
+
+            try:
+                return pFunction(*pArgs, **pKwargs)
+            finally:
+                pHistogram.observe(time.perf_counter() - lStart)
+
+        return lTimed
+
+    def render(self):
+
+        with self.mLock:
+            lMetrics = sorted(self.mMetrics.values(), key=lambda lMetric: lMetric.mName)
+
+        lLines = []
+        lLastName = None
+
+        for lMetric in lMetrics:
+
+            if lMetric.mName != lLastName:
+                lLines.append("# HELP " + lMetric.mName + " " + lMetric.mHelp)
+                lLines.append("# TYPE " + lMetric.mName + " " + lMetric.mType)
+                lLastName = lMetric.mName
+
+            try:
+                lLines.extend(lMetric.render())
+            except Exception:
+                # a failing callback must not break the whole scrape
+                continue
+
+        return "\n".join(lLines) + "\n"
+
+    @property
+    def enabled(self):
+        return self.mEnabled
+
+
+######################################################
+##
+##      Local HTTP endpoint serving GET /metrics
+##
+######################################################
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        lBody = self.server.registry.render().encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(lBody)))
+        self.end_headers()
+        self.wfile.write(lBody)
+
+        return
+
+    def log_message(self, pFormat, *pArgs):
+        return
+
+
+class MetricsHttpServer(object):
+
+    mRegistry = None
+    mServer = None
+    mThread = None
+
+    def __init__(self, pRegistry, pPort, pHost = '127.0.0.1'):
+
+        self.mRegistry = pRegistry
+        self.mServer = ThreadingHTTPServer((pHost, pPort), MetricsRequestHandler)
+        self.mServer.daemon_threads = True
+        self.mServer.registry = pRegistry
+
+        return
+
+    def start(self):
+
+        self.mThread = Thread(target=self.mServer.serve_forever)
+        self.mThread.daemon = True
+        self.mThread.start()
+
+        return
+
+    def close(self):
+
+        self.mServer.shutdown()
+        self.mServer.server_close()
+
+        return
+
+    @property
+    def port(self):
+        return self.mServer.server_address[1]
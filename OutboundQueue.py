@@ -0,0 +1,175 @@
+﻿######################################################
+##
+##     Per-client outbound queue limits, protects
+##       broadcasts against slow consumers
+##
+######################################################
+
+import socket
+from threading import Lock
+
+POLICY_DROP = 'drop'
+POLICY_DISCONNECT = 'disconnect'
+
+######################################################
+##
+##   A client whose queue reaches the high watermark
+##   is either throttled ( frames dropped until the
+##    queue falls back to the low watermark ) or
+##                  disconnected
+##
+######################################################
+
+class OutboundQueueGuard(object):
+
+    mLock = None
+    mHighWatermark = 1024
+    mLowWatermark = 256
+    mPolicy = POLICY_DROP
+    mThrottled = None
+    mEvicted = None
+
+    # depth histogram, bucket i counts depths in [ 2^(i-1), 2^i ),
+    # the last one also counts every deeper queue
+    mDepthBuckets = None
+
+    mAccepted = 0
+    mDropped = 0
+    mSlowConsumers = 0
+    mRecovered = 0
+    mEvictions = 0
+
+    def __init__(self, pHighWatermark = 1024, pLowWatermark = None, pPolicy = POLICY_DROP):
+
+        if pLowWatermark is None:
+            pLowWatermark = pHighWatermark // 4
+
+        if pHighWatermark <= 0 or pLowWatermark < 0 or pLowWatermark >= pHighWatermark:
+            raise NameError("Invalid watermarks : " + str(pHighWatermark) + " / " + str(pLowWatermark))
+
+        if pPolicy not in (POLICY_DROP, POLICY_DISCONNECT):
+            raise NameError("Invalid slow consumer policy : " + str(pPolicy))
+
+        self.mLock = Lock()
+        self.mHighWatermark = pHighWatermark
+        self.mLowWatermark = pLowWatermark
+        self.mPolicy = pPolicy
+        self.mThrottled = set()
+        self.mEvicted = set()
+        self.mDepthBuckets = [0] * (pHighWatermark.bit_length() + 1)
+
+        return
+
+    ######################################################
+	##
+	##   Return True if a data frame may be queued on a
+	##       client which already holds pDepth frames
+	##
+	######################################################
+
+    def admit(self, pSocket, pDepth):
+
+        lKey = pSocket.socketId
+        lEvict = False
+
+        with self.mLock:
+
+            self.mDepthBuckets[ min(pDepth.bit_length(), len(self.mDepthBuckets) - 1) ] += 1
+
+            if lKey in self.mEvicted:
+                self.mDropped += 1
+                return False
+
+            if lKey in self.mThrottled:
+
+                if pDepth > self.mLowWatermark:
+                    self.mDropped += 1
+                    return False
+
+                self.mThrottled.discard(lKey)
+                self.mRecovered += 1
+
+            if pDepth < self.mHighWatermark:
+                self.mAccepted += 1
+                return True
+
+            self.mSlowConsumers += 1
+            self.mDropped += 1
+
+            if self.mPolicy == POLICY_DISCONNECT:
+                self.mEvicted.add(lKey)
+                self.mEvictions += 1
+                lEvict = True
+            else:
+                self.mThrottled.add(lKey)
+
+        if lEvict == True:
+            evictSocket(pSocket)
+
+        return False
+
+    ######################################################
+	##
+	##       Must be called when a client is gone
+	##
+	######################################################
+
+    def release(self, pSocket):
+
+        with self.mLock:
+            self.mThrottled.discard(pSocket.socketId)
+            self.mEvicted.discard(pSocket.socketId)
+
+        return
+
+    def isThrottled(self, pSocket):
+        return pSocket.socketId in self.mThrottled
+
+    def getDepthHistogram(self):
+
+        with self.mLock:
+            return [ ((1 << lI) - 1, lCount) for lI, lCount in enumerate(self.mDepthBuckets) ]
+
+    def getStats(self):
+
+        with self.mLock:
+
+            return {
+                'high_watermark' : self.mHighWatermark,
+                'low_watermark' : self.mLowWatermark,
+                'policy' : self.mPolicy,
+                'accepted' : self.mAccepted,
+                'dropped' : self.mDropped,
+                'slow_consumers' : self.mSlowConsumers,
+                'throttled' : len(self.mThrottled),
+                'recovered' : self.mRecovered,
+                'evictions' : self.mEvictions,
+                'depth_histogram' : [ ((1 << lI) - 1, lCount) for lI, lCount in enumerate(self.mDepthBuckets) ],
+            }
+
+######################################################
+##
+##   Drop everything queued and cut the connection,
+##   the server loop then runs the usual close path
+##
+######################################################
+
+def evictSocket(pSocket):
+
+    # asyncio transport
+    lAbort = getattr(pSocket, 'abort', None)
+
+    if lAbort is not None:
+        lAbort()
+        return
+
+    # select backend : a close frame would wait behind the backlog,
+    # shutdown() makes the socket readable with EOF instead
+    pSocket.sendq.clear()
+
+    try:
+        pSocket.client.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+    return
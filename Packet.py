@@ -1,10 +1,14 @@
 ﻿from enum import Enum
 import serial
 import os.path
-import codecs
-from threading import Thread, Lock, RLock
+from threading import Thread, Lock, RLock, local
+from collections import OrderedDict
+from weakref import WeakSet
 import binascii
+import time
 from DeciboxApi import DeciboxAPI
+from common.logger import Logger
+from VaubanMetrics import VaubanLinkMetrics, VaubanMeteredPort
 
 ######################################################
 ##
@@ -37,6 +41,154 @@ class VaubanEnrollementData(Enum):
     ENROLLEMENT_THREE_FINGER        = 0x3
     
 
+######################################################
+##
+##          LRU cache of finished frames keyed by
+##           ( device ID, opcode, payload )
+##
+######################################################
+
+class VaubanFrameCache(object):
+
+    mInstance = None
+    mInstanceLock = Lock()
+
+    # every live cache, told when a device ID changes
+    mCaches = WeakSet()
+    mCachesLock = Lock()
+
+    mFrames = None
+    mDeviceKeys = None
+    mMaxSize = 1024
+    mLock = None
+    mHits = 0
+    mMisses = 0
+    mEvictions = 0
+
+    def __init__(self, pMaxSize = 1024):
+
+        if pMaxSize <= 0:
+            raise NameError("Invalid cache size : " + str(pMaxSize))
+
+        self.mFrames = OrderedDict()
+        self.mDeviceKeys = {}
+        self.mMaxSize = pMaxSize
+        self.mLock = Lock()
+
+        with VaubanFrameCache.mCachesLock:
+            VaubanFrameCache.mCaches.add(self)
+
+        return
+
+    @classmethod
+    def getInstance(cls):
+
+        if cls.mInstance is None:
+
+            with cls.mInstanceLock:
+
+                if cls.mInstance is None:
+                    cls.mInstance = VaubanFrameCache()
+
+        return cls.mInstance
+
+    def get(self, pDeviceId, pOpcode, pPayload):
+
+        lKey = (pDeviceId, pOpcode, pPayload)
+
+        with self.mLock:
+
+            lFrame = self.mFrames.get(lKey, None)
+
+            if lFrame is None:
+                self.mMisses += 1
+                return None
+
+            self.mFrames.move_to_end(lKey)
+            self.mHits += 1
+
+        return lFrame
+
+    def put(self, pDeviceId, pOpcode, pPayload, pFrame):
+
+        lKey = (pDeviceId, pOpcode, pPayload)
+        lFrame = bytes(pFrame)
+
+        with self.mLock:
+
+            self.mFrames[ lKey ] = lFrame
+            self.mFrames.move_to_end(lKey)
+            self.mDeviceKeys.setdefault(pDeviceId, set()).add(lKey)
+
+            while len(self.mFrames) > self.mMaxSize:
+
+                lOldKey, lOldFrame = self.mFrames.popitem(last=False)
+                self.mEvictions += 1
+
+                lKeys = self.mDeviceKeys[ lOldKey[0] ]
+                lKeys.discard(lOldKey)
+
+                if len(lKeys) == 0:
+                    del self.mDeviceKeys[ lOldKey[0] ]
+
+        return lFrame
+
+    ######################################################
+	##
+	##     Drop every frame built for a device ID,
+	##       must be called when a device ID changes
+	##
+	######################################################
+
+    def invalidate(self, pDeviceId):
+
+        with self.mLock:
+
+            for lKey in self.mDeviceKeys.pop(pDeviceId, ()):
+                del self.mFrames[ lKey ]
+
+        return
+
+    def onDeviceIdChanged(self, pDevicePtr, pOldDeviceId):
+        self.invalidate(pOldDeviceId)
+        return
+
+    # device ID listener of every VaubanDevice
+    @classmethod
+    def notifyDeviceIdChanged(cls, pDevicePtr, pOldDeviceId):
+
+        with cls.mCachesLock:
+            lCaches = list(cls.mCaches)
+
+        for lCache in lCaches:
+            lCache.onDeviceIdChanged(pDevicePtr, pOldDeviceId)
+
+        return
+
+    def clear(self):
+
+        with self.mLock:
+            self.mFrames.clear()
+            self.mDeviceKeys.clear()
+
+        return
+
+    def getStats(self):
+
+        with self.mLock:
+
+            lRequests = self.mHits + self.mMisses
+
+            return {
+                'size' : len(self.mFrames),
+                'max_size' : self.mMaxSize,
+                'hits' : self.mHits,
+                'misses' : self.mMisses,
+                'evictions' : self.mEvictions,
+                'hit_rate' : float(self.mHits) / lRequests if lRequests > 0 else 0.0,
+            }
+
+
 ######################################################
 ##
 ##              Vauban Opcode Handler
@@ -45,7 +197,21 @@ class VaubanEnrollementData(Enum):
 
 class VaubanOpcodeHandler(object):
 
-    def __init__(self):
+    mFrameCache = None
+    mAccessDispatcher = None
+    mServiceAlias = "[Vauban]"
+
+    # reader of packets processed outside of a read thread
+    mDefaultInterface = "/dev/ttyUSB0"
+
+    def __init__(self, pFrameCache = None, pAccessDispatcher = None):
+
+        if pFrameCache is None:
+            pFrameCache = VaubanFrameCache.getInstance()
+
+        self.mFrameCache = pFrameCache
+        self.mAccessDispatcher = pAccessDispatcher
+
         return
 
     ######################################################
@@ -55,7 +221,14 @@ class VaubanOpcodeHandler(object):
     ######################################################
 
     def sendLedPacket(self, pRedValue, pGreenValue, pBlueValue, pTime, pRepeat, pDevicePtr):
-        
+
+        lPayload = (pRedValue, pGreenValue, pBlueValue, pTime, pRepeat)
+        lFrame = self.mFrameCache.get(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_LED, lPayload)
+
+        if lFrame is not None:
+            pDevicePtr.device.write(lFrame)
+            return
+
         lPacket = VaubanPacket(device=pDevicePtr, opcode=VaubanOpcodes.MSG_SEND_LED)
 
         # Red Led
@@ -73,10 +246,17 @@ class VaubanOpcodeHandler(object):
         # Repeat
         lPacket.pushData(pRepeat, 1)
 
-        pDevicePtr.device.write(lPacket.finalizePacket())
+        pDevicePtr.device.write(self.mFrameCache.put(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_LED, lPayload, lPacket.finalizePacket()))
 
     def sendBuzzerPacket(self, pState, pTime, pRepeat, pDevicePtr):
 
+        lPayload = (pState, pTime, pRepeat)
+        lFrame = self.mFrameCache.get(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_BIP, lPayload)
+
+        if lFrame is not None:
+            pDevicePtr.device.write(lFrame)
+            return
+
         lPacket = VaubanPacket(device=pDevicePtr, opcode=VaubanOpcodes.MSG_SEND_BIP)
 
         # buzzer state
@@ -88,7 +268,7 @@ class VaubanOpcodeHandler(object):
         # buzzer repeat
         lPacket.pushData(pRepeat, 1)
 
-        pDevicePtr.device.write(lPacket.finalizePacket())
+        pDevicePtr.device.write(self.mFrameCache.put(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_BIP, lPayload, lPacket.finalizePacket()))
 
         return
 
@@ -101,10 +281,20 @@ class VaubanOpcodeHandler(object):
 
         pDevicePtr.device.write(lPacket.finalizePacket())
 
-    def sendPollingPacket(sekf, pDevicePtr):
+        lMetrics = getattr(pDevicePtr, 'metrics', None)
 
-        lPacket = VaubanPacket(device=pDevicePtr, opcode=VaubanOpcodes.MSG_SEND_POLLING)
-        pDevicePtr.device.write(lPacket.finalizePacket())
+        if lMetrics is not None:
+            lMetrics.onEnrollmentSent()
+
+    def sendPollingPacket(self, pDevicePtr):
+
+        lFrame = self.mFrameCache.get(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_POLLING, ())
+
+        if lFrame is None:
+            lPacket = VaubanPacket(device=pDevicePtr, opcode=VaubanOpcodes.MSG_SEND_POLLING)
+            lFrame = self.mFrameCache.put(pDevicePtr.deviceId, VaubanOpcodes.MSG_SEND_POLLING, (), lPacket.finalizePacket())
+
+        pDevicePtr.device.write(lFrame)
 
         return
 
@@ -121,20 +311,35 @@ class VaubanOpcodeHandler(object):
 
 
 
-    def processPacket(self, pPacket):
+    def processPacket(self, pPacket, pDevicePtr = None):
+
+        # legacy read callbacks do not pass the device, they run
+        # on the read thread of the device the packet came from
+        if pDevicePtr is None:
+            pDevicePtr = getattr(VaubanDevice.mReadContext, 'device', None)
 
         if pPacket.opcode == 'E':
 
+            lMetrics = getattr(pDevicePtr, 'metrics', None)
+
+            if lMetrics is not None:
+                lMetrics.onEnrollmentAnswered()
+
             lResult = self.handlingEnrollementPacket(pPacket)
 
             # Enrollement failed
             if type(lResult) is bool:
                 return
 
-            # Enrollement succeed
+            # Enrollement succeed, check access off the reader thread
+            elif self.mAccessDispatcher is not None and pDevicePtr is not None:
+
+                self.mAccessDispatcher.checkAccess(lResult, pDevicePtr)
+                return
+
             else:
-                
-                DeciboxAPI().checkAccess(lResult, "/dev/ttyUSB0")
+
+                DeciboxAPI().checkAccess(lResult, pDevicePtr.interface if pDevicePtr is not None else self.mDefaultInterface)
                 return
 
         elif pPacket.opcode == 'P':
@@ -154,11 +359,19 @@ class VaubanOpcodeHandler(object):
 
     def handlingEnrollementPacket(self, pPacket):
 
+        # frames decoded by decodeVaubanFrame already carry the card ID
+        if type(pPacket) is VaubanFrame:
+
+            if pPacket.state != 'S' or pPacket.cardId is None:
+                return False
+
+            return pPacket.cardId
+
         lStr = ""
 
         lState = binascii.unhexlify(str(pPacket.raw[0])).decode()
 
-        print( "receive enrollement state : " + lState )
+        Logger("vauban").Write(self.mServiceAlias + " -> receive enrollement state : " + lState)
 
         # Enrollement succeed
         if lState == 'S':
@@ -204,8 +417,20 @@ class VaubanDevice(object):
 
     mDevicePtr = None
     mDeviceID = 0
+    mInterface = ""
     mRunThread = None
+    mRunning = False
     mCallback = None
+    mCallbackLock = None
+    mParser = None
+    mDecodeFrames = False
+    mDeviceIdListeners = None
+    mMetrics = None
+    mPort = None
+    mServiceAlias = "[Vauban]"
+
+    # device served by the current read thread
+    mReadContext = local()
 
     def __init__(self, pInterface, pDeviceID):
 
@@ -227,56 +452,157 @@ class VaubanDevice(object):
             raise NameError("Could not open interface " + pInterface + " maybe busy ? ")
 
         self.mDeviceID = pDeviceID
+        self.mInterface = pInterface
+        self.mParser = VaubanFrameParser()
+        self.mCallbackLock = RLock()
+        self.mDeviceIdListeners = [ VaubanFrameCache.notifyDeviceIdChanged ]
 
         return
 
+    ######################################################
+	##
+	##    Change device ID, cached frames built for the
+	##          old ID are invalidated by listeners
+	##
+	######################################################
+
+    def setDeviceId(self, pDeviceID):
+
+        if pDeviceID is None or pDeviceID <= 0:
+            raise NameError("Invalid deviceID : " + str(pDeviceID))
+
+        lOldDeviceId = self.deviceId
+        self.mDeviceID = pDeviceID
+
+        if lOldDeviceId != pDeviceID:
+            for lListener in self.mDeviceIdListeners:
+                lListener(self, lOldDeviceId)
+
+        return
+
+    def addDeviceIdListener(self, pListener):
+        self.mDeviceIdListeners.append(pListener)
+        return
+
+    # waits for a running callback to return before swapping it
+    def setReadCallback(self, pReadCallback):
+
+        with self.mCallbackLock:
+            self.mCallback = pReadCallback
+
+        return
+
+    ######################################################
+	##
+	##   Collect serial link metrics, writes go through
+	##     a metered proxy of the serial port from now
+	##
+	######################################################
+
+    def enableMetrics(self):
+
+        if self.mMetrics is None:
+            self.mMetrics = VaubanLinkMetrics(self)
+            self.mPort = VaubanMeteredPort(self.mDevicePtr, self.mMetrics)
+
+        return self.mMetrics
+
     ######################################################
 	##
 	##        Start read service async thread
 	##
 	######################################################
 
-    def startReadService(self, pReadCallback):
-       
+    def startReadService(self, pReadCallback, pDecodeFrames = False):
+
+        # pDecodeFrames = True hands VaubanFrame objects to the callback
+        # instead of legacy decimal-coded packets
+        self.setReadCallback(pReadCallback)
+        self.mDecodeFrames = pDecodeFrames
+        self.mRunning = True
+
         self.mRunThread = Thread(target=self._readService)
         self.mRunThread.daemon = False
         self.mRunThread.start()
-        self.mCallback = pReadCallback
+
+        return
+
+    def stopReadService(self):
+
+        self.mRunning = False
+
+        # wakes up the blocking read
+        self.mDevicePtr.cancel_read()
+
+        if self.mRunThread is not None:
+            self.mRunThread.join()
+            self.mRunThread = None
 
         return
 
 
     def _readService(self):
 
-        lPacket = bytearray()
-        lOnRead = False
+        VaubanDevice.mReadContext.device = self
 
-        while(True):
+        while self.mRunning == True:
 
-            # read one byte from device
-            lByte = int(hex(int.from_bytes(self.mDevicePtr.read(),  byteorder='big')).replace('0x', '').upper())
-            
-            # if we receive new packet, or we are on reading
-            if lByte == 0x2 or lOnRead == True:
-                
-                lOnRead = True
-                lPacket.append(lByte)
-
-            # if we are at end of our packet
-            if lByte == 0x3:
-                
-                lOnRead = False
-
-                if callable(self.mCallback) :
-                    
-                    # Lock callback while we use it
-                    Lock()
-
-                    self.mCallback(lPacket)
-                    lPacket.clear()
-            
-                    # Release callback locking
-                    RLock()
+            # block for the first byte, then drain everything already buffered
+            lData = self.mDevicePtr.read(max(1, self.mDevicePtr.in_waiting))
+
+            lMetrics = self.mMetrics
+
+            if lMetrics is None:
+                lFrames = self.mParser.feed(lData)
+            else:
+                lMetrics.onRead(len(lData))
+
+                lStart = time.perf_counter()
+                lFrames = self.mParser.feed(lData)
+
+                # parsing time is shared by the frames of the chunk
+                lParseTime = (time.perf_counter() - lStart) / len(lFrames) if len(lFrames) > 0 else 0.0
+
+            for lFrame in lFrames:
+
+                if lMetrics is not None:
+                    lStart = time.perf_counter()
+
+                if self.mDecodeFrames == True:
+
+                    # the XOR matched but the device ID is not hex : drop
+                    # the frame, the read thread must keep running
+                    try:
+                        lPacket = decodeVaubanFrame(lFrame)
+                    except NameError as lError:
+                        self.mParser.mFramesCorrupt += 1
+                        lPacket = None
+                        Logger("vauban").Write(self.mServiceAlias + " -> reader " + str(self.mDeviceID) + " dropped frame : " + str(lError))
+
+                else:
+                    lPacket = self.mParser.toLegacyPacket(lFrame)
+
+                if lMetrics is not None:
+                    lMetrics.onDecode(lParseTime + time.perf_counter() - lStart)
+
+                if lPacket is None:
+                    continue
+
+                # Lock callback while we use it
+                with self.mCallbackLock:
+
+                    if callable(self.mCallback) == True:
+
+                        if lMetrics is None:
+                            self.mCallback(lPacket)
+                        else:
+
+                            lStart = time.perf_counter()
+
+                            try:
+                                self.mCallback(lPacket)
+                            finally:
+                                lMetrics.onCallback(time.perf_counter() - lStart)
 
         return
 
@@ -290,10 +616,110 @@ class VaubanDevice(object):
     def deviceId(self):
         return int(self.mDeviceID)
 
+    # metered proxy once metrics are enabled
     @property
     def device(self):
+
+        if self.mPort is not None:
+            return self.mPort
+
         return self.mDevicePtr
 
+    @property
+    def interface(self):
+        return self.mInterface
+
+    @property
+    def parser(self):
+        return self.mParser
+
+    @property
+    def metrics(self):
+        return self.mMetrics
+
+
+######################################################
+##
+##          ASCII-hex encoding lookup tables
+##
+######################################################
+
+_VAUBAN_HEX_DIGITS = b'0123456789ABCDEF'
+
+# byte value -> two upper-case ASCII-hex chars ( 0x4A -> b'4A' )
+_VAUBAN_HEX_TABLE = tuple(bytes((_VAUBAN_HEX_DIGITS[lI >> 4], _VAUBAN_HEX_DIGITS[lI & 0xF])) for lI in range(256))
+
+# raw pushed bytes use the legacy decimal-coded form ( 41 -> 0x41 ),
+# -1 makes bytearray.append() reject values that do not fit in a byte
+_VAUBAN_RAW_TABLE = tuple(int(str(lI), 16) if int(str(lI), 16) <= 0xFF else -1 for lI in range(256))
+
+# received byte -> legacy decimal-coded value ( 0x45 -> 45 ), bytes whose
+# hex form is not all digits can not be represented and map to 0xFF
+_VAUBAN_LEGACY_READ_TABLE = bytes(int('%X' % lI) if ('%X' % lI).isdigit() else 0xFF for lI in range(256))
+
+# ASCII-hex char -> nibble value, -1 for anything else
+_VAUBAN_NIBBLE_TABLE = tuple(int(chr(lI), 16) if chr(lI) in '0123456789abcdefABCDEF' else -1 for lI in range(256))
+
+
+######################################################
+##
+##        Encode an integer as ASCII-hex chars
+##
+######################################################
+
+def encodeVaubanValue(pValue, pByteSize = 1):
+
+    if pValue < 0:
+        raise NameError("Invalid value : " + str(pValue))
+
+    if pValue > 0xFF:
+        return b'%X' % pValue
+
+    # only 2 byte fields are zero padded
+    if pValue < 0x10 and pByteSize != 2:
+        return _VAUBAN_HEX_TABLE[pValue][1:]
+
+    return _VAUBAN_HEX_TABLE[pValue]
+
+
+######################################################
+##
+##     Encode a full frame in a single pass :
+##  STX | device ID | opcode | payload | XOR | ETX
+##
+######################################################
+
+def encodeVaubanFrame(pDeviceId, pOpcode, pPayload = b''):
+
+    if issubclass(type(pOpcode), Enum) is True:
+        pOpcode = pOpcode.value
+
+    if pDeviceId <= 0xFFFF:
+        lDeviceId = _VAUBAN_HEX_TABLE[pDeviceId >> 8] + _VAUBAN_HEX_TABLE[pDeviceId & 0xFF]
+    else:
+        lDeviceId = b'%X' % pDeviceId
+
+    lOpcodeOffset = 1 + len(lDeviceId)
+    lControlOffset = lOpcodeOffset + 1 + len(pPayload)
+
+    lFrame = bytearray(lControlOffset + 3)
+
+    lFrame[0] = VaubanPacket.mStartFrame
+    lFrame[1:lOpcodeOffset] = lDeviceId
+    lFrame[lOpcodeOffset] = pOpcode
+    lFrame[lOpcodeOffset + 1:lControlOffset] = pPayload
+
+    # control frame is the xor of everything between STX and itself
+    lXor = 0
+
+    for lByte in memoryview(lFrame)[1:lControlOffset]:
+        lXor ^= lByte
+
+    lFrame[lControlOffset:lControlOffset + 2] = _VAUBAN_HEX_TABLE[lXor]
+    lFrame[lControlOffset + 2] = VaubanPacket.mEndFrame
+
+    return lFrame
+
 
 class VaubanPacket(object):
 
@@ -325,6 +751,9 @@ class VaubanPacket(object):
         lOpcode = kwargs.get('opcode', 0x0)
         lPacket = None
 
+        self.mBytes = bytearray()
+        self.mControlFrame = bytearray()
+
         if 'packet' in kwargs:
             lPacket = kwargs.get('packet', None)
 
@@ -345,8 +774,6 @@ class VaubanPacket(object):
         lDeviceId = pPacket[1:5]
         lOpcode = pPacket[5]
 
-        print(lOpcode)
-
         lString = ""
 
         for lInt in lDeviceId:
@@ -369,18 +796,13 @@ class VaubanPacket(object):
 	######################################################
 
     def createControlFrame(self):
-        
-        lXorStr = ""
-
-        for lByte in self.mBytes:
-            lXorStr += hex(int(lByte)) + "^"
 
-        lControlFrame = hex(eval(lXorStr[:-1])).replace('0x', '').upper().zfill(2)
+        lXor = 0
 
-        for lChar in lControlFrame:
-            lByte = int(codecs.encode(bytes(lChar.encode('ascii')), 'hex'))
+        for lByte in self.mBytes:
+            lXor ^= lByte
 
-            self.mControlFrame.append(lByte)
+        self.mControlFrame = bytearray(_VAUBAN_HEX_TABLE[lXor])
 
     ######################################################
 	##
@@ -396,24 +818,10 @@ class VaubanPacket(object):
         if type(pData) is bytearray or type(pData) is dict:
             
             for lByte in pData:
-                self.mBytes.append(lByte)
+                self.mBytes.append(_VAUBAN_RAW_TABLE[lByte])
 
         else:
-
-            if len(str(pData)) < 2 and  pByteSize == 2 or len(hex(pData).replace('0x', '')) < 2 and  pByteSize == 2:
-                pData = '0' + hex(pData).replace('0x', '').upper()
-            else : 
-                pData = hex(pData).replace('0x', '').upper()
-
-            if len(str(pData)) >= 2:
-               
-                for lData in str(pData):
-                    self.mBytes.append(int(hex(ord(str(lData).encode('ascii'))).replace('0x', '')))
-                
-            else:
-                print(pData)
-                self.mBytes.append(int(hex(ord(str(pData).encode('ascii'))).replace('0x', '').zfill(pByteSize)))
-           
+            self.mBytes += encodeVaubanValue(pData, pByteSize)
 
     ######################################################
     ##
@@ -426,13 +834,13 @@ class VaubanPacket(object):
         if self.mDevicePtr is None:
             raise NameError("Invalid device ptr, aborting deviceId building...")
 
-        lDeviceId = hex(self.mDevicePtr.deviceId).replace("0x", "").upper().zfill(4)
-           
+        lDeviceId = self.mDevicePtr.deviceId
 
-        for lI in lDeviceId:
-            lByte = int(codecs.encode(bytes(lI.encode('ascii')), 'hex'))
-            
-            self.mBytes.append(int('0x' + str(lByte), 16))
+        if lDeviceId <= 0xFFFF:
+            self.mBytes += _VAUBAN_HEX_TABLE[lDeviceId >> 8]
+            self.mBytes += _VAUBAN_HEX_TABLE[lDeviceId & 0xFF]
+        else:
+            self.mBytes += b'%X' % lDeviceId
 
         return
 
@@ -444,37 +852,180 @@ class VaubanPacket(object):
 	######################################################
 
     def finalizePacket(self):
-     
-        lPacket = self.mBytes
 
-        self.mBytes = bytearray()
+        if self.mDevicePtr is None:
+            raise NameError("Invalid device ptr, aborting deviceId building...")
 
-        # Insert device Id first in our packet
-        self.insertDeviceID()
-       
-        # Insert packet opcode 
-        self.mBytes.append(int(hex(ord(chr(self.mOpcode))).replace('0x', ''), 16))
+        # device ID, opcode, payload and control frame
+        # are written in one preallocated buffer
+        self.mBytes = encodeVaubanFrame(self.mDevicePtr.deviceId, self.mOpcode, self.mBytes)
+        self.mControlFrame = self.mBytes[-3:-1]
 
+        return self.mBytes
 
-        # push our temp bytebuffer in our 
-        for lByte in lPacket:
-            self.mBytes.append(int('0x'+str(lByte), 16))
 
-        # Create control frame
-        # with xor()
-        self.createControlFrame()
+    ######################################################
+	##
+	##                 Class properties
+	##
+	######################################################
 
+    @property
+    def opcode(self):
+        return self.mOpcode
 
-        for lByte in self.mControlFrame:
-            self.mBytes.append(int('0x'+str(lByte), 16))
+    @property
+    def raw(self):
+        return self.mRawPacket
 
-        lPacket = []
 
-        self.mBytes.insert(0, self.mStartFrame)
-        self.mBytes.append(self.mEndFrame)
+######################################################
+##
+##       Incremental STX / ETX frame parser
+##
+######################################################
 
-        return self.mBytes
+class VaubanFrameParser(object):
+
+    mBuffer = None
+    mOnRead = False
+    mValidateControlFrame = True
+    mMaxFrameSize = 256
+
+    mFramesDecoded = 0
+    mFramesCorrupt = 0
+    mXorFailures = 0
+    mFramesDropped = 0
+    mBytesDropped = 0
+
+    # STX + 4 chars device ID + opcode + 2 chars control frame + ETX
+    mMinFrameSize = 9
+
+    def __init__(self, pValidateControlFrame = True, pMaxFrameSize = 256):
+
+        self.mBuffer = bytearray()
+        self.mValidateControlFrame = pValidateControlFrame
+        self.mMaxFrameSize = pMaxFrameSize
+
+        return
+
+    ######################################################
+	##
+	##   Feed received bytes, return complete frames
+	##
+	######################################################
+
+    def feed(self, pData):
+
+        lFrames = []
+        lOffset = 0
+        lSize = len(pData)
+
+        while lOffset < lSize:
+
+            # outside of a frame, skip line noise up to next STX
+            if self.mOnRead == False:
+
+                lStart = pData.find(b'\x02', lOffset)
+
+                if lStart < 0:
+                    self.mBytesDropped += lSize - lOffset
+                    break
+
+                self.mBytesDropped += lStart - lOffset
+                self.mOnRead = True
+                lOffset = lStart + 1
+
+                self.mBuffer.clear()
+                self.mBuffer.append(VaubanPacket.mStartFrame)
+
+            lEnd = pData.find(b'\x03', lOffset)
+            lChunkEnd = lSize if lEnd < 0 else lEnd
+
+            # a new STX before ETX means the current frame was truncated
+            lRestart = pData.rfind(b'\x02', lOffset, lChunkEnd)
+
+            if lRestart >= 0:
+                self.mFramesDropped += 1
+                self.mBuffer.clear()
+                self.mBuffer.append(VaubanPacket.mStartFrame)
+                lOffset = lRestart + 1
+
+            if lEnd < 0:
+
+                self.mBuffer += pData[lOffset:]
+
+                if len(self.mBuffer) > self.mMaxFrameSize:
+                    self.mFramesDropped += 1
+                    self.mOnRead = False
+                    self.mBuffer.clear()
+
+                break
 
+            self.mBuffer += pData[lOffset:lEnd + 1]
+            self.mOnRead = False
+            lOffset = lEnd + 1
+
+            lFrame = bytes(self.mBuffer)
+            self.mBuffer.clear()
+
+            if self.checkFrame(lFrame) == False:
+                self.mFramesCorrupt += 1
+                continue
+
+            self.mFramesDecoded += 1
+            lFrames.append(lFrame)
+
+        return lFrames
+
+    ######################################################
+	##
+	##       Check frame size and XOR control frame
+	##
+	######################################################
+
+    def checkFrame(self, pFrame):
+
+        if len(pFrame) > self.mMaxFrameSize:
+            return False
+
+        if self.mValidateControlFrame == False:
+            return True
+
+        if len(pFrame) < self.mMinFrameSize:
+            return False
+
+        lXor = 0
+
+        for lByte in memoryview(pFrame)[1:-3]:
+            lXor ^= lByte
+
+        if pFrame[-3:-1].upper() != _VAUBAN_HEX_TABLE[lXor]:
+            self.mXorFailures += 1
+            return False
+
+        return True
+
+    ######################################################
+	##
+	##   Convert a frame to the legacy decimal-coded
+	##        packet expected by read callbacks
+	##
+	######################################################
+
+    def toLegacyPacket(self, pFrame):
+
+        lPacket = bytearray(pFrame.translate(_VAUBAN_LEGACY_READ_TABLE))
+
+        if 0xFF in lPacket:
+            return None
+
+        return lPacket
+
+    def reset(self):
+        self.mOnRead = False
+        self.mBuffer.clear()
+        return
 
     ######################################################
 	##
@@ -482,12 +1033,115 @@ class VaubanPacket(object):
 	##
 	######################################################
 
+    @property
+    def framesDecoded(self):
+        return self.mFramesDecoded
+
+    @property
+    def framesCorrupt(self):
+        return self.mFramesCorrupt
+
+    @property
+    def xorFailures(self):
+        return self.mXorFailures
+
+    @property
+    def framesDropped(self):
+        return self.mFramesDropped
+
+    @property
+    def bytesDropped(self):
+        return self.mBytesDropped
+
+
+######################################################
+##
+##       Decoded received frame, fields are parsed
+##         straight from the frame memoryview
+##
+######################################################
+
+class VaubanFrame(object):
+
+    __slots__ = ('mDeviceId', 'mOpcode', 'mState', 'mCardId', 'mPayload')
+
+    def __init__(self, pDeviceId, pOpcode, pState, pCardId, pPayload):
+
+        self.mDeviceId = pDeviceId
+        self.mOpcode = pOpcode
+        self.mState = pState
+        self.mCardId = pCardId
+        self.mPayload = pPayload
+
+        return
+
+    ######################################################
+	##
+	##                 Class properties
+	##
+	######################################################
+
+    @property
+    def deviceId(self):
+        return self.mDeviceId
+
     @property
     def opcode(self):
         return self.mOpcode
 
     @property
-    def raw(self):
-        return self.mRawPacket
+    def state(self):
+        return self.mState
+
+    @property
+    def cardId(self):
+        return self.mCardId
+
+    @property
+    def payload(self):
+        return self.mPayload
+
+
+######################################################
+##
+##  Decode STX | device ID | opcode | payload | XOR | ETX
+##
+######################################################
+
+def decodeVaubanFrame(pFrame):
+
+    lView = memoryview(pFrame)
+
+    if len(lView) < VaubanFrameParser.mMinFrameSize:
+        raise NameError("Invalid frame size : " + str(len(lView)))
+
+    lNibbles = _VAUBAN_NIBBLE_TABLE
+
+    lHigh = lNibbles[ lView[1] ]
+    lMidHigh = lNibbles[ lView[2] ]
+    lMidLow = lNibbles[ lView[3] ]
+    lLow = lNibbles[ lView[4] ]
+
+    if lHigh < 0 or lMidHigh < 0 or lMidLow < 0 or lLow < 0:
+        raise NameError("Invalid device ID in frame")
+
+    lDeviceId = (lHigh << 12) | (lMidHigh << 8) | (lMidLow << 4) | lLow
+
+    lOpcode = chr(lView[5])
+    lPayload = lView[6:-3]
+
+    lState = None
+    lCardId = None
+
+    if len(lPayload) > 0:
+        lState = chr(lPayload[0])
+
+    # enrollment card ID is sent least significant byte first
+    if lOpcode == 'E' and lState == 'S' and len(lPayload) >= 9:
 
+        try:
+            lCardId = binascii.unhexlify(lPayload[1:9])[::-1].hex()
+        except binascii.Error:
+            lCardId = None
 
+    return VaubanFrame(lDeviceId, lOpcode, lState, lCardId, lPayload)
@@ -0,0 +1,544 @@
+﻿import errno
+import json
+import multiprocessing
+import os
+import os.path
+import shutil
+import socket
+import stat
+import struct
+import tempfile
+from threading import Thread
+
+from django.conf import settings
+from common.utils import SharedVar
+from common.logger import Logger
+from websocket.Dependency.websocket_server import SimpleWebSocketServer, SimpleSSLWebSocketServer
+from websocket.WebsocketServer import WebsocketServer, SslWebsocketServer, TrackedWebsocketClient
+from websocket.AsyncWebsocketServer import AsyncWebsocketServer
+
+######################################################
+##
+##   Bus messages : ( kind, target, sender id, packet
+##   or notification events ). Length of a JSON header
+##    then the raw packet, nothing is unpickled from
+##                    the socket
+##
+######################################################
+
+def encodeShardMessage(pMessage):
+
+    lKind, lTarget, lSenderId, lPacket = pMessage
+
+    lEvents = None
+    lText = False
+
+    # ( events, { socket id : join sequence } ), JSON keys are strings
+    if lKind == 'notify':
+        lEvents = [ lPacket[0], list(lPacket[1].items()) ]
+        lPacket = b''
+
+    elif isinstance(lPacket, str):
+        lText = True
+        lPacket = lPacket.encode('utf-8')
+
+    lHeader = json.dumps([ lKind, lTarget, lSenderId, lText, lEvents ]).encode('utf-8')
+
+    return struct.pack('!I', len(lHeader)) + lHeader + bytes(lPacket)
+
+def decodeShardMessage(pData):
+
+    lSize = struct.unpack_from('!I', pData)[0]
+
+    if lSize > len(pData) - 4:
+        raise NameError("Truncated shard message")
+
+    lKind, lTarget, lSenderId, lText, lEvents = json.loads(bytes(pData[ 4:4 + lSize ]).decode('utf-8'))
+
+    if lKind == 'notify':
+        return (lKind, lTarget, lSenderId, ([ tuple(lEvent) for lEvent in lEvents[0] ], { lSocketId : lSequence for lSocketId, lSequence in lEvents[1] }))
+
+    lPacket = bytes(pData[ 4 + lSize: ])
+
+    if lText == True:
+        lPacket = lPacket.decode('utf-8')
+
+    return (lKind, lTarget, lSenderId, lPacket)
+
+######################################################
+##
+##   Bus sockets live in a directory owned by us and
+##     closed to other users, otherwise anyone could
+##       inject messages into every worker
+##
+######################################################
+
+def checkShardDirectory(pDirectory):
+
+    lStat = os.lstat(pDirectory)
+
+    if stat.S_ISDIR(lStat.st_mode) == False or lStat.st_uid != os.getuid() or (lStat.st_mode & 0o077) != 0:
+        raise NameError("Unsafe shard socket directory ( must be a private directory of the current user ) : " + pDirectory)
+
+    return
+
+######################################################
+##
+##     Local IPC bus between workers, one unix
+##        datagram socket per worker
+##
+######################################################
+
+class ShardBus(object):
+
+    mIndex = 0
+    mCount = 0
+    mDirectory = ""
+    mSocket = None
+    mSendSocket = None
+    mPeers = None
+    mHandler = None
+    mRunThread = None
+    mMaxMessageSize = 1048576
+
+    mPublished = 0
+    mReceived = 0
+    mDropped = 0
+
+    def __init__(self, pIndex, pCount, pDirectory):
+
+        self.mIndex = pIndex
+        self.mCount = pCount
+        self.mDirectory = pDirectory
+        self.mPeers = [ self.getPath(pDirectory, lI) for lI in range(pCount) if lI != pIndex ]
+
+        return
+
+    @staticmethod
+    def getPath(pDirectory, pIndex):
+        return os.path.join(pDirectory, "shard-" + str(pIndex) + ".sock")
+
+    def open(self):
+
+        checkShardDirectory(self.mDirectory)
+
+        lPath = self.getPath(self.mDirectory, self.mIndex)
+
+        if os.path.exists(lPath):
+            os.unlink(lPath)
+
+        # blocking reads on the bound socket
+        self.mSocket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.mSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.mMaxMessageSize * 4)
+        self.mSocket.bind(lPath)
+
+        # a stalled worker must not block publishing to the others,
+        # its messages are dropped ( EAGAIN ) instead
+        self.mSendSocket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.mSendSocket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.mMaxMessageSize * 4)
+        self.mSendSocket.setblocking(False)
+
+        return
+
+    ######################################################
+	##
+	##      Send a message to every other worker, a
+	##       worker which is not up yet misses it
+	##
+	######################################################
+
+    def publish(self, pMessage):
+
+        lData = encodeShardMessage(pMessage)
+
+        if len(lData) > self.mMaxMessageSize:
+            self.mDropped += 1
+            return False
+
+        for lPeer in self.mPeers:
+
+            try:
+                self.mSendSocket.sendto(lData, lPeer)
+                self.mPublished += 1
+
+            except (FileNotFoundError, ConnectionRefusedError):
+                self.mDropped += 1
+
+            except OSError as lException:
+
+                if lException.errno not in (errno.EAGAIN, errno.ENOBUFS, errno.EMSGSIZE):
+                    raise
+
+                self.mDropped += 1
+
+        return True
+
+    def start(self, pHandler):
+
+        self.mHandler = pHandler
+
+        self.mRunThread = Thread(target=self._readService)
+        self.mRunThread.daemon = True
+        self.mRunThread.start()
+
+        return
+
+    def _readService(self):
+
+        lBuffer = bytearray(self.mMaxMessageSize)
+        lView = memoryview(lBuffer)
+
+        while True:
+
+            try:
+                lSize = self.mSocket.recv_into(lBuffer)
+            except OSError:
+                return
+
+            self.mReceived += 1
+
+            try:
+                self.mHandler(decodeShardMessage(lView[:lSize]))
+            except Exception as lException:
+                Logger("websocket").Write("[Shard-" + str(self.mIndex) + "] -> Relay error : " + str(lException))
+
+        return
+
+    def close(self):
+
+        if self.mSocket is not None:
+            self.mSocket.close()
+            self.mSocket = None
+
+        if self.mSendSocket is not None:
+            self.mSendSocket.close()
+            self.mSendSocket = None
+
+        return
+
+
+######################################################
+##
+##   Relay broadcasts to the other workers, channel
+##     membership is shared through SharedVar
+##
+######################################################
+
+class ShardRelay(object):
+
+    mShardIndex = 0
+    mShardCount = 1
+    mBus = None
+
+    def initShard(self, pIndex, pCount, pBus, pStoreLock = None):
+
+        from websocket.ChannelHandler.Channel import ChannelRegistry
+
+        self.mShardIndex = pIndex
+        self.mShardCount = pCount
+        self.mBus = pBus
+
+        # worker i hands out ids i + 1, i + 1 + N, i + 1 + 2N ...
+        self.mClientStack.setIdSequence(pIndex + 1 - pCount, pCount)
+
+        # WEBSOCKET_SERVER_CAPACITY is for the whole server, the kernel
+        # spreads connections evenly over the workers
+        if self.mCapacity > 0:
+            self.mCapacity = -(-self.mCapacity // pCount)
+
+        # every worker merges its membership changes into SharedVar
+        ChannelRegistry.setConsistencyMode(ChannelRegistry.CONSISTENCY_SHARED, pStoreLock)
+
+        self.mServiceAlias = self.mServiceAlias + "[Shard-" + str(pIndex) + "]"
+
+        pBus.start(self.onShardMessage)
+
+        return
+
+    # SharedVar channels are cleared once by the launcher, not per worker
+    def resetChannels(self):
+
+        from websocket.ChannelHandler.Channel import ChannelRegistry
+
+        ChannelRegistry.reset()
+
+        return
+
+    ######################################################
+	##
+	##   Bind the listening socket with SO_REUSEPORT,
+	##    used by the select backend which binds in
+	##          SimpleWebSocketServer.__init__
+	##
+	######################################################
+
+    def rebindReusePort(self, pBindedHost, pPort):
+
+        self.serversocket.close()
+
+        lHost = pBindedHost if pBindedHost != '' else None
+        lFamily = socket.AF_INET6 if lHost is None else 0
+
+        lHostInfo = socket.getaddrinfo(lHost, pPort, lFamily, socket.SOCK_STREAM, socket.IPPROTO_TCP, socket.AI_PASSIVE)
+
+        lSocket = socket.socket(lHostInfo[0][0], lHostInfo[0][1], lHostInfo[0][2])
+        lSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        lSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        if lHost is None:
+            lSocket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+
+        lSocket.bind(lHostInfo[0][4])
+        lSocket.listen(getattr(self, 'request_queue_size', 128))
+
+        self.serversocket = lSocket
+        self.listeners = [ lSocket ]
+
+        return
+
+    ######################################################
+	##
+	##      Local delivery first, then other workers
+	##
+	######################################################
+
+    def sendToChannel(self, pPacket, pSender, pChannel):
+
+        if super().sendToChannel(pPacket, pSender, pChannel) == False:
+            return False
+
+        self.mBus.publish(('channel', pChannel, pSender.socketId, pPacket))
+
+        return True
+
+    def sendToAll(self, pPacket, pSender):
+
+        super().sendToAll(pPacket, pSender)
+        self.mBus.publish(('all', None, pSender.socketId, pPacket))
+
+        return True
+
+    def sendToInstId(self, pPacket, pSender, pInstID):
+
+        super().sendToInstId(pPacket, pSender, pInstID)
+        self.mBus.publish(('inst', pInstID, pSender.socketId, pPacket))
+
+        return True
+
+    def sendChannelNotifications(self, pChannelHandler, pEvents, pJoins):
+
+        super().sendChannelNotifications(pChannelHandler, pEvents, pJoins)
+        self.mBus.publish(('notify', pChannelHandler.mCurrentChannel, None, (pEvents, pJoins)))
+
+        return True
+
+    def onShardMessage(self, pMessage):
+
+        from websocket.ChannelHandler.Channel import ChannelRegistry
+
+        lKind, lTarget, lSenderId, lPacket = pMessage
+
+        # without a local handler the channel has no local member
+        if lKind == 'channel' or lKind == 'notify':
+
+            lHandler = ChannelRegistry.find(lTarget)
+
+            if lHandler is None:
+                return
+
+        if lKind == 'channel':
+            self.deliverToChannel(lPacket, lSenderId, lHandler)
+
+        elif lKind == 'all':
+            self.deliverToAll(lPacket, lSenderId)
+
+        elif lKind == 'inst':
+            self.deliverToInstId(lPacket, lSenderId, lTarget)
+
+        elif lKind == 'notify':
+            self.deliverChannelNotifications(lHandler, lPacket[0], lPacket[1])
+
+        return
+
+    @property
+    def shardIndex(self):
+        return self.mShardIndex
+
+    @property
+    def bus(self):
+        return self.mBus
+
+
+class ShardedWebsocketServer(ShardRelay, WebsocketServer):
+
+    def __init__(self, pPort = None, pBindedHost = ''):
+
+        if pPort is None:
+            pPort = int(settings.WEBSOCKET_DEFAULT_PORT)
+
+        WebsocketServer.__init__(self, pPort, pBindedHost, True)
+
+        # bind an ephemeral port first, then take the shared one
+        SimpleWebSocketServer.__init__(self, pBindedHost, 0, TrackedWebsocketClient)
+        self.rebindReusePort(pBindedHost, pPort)
+
+        return
+
+
+class ShardedSslWebsocketServer(ShardRelay, SslWebsocketServer):
+
+    def __init__(self, pCertfile, pKeyfile, pPort = None, pBindedHost = ''):
+
+        if pPort is None:
+            pPort = int(settings.WEBSOCKET_DEFAULT_PORT)
+
+        WebsocketServer.__init__(self, pPort, pBindedHost, True)
+
+        SimpleSSLWebSocketServer.__init__(self, pBindedHost, 0, TrackedWebsocketClient, pCertfile, pKeyfile)
+        self.rebindReusePort(pBindedHost, pPort)
+        self.enableHandshakeOffload(pCertfile, pKeyfile)
+
+        return
+
+
+class ShardedAsyncWebsocketServer(ShardRelay, AsyncWebsocketServer):
+
+    def __init__(self, pPort = None, pBindedHost = '', pCertfile = None, pKeyfile = None):
+        AsyncWebsocketServer.__init__(self, pPort, pBindedHost, pCertfile, pKeyfile, TrackedWebsocketClient, True)
+        return
+
+
+######################################################
+##
+##               Worker process entry
+##
+######################################################
+
+def runShardWorker(pIndex, pCount, pPort, pBindedHost, pCertfile, pKeyfile, pDirectory, pStoreLock = None):
+
+    # never share database connections with the parent process
+    from django import db
+    db.connections.close_all()
+
+    lBackend = getattr(settings, 'WEBSOCKET_BACKEND', 'select')
+
+    if lBackend == 'asyncio':
+        lServer = ShardedAsyncWebsocketServer(pPort, pBindedHost, pCertfile, pKeyfile)
+    elif pCertfile is not None:
+        lServer = ShardedSslWebsocketServer(pCertfile, pKeyfile, pPort, pBindedHost)
+    else:
+        lServer = ShardedWebsocketServer(pPort, pBindedHost)
+
+    lBus = ShardBus(pIndex, pCount, pDirectory)
+    lBus.open()
+
+    lServer.initShard(pIndex, pCount, lBus, pStoreLock)
+
+    # one metrics port per worker, start() then keeps this endpoint
+    lServer.startMetricsEndpoint(pIndex)
+
+    # MySQL ping scheduling and the serving thread
+    lServer.start()
+    lServer.mServerThread.join()
+
+    return
+
+
+######################################################
+##
+##      Run N workers sharing the same port
+##
+######################################################
+
+class ShardedWebsocketLauncher(object):
+
+    mServiceAlias = "[Django-WebSocket-Launcher]"
+    mWorkers = 1
+    mPort = 0
+    mBindedHost = ''
+    mCertfile = None
+    mKeyfile = None
+    mDirectory = None
+    mOwnsDirectory = False
+    mProcesses = None
+
+    def __init__(self, pWorkers = None, pPort = None, pBindedHost = '', pCertfile = None, pKeyfile = None):
+
+        if pWorkers is None:
+            pWorkers = int(getattr(settings, 'WEBSOCKET_WORKERS', os.cpu_count() or 1))
+
+        if pPort is None:
+            pPort = int(settings.WEBSOCKET_DEFAULT_PORT)
+
+        if pWorkers <= 0:
+            raise NameError("Invalid workers count : " + str(pWorkers))
+
+        self.mWorkers = pWorkers
+        self.mPort = int(pPort)
+        self.mBindedHost = pBindedHost
+        self.mCertfile = pCertfile
+        self.mKeyfile = pKeyfile
+        self.mDirectory = getattr(settings, 'WEBSOCKET_SHARD_SOCKET_DIR', None)
+        self.mProcesses = []
+
+        return
+
+    def start(self):
+
+        Logger("websocket").Write(self.mServiceAlias + " -> Start " + str(self.mWorkers) + " workers on port : " + str(self.mPort))
+
+        # private directory with an unpredictable name by default, a
+        # configured one must already be private to the current user
+        if self.mDirectory is None:
+            self.mDirectory = tempfile.mkdtemp(prefix="websocket-shards-" + str(self.mPort) + "-")
+            self.mOwnsDirectory = True
+        else:
+            os.makedirs(self.mDirectory, mode=0o700, exist_ok=True)
+
+        checkShardDirectory(self.mDirectory)
+
+        # channel membership is shared by every worker, clear it once
+        SharedVar('Core').removePattern('Channel', '*')
+
+        lContext = multiprocessing.get_context('fork')
+
+        # serializes the channel membership writes of the workers
+        lStoreLock = lContext.Lock()
+
+        for lI in range(self.mWorkers):
+
+            lProcess = lContext.Process(
+                target=runShardWorker,
+                args=(lI, self.mWorkers, self.mPort, self.mBindedHost, self.mCertfile, self.mKeyfile, self.mDirectory, lStoreLock),
+                name="websocket-shard-" + str(lI))
+
+            lProcess.start()
+            self.mProcesses.append(lProcess)
+
+        return
+
+    def join(self):
+
+        for lProcess in self.mProcesses:
+            lProcess.join()
+
+        return
+
+    def stop(self):
+
+        for lProcess in self.mProcesses:
+            lProcess.terminate()
+
+        self.join()
+        self.mProcesses = []
+
+        if self.mOwnsDirectory == True:
+            shutil.rmtree(self.mDirectory, ignore_errors=True)
+            self.mDirectory = None
+            self.mOwnsDirectory = False
+
+        return
+
+    @property
+    def processes(self):
+        return self.mProcesses
@@ -0,0 +1,252 @@
+﻿######################################################
+##
+##    TLS handshakes off the select loop, resumed
+##      sessions and handshake statistics
+##
+######################################################
+
+import socket
+import ssl
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock, BoundedSemaphore
+
+######################################################
+##
+##        Handshake latency and resumption rate
+##
+######################################################
+
+class TlsHandshakeStats(object):
+
+    mLock = None
+    mLatencies = None
+    mHandshakes = 0
+    mResumed = 0
+    mFailures = 0
+    mTotalTime = 0.0
+    mMaxTime = 0.0
+
+    def __init__(self, pWindow = 4096):
+
+        self.mLock = Lock()
+        self.mLatencies = deque(maxlen=pWindow)
+
+        return
+
+    def record(self, pElapsed, pResumed):
+
+        with self.mLock:
+
+            self.mHandshakes += 1
+            self.mTotalTime += pElapsed
+            self.mLatencies.append(pElapsed)
+
+            if pResumed == True:
+                self.mResumed += 1
+
+            if pElapsed > self.mMaxTime:
+                self.mMaxTime = pElapsed
+
+        return
+
+    def recordFailure(self):
+
+        with self.mLock:
+            self.mFailures += 1
+
+        return
+
+    def getStats(self):
+
+        with self.mLock:
+
+            lLatencies = sorted(self.mLatencies)
+            lCount = len(lLatencies)
+
+            return {
+                'handshakes' : self.mHandshakes,
+                'resumed' : self.mResumed,
+                'failures' : self.mFailures,
+                'resumption_rate' : float(self.mResumed) / self.mHandshakes if self.mHandshakes > 0 else 0.0,
+                'avg_ms' : self.mTotalTime * 1000.0 / self.mHandshakes if self.mHandshakes > 0 else 0.0,
+                'p50_ms' : lLatencies[ lCount // 2 ] * 1000.0 if lCount > 0 else 0.0,
+                'p99_ms' : lLatencies[ min(lCount - 1, (lCount * 99) // 100) ] * 1000.0 if lCount > 0 else 0.0,
+                'max_ms' : self.mMaxTime * 1000.0,
+            }
+
+
+######################################################
+##
+##   Stands in for the listening socket of the select
+##   loop : connections are accepted and handshaked
+##   by worker threads, accept() hands out finished
+##    TLS sockets, a socketpair wakes up select()
+##
+######################################################
+
+class TlsHandshakeListener(object):
+
+    mListenSocket = None
+    mContext = None
+    mExecutor = None
+    mSlots = None
+    mAcceptThread = None
+    mWakeReader = None
+    mWakeWriter = None
+    mReady = None
+    mTimeout = 10.0
+    mStats = None
+    mClosed = False
+
+    def __init__(self, pListenSocket, pContext, pWorkers = 4, pTimeout = 10.0, pStats = None):
+
+        if pWorkers <= 0:
+            raise NameError("Invalid handshake workers : " + str(pWorkers))
+
+        if pStats is None:
+            pStats = TlsHandshakeStats()
+
+        self.mListenSocket = pListenSocket
+        self.mContext = pContext
+        self.mExecutor = ThreadPoolExecutor(max_workers=pWorkers)
+
+        # connections waiting for a worker stay in the kernel backlog
+        self.mSlots = BoundedSemaphore(pWorkers * 4)
+
+        self.mWakeReader, self.mWakeWriter = socket.socketpair()
+        self.mWakeReader.setblocking(False)
+
+        self.mReady = deque()
+        self.mTimeout = pTimeout
+        self.mStats = pStats
+
+        return
+
+    def start(self):
+
+        if self.mAcceptThread is not None:
+            return
+
+        self.mListenSocket.setblocking(True)
+
+        self.mAcceptThread = Thread(target=self._acceptService)
+        self.mAcceptThread.daemon = True
+        self.mAcceptThread.start()
+
+        return
+
+    def _acceptService(self):
+
+        while self.mClosed == False:
+
+            self.mSlots.acquire()
+
+            try:
+                lSocket, lAddress = self.mListenSocket.accept()
+            except OSError:
+                self.mSlots.release()
+
+                if self.mClosed == True:
+                    return
+
+                continue
+
+            self.mExecutor.submit(self._handshakeTask, lSocket, lAddress)
+
+        return
+
+    def _handshakeTask(self, pSocket, pAddress):
+
+        try:
+
+            lStart = time.perf_counter()
+
+            pSocket.settimeout(self.mTimeout)
+
+            lSslSocket = self.mContext.wrap_socket(pSocket, server_side=True, do_handshake_on_connect=False)
+            lSslSocket.do_handshake()
+
+            self.mStats.record(time.perf_counter() - lStart, lSslSocket.session_reused)
+
+            self.mReady.append((lSslSocket, pAddress))
+            self.mWakeWriter.send(b'\x00')
+
+        except (OSError, ValueError):
+
+            self.mStats.recordFailure()
+            pSocket.close()
+
+        finally:
+            self.mSlots.release()
+
+        return
+
+    ######################################################
+	##
+	##       Listening socket surface used by the
+	##                 select loop
+	##
+	######################################################
+
+    def fileno(self):
+        return self.mWakeReader.fileno()
+
+    def accept(self):
+
+        self.mWakeReader.recv(1)
+
+        # raises IndexError if nothing is ready, the loop ignores it
+        return self.mReady.popleft()
+
+    def close(self):
+
+        self.mClosed = True
+
+        # wakes up the blocking accept() of the accept thread
+        try:
+            self.mListenSocket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        self.mListenSocket.close()
+        self.mExecutor.shutdown(wait=False)
+
+        while len(self.mReady) > 0:
+            self.mReady.popleft()[0].close()
+
+        self.mWakeReader.close()
+        self.mWakeWriter.close()
+
+        return
+
+    @property
+    def stats(self):
+        return self.mStats
+
+    @property
+    def pending(self):
+        return len(self.mReady)
+
+
+######################################################
+##
+##    Server context tuned for resumption : session
+##     cache ( TLS 1.2 ) and session tickets ( 1.3 )
+##
+######################################################
+
+def createServerContext(pCertfile, pKeyfile, pTickets = 2):
+
+    lContext = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    lContext.load_cert_chain(pCertfile, pKeyfile)
+
+    # the OpenSSL server session cache is on by default, it only
+    # works because every connection shares this one context
+    if pTickets <= 0:
+        lContext.options |= ssl.OP_NO_TICKET
+    else:
+        lContext.num_tickets = pTickets
+
+    return lContext
@@ -0,0 +1,444 @@
+﻿import time
+import json
+import os
+import os.path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, BoundedSemaphore
+
+from DeciboxApi import DeciboxAPI
+from Packet import VaubanOpcodeHandler
+from common.logger import Logger
+
+######################################################
+##
+##     Local access decision cache, keyed by card ID
+##    and interface ( None interface = every reader )
+##
+######################################################
+
+class VaubanAccessCache(object):
+
+    mEntries = None
+    mLock = None
+    mTTL = 30.0
+    mMaxStale = 86400.0
+    mMaxSize = 100000
+
+    mHits = 0
+    mStaleHits = 0
+    mMisses = 0
+    mEvictions = 0
+
+    def __init__(self, pTTL = 30.0, pMaxSize = 100000, pMaxStale = 86400.0):
+
+        if pMaxSize <= 0:
+            raise NameError("Invalid cache size : " + str(pMaxSize))
+
+        self.mEntries = OrderedDict()
+        self.mLock = Lock()
+        self.mTTL = float(pTTL)
+        self.mMaxSize = pMaxSize
+        self.mMaxStale = float(pMaxStale)
+
+        return
+
+    ######################################################
+	##
+	##   Return ( result, isFresh, expiredFor ), stale
+	##   entries are kept for offline answers up to
+	##   mMaxStale, expiredFor is None on a miss and 0
+	##                on a fresh entry
+	##
+	######################################################
+
+    def lookup(self, pCardId, pInterface):
+
+        lNow = time.time()
+
+        with self.mLock:
+
+            lKey = (pCardId, pInterface)
+            lEntry = self.mEntries.get(lKey, None)
+
+            if lEntry is None:
+                lKey = (pCardId, None)
+                lEntry = self.mEntries.get(lKey, None)
+
+            if lEntry is None or lNow - lEntry[1] > self.mMaxStale:
+                self.mMisses += 1
+                return (None, False, None)
+
+            self.mEntries.move_to_end(lKey)
+
+            if lEntry[2] > lNow:
+                self.mHits += 1
+                return (lEntry[0], True, 0.0)
+
+            self.mStaleHits += 1
+
+            return (lEntry[0], False, lNow - lEntry[2])
+
+    def put(self, pCardId, pInterface, pResult, pTTL = None, pStored = None):
+
+        if pTTL is None:
+            pTTL = self.mTTL
+
+        if pStored is None:
+            pStored = time.time()
+
+        lKey = (pCardId, pInterface)
+
+        with self.mLock:
+
+            self.mEntries[ lKey ] = (pResult, pStored, pStored + pTTL)
+            self.mEntries.move_to_end(lKey)
+
+            while len(self.mEntries) > self.mMaxSize:
+                self.mEntries.popitem(last=False)
+                self.mEvictions += 1
+
+        return
+
+    def invalidate(self, pCardId = None):
+
+        with self.mLock:
+
+            if pCardId is None:
+                self.mEntries.clear()
+            else:
+                for lKey in [ lKey for lKey in self.mEntries if lKey[0] == pCardId ]:
+                    del self.mEntries[ lKey ]
+
+        return
+
+    ######################################################
+	##
+	##          On-disk snapshot and bulk preload
+	##
+	######################################################
+
+    def save(self, pPath):
+
+        with self.mLock:
+
+            lEntries = [
+                { 'card' : lKey[0], 'interface' : lKey[1], 'access' : lEntry[0], 'stored' : lEntry[1], 'expires' : lEntry[2] }
+                for lKey, lEntry in self.mEntries.items()
+            ]
+
+        lTmpPath = pPath + ".tmp"
+
+        with open(lTmpPath, 'w') as lFile:
+            json.dump({ 'version' : 1, 'entries' : lEntries }, lFile)
+
+        os.replace(lTmpPath, pPath)
+
+        return len(lEntries)
+
+    def load(self, pPath, pTTL = None):
+
+        # accept a snapshot written by save() or a plain list of entries
+        with open(pPath, 'r') as lFile:
+            lData = json.load(lFile)
+
+        if type(lData) is dict:
+            lData = lData.get('entries', [])
+
+        lNow = time.time()
+
+        for lEntry in lData:
+
+            lStored = lEntry.get('stored', lNow)
+            lTTL = pTTL
+
+            if lTTL is None:
+                lTTL = lEntry.get('expires', lStored + self.mTTL) - lStored
+
+            self.put(lEntry['card'], lEntry.get('interface', None), lEntry['access'], lTTL, lStored)
+
+        return len(lData)
+
+    def getStats(self):
+
+        with self.mLock:
+
+            lRequests = self.mHits + self.mStaleHits + self.mMisses
+
+            return {
+                'size' : len(self.mEntries),
+                'max_size' : self.mMaxSize,
+                'hits' : self.mHits,
+                'stale_hits' : self.mStaleHits,
+                'misses' : self.mMisses,
+                'evictions' : self.mEvictions,
+                'hit_rate' : float(self.mHits + self.mStaleHits) / lRequests if lRequests > 0 else 0.0,
+            }
+
+
+######################################################
+##
+##   Dispatch DeciboxAPI access checks to a bounded
+##    worker pool and route replies to the reader
+##
+######################################################
+
+class VaubanAccessDispatcher(object):
+
+    mServiceAlias = "[Vauban-Access]"
+    mClient = None
+    mExecutor = None
+    mSlots = None
+    mHandler = None
+    mReplyCallback = None
+    mLock = None
+    mCache = None
+    mPending = None
+    mSnapshotPath = None
+
+    # seconds past its TTL an entry may still answer while the backend
+    # is asked again, 0 waits for the backend ( a revoked card must not
+    # open once its TTL is over )
+    mServeStale = 0.0
+
+    # offline mode, forced or tripped by consecutive backend failures
+    mForceOffline = False
+    mOfflineUntil = 0.0
+    mOfflineThreshold = 3
+    mOfflineCooldown = 30.0
+    mConsecutiveFailures = 0
+
+    mRequests = 0
+    mCacheHits = 0
+    mOfflineAnswers = 0
+    mRejected = 0
+    mFailures = 0
+
+    def __init__(self, pWorkers = 4, pMaxPending = 64, pTTL = 30.0, pClient = None, pReplyCallback = None, pCache = None, pSnapshotPath = None, pServeStale = 0.0):
+
+        if pWorkers <= 0 or pMaxPending < pWorkers:
+            raise NameError("Invalid pool size : " + str(pWorkers) + " / " + str(pMaxPending))
+
+        if pClient is None:
+            pClient = DeciboxAPI()
+
+        if pReplyCallback is None:
+            pReplyCallback = self.sendAccessReply
+
+        self.mClient = pClient
+        self.mExecutor = ThreadPoolExecutor(max_workers=pWorkers)
+        self.mSlots = BoundedSemaphore(pMaxPending)
+        self.mHandler = VaubanOpcodeHandler()
+        self.mReplyCallback = pReplyCallback
+        if pCache is None:
+            pCache = VaubanAccessCache(pTTL)
+
+        self.mLock = Lock()
+        self.mCache = pCache
+        self.mPending = set()
+        self.mSnapshotPath = pSnapshotPath
+        self.mServeStale = float(pServeStale)
+
+        if pSnapshotPath is not None and os.path.exists(pSnapshotPath):
+            self.mCache.load(pSnapshotPath)
+
+        return
+
+    ######################################################
+	##
+	##    Answer from cache or queue a backend request,
+	##    return False when the pool is saturated. Stale
+	##    entries only answer offline, on a saturated
+	##    pool or within mServeStale past their TTL
+	##
+	######################################################
+
+    def checkAccess(self, pCardId, pDevicePtr):
+
+        lKey = (pCardId, pDevicePtr.interface)
+        lResult, lFresh, lExpiredFor = self.mCache.lookup(pCardId, pDevicePtr.interface)
+
+        with self.mLock:
+
+            self.mRequests += 1
+
+            if lFresh == True:
+                self.mCacheHits += 1
+                lReply = True
+                lSubmit = False
+
+            elif self.isOffline() == True:
+                self.mOfflineAnswers += 1
+                lReply = True
+
+                if lResult is None:
+                    lResult = False
+
+                lSubmit = False
+
+            elif lKey in self.mPending:
+                return True
+
+            # a slot is only taken on this branch, the task owns it
+            elif self.mSlots.acquire(False) == False:
+
+                self.mRejected += 1
+
+                if lResult is None:
+                    return False
+
+                # saturated backend, answer from the stale decision
+                self.mOfflineAnswers += 1
+                lReply = True
+                lSubmit = False
+
+            else:
+
+                self.mPending.add(lKey)
+                lSubmit = True
+
+                # recently expired and serving stale allowed : answer
+                # now, refresh in background
+                lReply = lResult is not None and lExpiredFor < self.mServeStale
+
+                if lReply == True:
+                    self.mOfflineAnswers += 1
+
+        if lReply == True:
+            self.mReplyCallback(pDevicePtr, pCardId, lResult)
+
+        if lSubmit == False:
+            return True
+
+        try:
+            self.mExecutor.submit(self._checkAccessTask, lKey, pCardId, pDevicePtr, lReply == False)
+
+        # executor shut down, give the slot back
+        except RuntimeError:
+
+            self._releaseSlot(lKey)
+
+            return lReply
+
+        return True
+
+    def _checkAccessTask(self, pKey, pCardId, pDevicePtr, pReply):
+
+        try:
+            lResult = self.mClient.checkAccess(pCardId, pDevicePtr.interface)
+
+            self.mCache.put(pCardId, pDevicePtr.interface, lResult)
+
+            with self.mLock:
+                self.mConsecutiveFailures = 0
+
+        except Exception as lException:
+
+            Logger("vauban").Write(self.mServiceAlias + " -> Access check failed for " + str(pCardId) + " : " + str(lException))
+
+            with self.mLock:
+
+                self.mFailures += 1
+                self.mConsecutiveFailures += 1
+
+                if self.mConsecutiveFailures >= self.mOfflineThreshold:
+                    self.mOfflineUntil = time.monotonic() + self.mOfflineCooldown
+
+            # fail closed
+            lResult = False
+
+        finally:
+            self._releaseSlot(pKey)
+
+        if pReply == False:
+            return
+
+        # nothing would report an exception raised in a pool thread
+        try:
+            self.mReplyCallback(pDevicePtr, pCardId, lResult)
+        except Exception as lException:
+            Logger("vauban").Write(self.mServiceAlias + " -> Access reply failed for " + str(pCardId) + " : " + str(lException))
+
+        return
+
+    def _releaseSlot(self, pKey):
+
+        with self.mLock:
+            self.mPending.discard(pKey)
+
+        self.mSlots.release()
+
+        return
+
+    ######################################################
+	##
+	##   Offline : only the local cache answers, unknown
+	##                 cards are denied
+	##
+	######################################################
+
+    def isOffline(self):
+        return self.mForceOffline == True or self.mOfflineUntil > time.monotonic()
+
+    def setOffline(self, pOffline):
+        self.mForceOffline = pOffline
+        return
+
+    def preload(self, pPath, pTTL = None):
+        return self.mCache.load(pPath, pTTL)
+
+    def saveSnapshot(self, pPath = None):
+
+        if pPath is None:
+            pPath = self.mSnapshotPath
+
+        if pPath is None:
+            return 0
+
+        return self.mCache.save(pPath)
+
+    ######################################################
+	##
+	##      Default reply : green or red led and bip
+	##
+	######################################################
+
+    def sendAccessReply(self, pDevicePtr, pCardId, pResult):
+
+        if pResult:
+            self.mHandler.sendLedPacket(0x00, 0xFF, 0x00, 10, 1, pDevicePtr)
+        else:
+            self.mHandler.sendLedPacket(0xFF, 0x00, 0x00, 10, 1, pDevicePtr)
+
+        self.mHandler.sendBuzzerPacket(1, 10, 1, pDevicePtr)
+
+        return
+
+    def invalidate(self, pCardId = None):
+        self.mCache.invalidate(pCardId)
+        return
+
+    def shutdown(self, pWait = True):
+
+        self.mExecutor.shutdown(wait=pWait)
+        self.saveSnapshot()
+
+        return
+
+    def getStats(self):
+
+        with self.mLock:
+
+            lStats = {
+                'requests' : self.mRequests,
+                'cache_hits' : self.mCacheHits,
+                'offline_answers' : self.mOfflineAnswers,
+                'pending' : len(self.mPending),
+                'rejected' : self.mRejected,
+                'failures' : self.mFailures,
+                'offline' : self.isOffline(),
+            }
+
+        lStats['cache'] = self.mCache.getStats()
+
+        return lStats
@@ -0,0 +1,413 @@
+﻿import asyncio
+import os
+import os.path
+import serial
+
+from Packet import VaubanOpcodeHandler, VaubanFrameParser
+
+######################################################
+##
+##        Vauban device driven by an event loop
+##
+######################################################
+
+class AsyncVaubanDevice(object):
+
+    mDevicePtr = None
+    mDeviceID = 0
+    mInterface = ""
+    mLoop = None
+    mParser = None
+    mQueue = None
+    mWriteBuffer = None
+    mDrainWaiters = None
+    mFramesOverflow = 0
+    mLost = False
+    mLostReason = ""
+
+    def __init__(self, pInterface, pDeviceID, pLoop, pQueueSize = 256):
+
+        if pDeviceID is None or pDeviceID <= 0:
+            raise NameError("Invalid deviceID : " + str(pDeviceID))
+
+        if os.path.exists(pInterface) == False :
+            raise NameError("Invalid interface " + pInterface)
+
+        # timeout=0 keeps the file descriptor non-blocking
+        self.mDevicePtr = serial.Serial(
+            port=pInterface,
+            baudrate=19200,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_ONE,
+            bytesize=serial.EIGHTBITS,
+            timeout=0,
+            write_timeout=0)
+
+        if self.mDevicePtr.is_open == False:
+            raise NameError("Could not open interface " + pInterface + " maybe busy ? ")
+
+        self.mDeviceID = pDeviceID
+        self.mInterface = pInterface
+        self.mLoop = pLoop
+        self.mParser = VaubanFrameParser()
+        self.mQueue = asyncio.Queue(pQueueSize)
+        self.mWriteBuffer = bytearray()
+        self.mDrainWaiters = []
+
+        self.mLoop.add_reader(self.mDevicePtr.fileno(), self._onReadable)
+
+        return
+
+    ######################################################
+	##
+	##       Read everything available, queue frames
+	##
+	######################################################
+
+    def _onReadable(self):
+
+        try:
+            lData = os.read(self.mDevicePtr.fileno(), 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as lException:
+            self._onLost(str(lException))
+            return
+
+        # unplugged adapter or closed pty, the descriptor would
+        # stay readable forever
+        if len(lData) == 0:
+            self._onLost("end of file")
+            return
+
+        for lFrame in self.mParser.feed(lData):
+
+            # keep the freshest frames when the consumer lags behind
+            if self.mQueue.full():
+                self.mQueue.get_nowait()
+                self.mFramesOverflow += 1
+
+            self.mQueue.put_nowait(lFrame)
+
+        return
+
+    ######################################################
+	##
+	##    Non-blocking write, remainder is flushed when
+	##         the descriptor becomes writable
+	##
+	######################################################
+
+    def write(self, pData):
+
+        if self.mLost == True:
+            raise NameError("Device lost " + self.mInterface + " : " + self.mLostReason)
+
+        if len(self.mWriteBuffer) == 0:
+
+            try:
+                lWritten = os.write(self.mDevicePtr.fileno(), pData)
+            except (BlockingIOError, InterruptedError):
+                lWritten = 0
+            except OSError as lException:
+                self._onLost(str(lException))
+                raise NameError("Device lost " + self.mInterface + " : " + self.mLostReason)
+
+            if lWritten == len(pData):
+                return lWritten
+
+            self.mLoop.add_writer(self.mDevicePtr.fileno(), self._onWritable)
+            pData = pData[lWritten:]
+
+        self.mWriteBuffer += pData
+
+        return len(pData)
+
+    def _onWritable(self):
+
+        try:
+            lWritten = os.write(self.mDevicePtr.fileno(), self.mWriteBuffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as lException:
+            self._onLost(str(lException))
+            return
+
+        del self.mWriteBuffer[:lWritten]
+
+        if len(self.mWriteBuffer) > 0:
+            return
+
+        self.mLoop.remove_writer(self.mDevicePtr.fileno())
+
+        for lWaiter in self.mDrainWaiters:
+            if lWaiter.done() == False:
+                lWaiter.set_result(None)
+
+        self.mDrainWaiters.clear()
+
+        return
+
+    async def drain(self):
+
+        if self.mLost == True:
+            raise NameError("Device lost " + self.mInterface + " : " + self.mLostReason)
+
+        if len(self.mWriteBuffer) == 0:
+            return
+
+        lWaiter = self.mLoop.create_future()
+        self.mDrainWaiters.append(lWaiter)
+
+        await lWaiter
+
+        return
+
+    async def receive(self):
+
+        # frames read before the loss are still served
+        if self.mLost == True and self.mQueue.empty():
+            raise NameError("Device lost " + self.mInterface + " : " + self.mLostReason)
+
+        lFrame = await self.mQueue.get()
+
+        if lFrame is None:
+            self.mQueue.put_nowait(None)
+            raise NameError("Device lost " + self.mInterface + " : " + self.mLostReason)
+
+        return lFrame
+
+    ######################################################
+	##
+	##    Descriptor gone ( EOF, EIO ... ) : stop
+	##   watching it, fail pending drains and wake
+	##               pending receivers
+	##
+	######################################################
+
+    def _onLost(self, pReason):
+
+        if self.mLost == True:
+            return
+
+        self.mLost = True
+        self.mLostReason = pReason
+
+        for lWaiter in self.mDrainWaiters:
+            if lWaiter.done() == False:
+                lWaiter.set_exception(NameError("Device lost " + self.mInterface + " : " + pReason))
+
+        self.mDrainWaiters.clear()
+
+        self.close()
+
+        return
+
+    ######################################################
+	##
+	##   Close the descriptor, whatever the kernel takes
+	##   of pending writes is still sent, and pending
+	##    receivers are woken like on a lost device
+	##
+	######################################################
+
+    def close(self):
+
+        if self.mDevicePtr.is_open == False:
+            return
+
+        if self.mLost == False and len(self.mWriteBuffer) > 0:
+
+            try:
+                os.write(self.mDevicePtr.fileno(), self.mWriteBuffer)
+            except OSError:
+                pass
+
+        self.mLoop.remove_reader(self.mDevicePtr.fileno())
+
+        if len(self.mWriteBuffer) > 0:
+            self.mLoop.remove_writer(self.mDevicePtr.fileno())
+
+        for lWaiter in self.mDrainWaiters:
+            if lWaiter.done() == False:
+                lWaiter.cancel()
+
+        self.mDrainWaiters.clear()
+        self.mWriteBuffer.clear()
+        self.mDevicePtr.close()
+
+        if self.mLost == False:
+            self.mLost = True
+            self.mLostReason = "closed"
+
+        # receive() awaiters get the sentinel instead of hanging
+        if self.mQueue.full():
+            self.mQueue.get_nowait()
+            self.mFramesOverflow += 1
+
+        self.mQueue.put_nowait(None)
+
+        return
+
+    # flush pending writes ( frames already handed to write() )
+    # before closing, at most pTimeout seconds
+    async def shutdown(self, pTimeout = 1.0):
+
+        try:
+            await asyncio.wait_for(self.drain(), pTimeout)
+        except (asyncio.TimeoutError, NameError):
+            pass
+
+        self.close()
+
+        return
+
+    ######################################################
+	##
+	##                 Class properties
+	##
+	######################################################
+
+    @property
+    def deviceId(self):
+        return int(self.mDeviceID)
+
+    # VaubanOpcodeHandler writes through device.write()
+    @property
+    def device(self):
+        return self
+
+    @property
+    def interface(self):
+        return self.mInterface
+
+    @property
+    def parser(self):
+        return self.mParser
+
+    @property
+    def queue(self):
+        return self.mQueue
+
+    @property
+    def framesOverflow(self):
+        return self.mFramesOverflow
+
+    @property
+    def lost(self):
+        return self.mLost
+
+    @property
+    def lostReason(self):
+        return self.mLostReason
+
+
+######################################################
+##
+##     Multiplex many Vauban readers on one loop
+##
+######################################################
+
+class VaubanDeviceManager(object):
+
+    mDevices = None
+    mLoop = None
+    mHandler = None
+    mQueueSize = 256
+
+    def __init__(self, pLoop = None, pQueueSize = 256):
+
+        self.mDevices = {}
+        self.mLoop = pLoop
+        self.mHandler = VaubanOpcodeHandler()
+        self.mQueueSize = pQueueSize
+
+        return
+
+    ######################################################
+	##
+	##              Devices registration
+	##
+	######################################################
+
+    def addDevice(self, pInterface, pDeviceID):
+
+        if pDeviceID in self.mDevices:
+            raise NameError("DeviceID already registered : " + str(pDeviceID))
+
+        if self.mLoop is None:
+            self.mLoop = asyncio.get_running_loop()
+
+        lDevice = AsyncVaubanDevice(pInterface, pDeviceID, self.mLoop, self.mQueueSize)
+        self.mDevices[ pDeviceID ] = lDevice
+
+        return lDevice
+
+    def removeDevice(self, pDeviceID):
+
+        lDevice = self.mDevices.pop(pDeviceID, None)
+
+        if lDevice is not None:
+            lDevice.close()
+
+        return lDevice
+
+    def getDevice(self, pDeviceID):
+        return self.mDevices.get(pDeviceID, None)
+
+    def close(self):
+
+        for lDevice in self.mDevices.values():
+            lDevice.close()
+
+        self.mDevices.clear()
+
+        return
+
+    async def shutdown(self, pTimeout = 1.0):
+
+        lDevices = list(self.mDevices.values())
+        self.mDevices.clear()
+
+        await asyncio.gather(*[ lDevice.shutdown(pTimeout) for lDevice in lDevices ])
+
+        return
+
+    async def receive(self, pDeviceID):
+        return await self.mDevices[ pDeviceID ].receive()
+
+    ######################################################
+	##
+	##      Sending handler, mirrors VaubanOpcodeHandler
+	##
+	######################################################
+
+    async def sendLedPacket(self, pRedValue, pGreenValue, pBlueValue, pTime, pRepeat, pDevicePtr):
+        self.mHandler.sendLedPacket(pRedValue, pGreenValue, pBlueValue, pTime, pRepeat, pDevicePtr)
+        await pDevicePtr.drain()
+
+    async def sendBuzzerPacket(self, pState, pTime, pRepeat, pDevicePtr):
+        self.mHandler.sendBuzzerPacket(pState, pTime, pRepeat, pDevicePtr)
+        await pDevicePtr.drain()
+
+    async def sendEnrollementPacket(self, pFingerCount, pDevicePtr):
+        self.mHandler.sendEnrollementPacket(pFingerCount, pDevicePtr)
+        await pDevicePtr.drain()
+
+    async def sendPollingPacket(self, pDevicePtr):
+        self.mHandler.sendPollingPacket(pDevicePtr)
+        await pDevicePtr.drain()
+
+    async def sendVerificationPacket(self, pMode, pDevicePtr):
+        self.mHandler.sendVerificationPacket(pMode, pDevicePtr)
+        await pDevicePtr.drain()
+
+    ######################################################
+	##
+	##                 Class properties
+	##
+	######################################################
+
+    @property
+    def devices(self):
+        return self.mDevices
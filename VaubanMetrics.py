@@ -0,0 +1,391 @@
+﻿import time
+from collections import deque
+from threading import Thread, Lock, Event
+from common.logger import Logger
+
+######################################################
+##
+##     Count, average, percentiles and max of a
+##          window of recent durations
+##
+######################################################
+
+class VaubanTimingStats(object):
+
+    mLatencies = None
+    mCount = 0
+    mTotalTime = 0.0
+    mMaxTime = 0.0
+
+    def __init__(self, pWindow = 1024):
+
+        self.mLatencies = deque(maxlen=pWindow)
+
+        return
+
+    # callers hold the VaubanLinkMetrics lock
+    def record(self, pElapsed):
+
+        self.mCount += 1
+        self.mTotalTime += pElapsed
+        self.mLatencies.append(pElapsed)
+
+        if pElapsed > self.mMaxTime:
+            self.mMaxTime = pElapsed
+
+        return
+
+    def getStats(self):
+
+        lLatencies = sorted(self.mLatencies)
+        lCount = len(lLatencies)
+
+        return {
+            'count' : self.mCount,
+            'avg_ms' : self.mTotalTime * 1000.0 / self.mCount if self.mCount > 0 else 0.0,
+            'p50_ms' : lLatencies[ lCount // 2 ] * 1000.0 if lCount > 0 else 0.0,
+            'p99_ms' : lLatencies[ min(lCount - 1, (lCount * 99) // 100) ] * 1000.0 if lCount > 0 else 0.0,
+            'max_ms' : self.mMaxTime * 1000.0,
+        }
+
+
+######################################################
+##
+##    Serial link metrics of one reader, frame and
+##    XOR counters are read from the device parser
+##
+######################################################
+
+class VaubanLinkMetrics(object):
+
+    mDevicePtr = None
+    mLock = None
+
+    mBytesIn = 0
+    mBytesOut = 0
+    mFramesOut = 0
+
+    mDecodeTime = None
+    mCallbackTime = None
+    mEnrollmentTime = None
+
+    mEnrollmentStart = None
+    mEnrollmentsSent = 0
+    mEnrollmentsAnswered = 0
+    mEnrollmentsLost = 0
+
+    def __init__(self, pDevicePtr, pWindow = 1024):
+
+        self.mDevicePtr = pDevicePtr
+        self.mLock = Lock()
+        self.mDecodeTime = VaubanTimingStats(pWindow)
+        self.mCallbackTime = VaubanTimingStats(pWindow)
+        self.mEnrollmentTime = VaubanTimingStats(pWindow)
+
+        return
+
+    def onRead(self, pSize):
+
+        with self.mLock:
+            self.mBytesIn += pSize
+
+        return
+
+    # every write of the opcode handler and the scheduler is one frame
+    def onWrite(self, pSize):
+
+        with self.mLock:
+            self.mBytesOut += pSize
+            self.mFramesOut += 1
+
+        return
+
+    def onDecode(self, pElapsed):
+
+        with self.mLock:
+            self.mDecodeTime.record(pElapsed)
+
+        return
+
+    def onCallback(self, pElapsed):
+
+        with self.mLock:
+            self.mCallbackTime.record(pElapsed)
+
+        return
+
+    ######################################################
+	##
+	##   Enrollment round trip, from the request write
+	##    to the 'E' answer, an unanswered request is
+	##         counted lost when the next one is sent
+	##
+	######################################################
+
+    def onEnrollmentSent(self):
+
+        with self.mLock:
+
+            if self.mEnrollmentStart is not None:
+                self.mEnrollmentsLost += 1
+
+            self.mEnrollmentStart = time.monotonic()
+            self.mEnrollmentsSent += 1
+
+        return
+
+    def onEnrollmentAnswered(self):
+
+        lNow = time.monotonic()
+
+        with self.mLock:
+
+            # 'E' frames nobody asked for have no round trip
+            if self.mEnrollmentStart is None:
+                return
+
+            self.mEnrollmentTime.record(lNow - self.mEnrollmentStart)
+            self.mEnrollmentStart = None
+            self.mEnrollmentsAnswered += 1
+
+        return
+
+    def getStats(self):
+
+        lParser = self.mDevicePtr.parser
+
+        with self.mLock:
+
+            return {
+                'device_id' : self.mDevicePtr.deviceId,
+                'interface' : self.mDevicePtr.interface,
+                'bytes_in' : self.mBytesIn,
+                'bytes_out' : self.mBytesOut,
+                'frames_in' : lParser.framesDecoded,
+                'frames_out' : self.mFramesOut,
+                'xor_failures' : lParser.xorFailures,
+                'frames_corrupt' : lParser.framesCorrupt,
+                'frames_dropped' : lParser.framesDropped,
+                'bytes_dropped' : lParser.bytesDropped,
+                'enrollments_sent' : self.mEnrollmentsSent,
+                'enrollments_answered' : self.mEnrollmentsAnswered,
+                'enrollments_lost' : self.mEnrollmentsLost,
+                'decode' : self.mDecodeTime.getStats(),
+                'callback' : self.mCallbackTime.getStats(),
+                'enrollment' : self.mEnrollmentTime.getStats(),
+            }
+
+
+######################################################
+##
+##    Serial port proxy counting written bytes and
+##                    frames
+##
+######################################################
+
+class VaubanMeteredPort(object):
+
+    mPort = None
+    mMetrics = None
+
+    def __init__(self, pPort, pMetrics):
+
+        self.mPort = pPort
+        self.mMetrics = pMetrics
+
+        return
+
+    def write(self, pData):
+
+        lWritten = self.mPort.write(pData)
+        self.mMetrics.onWrite(len(pData))
+
+        return lWritten
+
+    def __getattr__(self, pName):
+        return getattr(self.mPort, pName)
+
+
+######################################################
+##
+##     Sinks receive a getStats() snapshot of every
+##         reported device on each interval
+##
+######################################################
+
+class VaubanMetricsSink(object):
+
+    def publish(self, pStats):
+        return
+
+
+class VaubanLogSink(VaubanMetricsSink):
+
+    mServiceAlias = "[Vauban-Metrics]"
+
+    def publish(self, pStats):
+
+        Logger("vauban").Write(self.mServiceAlias + " -> reader %d ( %s ) : in %d B / %d frames, out %d B / %d frames, xor failures %d, dropped %d, decode p99 %.3f ms, callback p99 %.3f ms, enrollment p99 %.1f ms" % (
+            pStats['device_id'], pStats['interface'],
+            pStats['bytes_in'], pStats['frames_in'], pStats['bytes_out'], pStats['frames_out'],
+            pStats['xor_failures'], pStats['frames_dropped'],
+            pStats['decode']['p99_ms'], pStats['callback']['p99_ms'], pStats['enrollment']['p99_ms']))
+
+        return
+
+
+######################################################
+##
+##    Compare each snapshot with the previous one of
+##    the same device, pCallback( deviceId, reasons,
+##       stats ) is called when the line degrades
+##
+######################################################
+
+class VaubanLineHealthSink(VaubanMetricsSink):
+
+    mCallback = None
+    mMaxErrorRate = 0.01
+    mMaxEnrollmentTime = 2.0
+    mMinFrames = 20
+    mLastStats = None
+
+    def __init__(self, pCallback, pMaxErrorRate = 0.01, pMaxEnrollmentTime = 2.0, pMinFrames = 20):
+
+        self.mCallback = pCallback
+        self.mMaxErrorRate = pMaxErrorRate
+        self.mMaxEnrollmentTime = pMaxEnrollmentTime
+        self.mMinFrames = pMinFrames
+        self.mLastStats = {}
+
+        return
+
+    def publish(self, pStats):
+
+        lPrevious = self.mLastStats.get(pStats['device_id'], None)
+        self.mLastStats[ pStats['device_id'] ] = pStats
+
+        if lPrevious is None:
+            return
+
+        lReasons = []
+
+        lFramesIn = pStats['frames_in'] - lPrevious['frames_in']
+        lErrors = (pStats['xor_failures'] - lPrevious['xor_failures']) + (pStats['frames_dropped'] - lPrevious['frames_dropped'])
+
+        if lFramesIn + lErrors >= self.mMinFrames and lErrors > self.mMaxErrorRate * (lFramesIn + lErrors):
+            lReasons.append("error rate %.1f%%" % (100.0 * lErrors / (lFramesIn + lErrors)))
+
+        # polled but silent during the whole interval
+        if pStats['bytes_out'] > lPrevious['bytes_out'] and pStats['bytes_in'] == lPrevious['bytes_in']:
+            lReasons.append("no answer")
+
+        if pStats['enrollments_lost'] > lPrevious['enrollments_lost']:
+            lReasons.append("enrollment lost")
+
+        if pStats['enrollment']['count'] > lPrevious['enrollment']['count'] and pStats['enrollment']['p99_ms'] > self.mMaxEnrollmentTime * 1000.0:
+            lReasons.append("enrollment p99 %.0f ms" % pStats['enrollment']['p99_ms'])
+
+        if len(lReasons) > 0:
+            self.mCallback(pStats['device_id'], lReasons, pStats)
+
+        return
+
+
+######################################################
+##
+##   Periodically publish metrics of registered
+##             devices to every sink
+##
+######################################################
+
+class VaubanMetricsReporter(object):
+
+    mDevices = None
+    mSinks = None
+    mInterval = 10.0
+    mLock = None
+    mStopEvent = None
+    mRunThread = None
+
+    def __init__(self, pInterval = 10.0, pSinks = None):
+
+        self.mDevices = {}
+        self.mSinks = list(pSinks) if pSinks is not None else []
+        self.mInterval = pInterval
+        self.mLock = Lock()
+        self.mStopEvent = Event()
+
+        return
+
+    # enables metrics on the device if needed
+    def addDevice(self, pDevicePtr):
+
+        pDevicePtr.enableMetrics()
+
+        with self.mLock:
+            self.mDevices[ id(pDevicePtr) ] = pDevicePtr
+
+        return
+
+    def removeDevice(self, pDevicePtr):
+
+        with self.mLock:
+            self.mDevices.pop(id(pDevicePtr), None)
+
+        return
+
+    def addSink(self, pSink):
+
+        with self.mLock:
+            self.mSinks.append(pSink)
+
+        return
+
+    def report(self):
+
+        with self.mLock:
+            lDevices = list(self.mDevices.values())
+            lSinks = list(self.mSinks)
+
+        for lDevice in lDevices:
+
+            lStats = lDevice.metrics.getStats()
+
+            for lSink in lSinks:
+                lSink.publish(lStats)
+
+        return
+
+    ######################################################
+	##
+	##           Start reporting async thread
+	##
+	######################################################
+
+    def start(self):
+
+        self.mStopEvent.clear()
+
+        self.mRunThread = Thread(target=self._reportService)
+        self.mRunThread.daemon = True
+        self.mRunThread.start()
+
+        return
+
+    def stop(self):
+
+        self.mStopEvent.set()
+
+        if self.mRunThread is not None:
+            self.mRunThread.join()
+            self.mRunThread = None
+
+        return
+
+    def _reportService(self):
+
+        while self.mStopEvent.wait(self.mInterval) == False:
+            self.report()
+
+        return
@@ -0,0 +1,304 @@
+﻿import time
+from threading import Thread, Lock, Event
+
+from Packet import VaubanOpcodes, VaubanFrameCache, encodeVaubanFrame
+from common.logger import Logger
+
+######################################################
+##
+##            Polling state of one reader
+##
+######################################################
+
+class VaubanPollingState(object):
+
+    mDevicePtr = None
+    mInterval = 0.0
+    mNextPoll = 0.0
+    mLastPoll = 0.0
+    mAnswered = True
+    mPollCount = 0
+    mAnswerCount = 0
+    mLastLatency = None
+    mAverageLatency = None
+    mMaxLatency = None
+    mErrorCount = 0
+    mLastError = None
+
+    def __init__(self, pDevicePtr, pInterval):
+
+        self.mDevicePtr = pDevicePtr
+        self.mInterval = pInterval
+
+        return
+
+    @property
+    def device(self):
+        return self.mDevicePtr
+
+    @property
+    def interval(self):
+        return self.mInterval
+
+
+######################################################
+##
+##      Round-robin polling of registered readers
+##
+######################################################
+
+class VaubanPollingScheduler(object):
+
+    mServiceAlias = "[Vauban-Polling]"
+    mStates = None
+    mOrder = None
+    mFrameCache = None
+    mCursor = 0
+    mRate = 50.0
+    mMinInterval = 0.1
+    mMaxInterval = 2.0
+    mBackoffFactor = 2.0
+    mLatencySmoothing = 0.2
+    mLock = None
+    mStopEvent = None
+    mRunThread = None
+
+    def __init__(self, pRate = 50.0, pMinInterval = 0.1, pMaxInterval = 2.0, pBackoffFactor = 2.0, pFrameCache = None):
+
+        if pRate <= 0:
+            raise NameError("Invalid polling rate : " + str(pRate))
+
+        if pMinInterval <= 0 or pMaxInterval < pMinInterval:
+            raise NameError("Invalid polling interval : " + str(pMinInterval) + " - " + str(pMaxInterval))
+
+        self.mStates = {}
+        self.mOrder = []
+        self.mRate = float(pRate)
+        self.mMinInterval = float(pMinInterval)
+        self.mMaxInterval = float(pMaxInterval)
+        self.mBackoffFactor = float(pBackoffFactor)
+        self.mLock = Lock()
+        self.mStopEvent = Event()
+
+        # shared with VaubanOpcodeHandler, frames of an old device ID
+        # are dropped by the cache itself
+        if pFrameCache is None:
+            pFrameCache = VaubanFrameCache.getInstance()
+
+        self.mFrameCache = pFrameCache
+
+        return
+
+    ######################################################
+	##
+	##              Devices registration
+	##
+	######################################################
+
+    # states are keyed by the device itself, its ID may change
+    # through setDeviceId() while it is registered
+    def registerDevice(self, pDevicePtr):
+
+        with self.mLock:
+
+            if pDevicePtr in self.mStates:
+                return False
+
+            self.mStates[ pDevicePtr ] = VaubanPollingState(pDevicePtr, self.mMinInterval)
+            self.mOrder.append(pDevicePtr)
+
+        return True
+
+    def unregisterDevice(self, pDevicePtr):
+
+        with self.mLock:
+
+            if self.mStates.pop(pDevicePtr, None) is None:
+                return False
+
+            self.mOrder.remove(pDevicePtr)
+
+            if self.mCursor >= len(self.mOrder):
+                self.mCursor = 0
+
+        return True
+
+    ######################################################
+	##
+	##     Polling frame only depends on the device ID
+	##
+	######################################################
+
+    def getPollingFrame(self, pDeviceId):
+
+        lFrame = self.mFrameCache.get(pDeviceId, VaubanOpcodes.MSG_SEND_POLLING, ())
+
+        if lFrame is None:
+            lFrame = self.mFrameCache.put(pDeviceId, VaubanOpcodes.MSG_SEND_POLLING, (), encodeVaubanFrame(pDeviceId, VaubanOpcodes.MSG_SEND_POLLING))
+
+        return lFrame
+
+    ######################################################
+	##
+	##    Must be called by the device read callback,
+	##       use wrapCallback() to do it for you
+	##
+	######################################################
+
+    def onFrameReceived(self, pDevicePtr):
+
+        lNow = time.monotonic()
+
+        with self.mLock:
+
+            lState = self.mStates.get(pDevicePtr, None)
+
+            if lState is None or lState.mAnswered == True:
+                return
+
+            lLatency = lNow - lState.mLastPoll
+
+            lState.mAnswered = True
+            lState.mAnswerCount += 1
+            lState.mLastLatency = lLatency
+
+            if lState.mAverageLatency is None:
+                lState.mAverageLatency = lLatency
+            else:
+                lState.mAverageLatency += (lLatency - lState.mAverageLatency) * self.mLatencySmoothing
+
+            if lState.mMaxLatency is None or lLatency > lState.mMaxLatency:
+                lState.mMaxLatency = lLatency
+
+            # active reader, poll it again as soon as allowed
+            lState.mInterval = self.mMinInterval
+            lState.mNextPoll = min(lState.mNextPoll, lState.mLastPoll + self.mMinInterval)
+
+        return
+
+    def wrapCallback(self, pDevicePtr, pCallback):
+
+        def lCallback(pPacket):
+            self.onFrameReceived(pDevicePtr)
+            return pCallback(pPacket)
+
+        return lCallback
+
+    ######################################################
+	##
+	##   Poll the next due device, return the delay to
+	##             wait before the next tick
+	##
+	######################################################
+
+    def tick(self, pNow = None):
+
+        if pNow is None:
+            pNow = time.monotonic()
+
+        lState = None
+        lNextDue = None
+
+        with self.mLock:
+
+            lCount = len(self.mOrder)
+
+            for lI in range(lCount):
+
+                lCandidate = self.mStates[ self.mOrder[ (self.mCursor + lI) % lCount ] ]
+
+                if lCandidate.mNextPoll <= pNow:
+                    lState = lCandidate
+                    self.mCursor = (self.mCursor + lI + 1) % lCount
+                    break
+
+                if lNextDue is None or lCandidate.mNextPoll < lNextDue:
+                    lNextDue = lCandidate.mNextPoll
+
+            if lState is None:
+                return self.mMinInterval if lNextDue is None else max(lNextDue - pNow, 1.0 / self.mRate)
+
+            # idle since last poll, back off
+            if lState.mAnswered == False:
+                lState.mInterval = min(lState.mInterval * self.mBackoffFactor, self.mMaxInterval)
+
+            lState.mAnswered = False
+            lState.mLastPoll = pNow
+            lState.mNextPoll = pNow + lState.mInterval
+            lState.mPollCount += 1
+
+            lFrame = self.getPollingFrame(lState.mDevicePtr.deviceId)
+
+        # a failing reader ( unplugged adapter ... ) must not stop
+        # the polling of the others
+        try:
+            lState.mDevicePtr.device.write(lFrame)
+        except Exception as lException:
+
+            with self.mLock:
+                lState.mErrorCount += 1
+                lState.mLastError = str(lException)
+
+            Logger("vauban").Write(self.mServiceAlias + " -> polling reader " + str(lState.mDevicePtr.deviceId) + " failed : " + str(lException))
+
+        return 1.0 / self.mRate
+
+    ######################################################
+	##
+	##           Start polling async thread
+	##
+	######################################################
+
+    def start(self):
+
+        self.mStopEvent.clear()
+
+        self.mRunThread = Thread(target=self._pollService)
+        self.mRunThread.daemon = True
+        self.mRunThread.start()
+
+        return
+
+    def stop(self):
+
+        self.mStopEvent.set()
+
+        if self.mRunThread is not None:
+            self.mRunThread.join()
+            self.mRunThread = None
+
+        return
+
+    def _pollService(self):
+
+        while self.mStopEvent.is_set() == False:
+            self.mStopEvent.wait(self.tick())
+
+        return
+
+    ######################################################
+	##
+	##              Per device statistics
+	##
+	######################################################
+
+    def getStats(self):
+
+        lStats = {}
+
+        with self.mLock:
+
+            for lState in self.mStates.values():
+
+                lStats[ lState.mDevicePtr.deviceId ] = {
+                    'interval' : lState.mInterval,
+                    'polls' : lState.mPollCount,
+                    'answers' : lState.mAnswerCount,
+                    'last_latency' : lState.mLastLatency,
+                    'average_latency' : lState.mAverageLatency,
+                    'max_latency' : lState.mMaxLatency,
+                    'errors' : lState.mErrorCount,
+                    'last_error' : lState.mLastError,
+                }
+
+        return lStats
@@ -3,22 +3,74 @@
 from logging import getLogger
 from django.conf import settings
 from django.core.wsgi import get_wsgi_application
-from threading import Thread, Lock, RLock
+from threading import Thread, Lock
 from common.utils import SharedVar
 from websocket.WebsocketClient import WebsocketClient
+from websocket.Broadcast import BroadcastStats, BroadcastMessage, enqueueMessage
+from websocket.OutboundQueue import OutboundQueueGuard
+from websocket.ClientRegistry import ClientRegistry
+from websocket.Metrics import MetricsRegistry, MetricsHttpServer, NULL_METRIC
 from common.ScheduledTask import ScheduledObject
 from common.logger import Logger
 
-import time
 import sys
+import time
+from bisect import bisect_left
+
+######################################################
+##
+##   instId is usually set once the client is logged
+##   in, after connect, the setter keeps the server
+##            instId index up to date
+##
+######################################################
+
+class InstIdTracking(object):
+
+    mInstId = None
+
+    @property
+    def instId(self):
+        return self.mInstId
+
+    @instId.setter
+    def instId(self, pInstID):
+
+        lOldInstID = self.mInstId
+        self.mInstId = pInstID
+
+        lServer = getattr(self, 'server', None)
+
+        if lServer is not None and hasattr(lServer, 'onClientInstIdChange'):
+            lServer.onClientInstIdChange(self, lOldInstID)
+
+        return
+
+
+class TrackedWebsocketClient(InstIdTracking, WebsocketClient):
+
+    # set by the client handler once the client announced it reads
+    # SMSG_CHANNEL_NOTIFICATION_BATCH, others get one packet per event
+    supportsBatchNotification = False
+
 
 class WebsocketServer(SimpleWebSocketServer):
 
     mServiceAlias = "[Django-WebSocket]"
     mServerThread = None
-    mClientStack = {}
-    mIdIterator = 0
+    mClientStack = None
     mPort = 0
+    mCapacity = 0
+    mBroadcastStats = None
+    mOutboundGuard = None
+    mInstIdIndex = None
+    mInstIdLock = None
+
+    mMetrics = None
+    mMetricsServer = None
+    mConnectCounter = NULL_METRIC
+    mRejectCounter = NULL_METRIC
+    mDisconnectCounter = NULL_METRIC
 
     ######################################################
 	##
@@ -32,17 +84,45 @@ class WebsocketServer(SimpleWebSocketServer):
             pPort = int(settings.WEBSOCKET_DEFAULT_PORT)
 
         self.mPort = int(pPort)
+        self.mCapacity = int(settings.WEBSOCKET_SERVER_CAPACITY)
+        self.mClientStack = ClientRegistry()
+        self.mBroadcastStats = BroadcastStats()
+
+        # None lets the guard derive it from the high watermark
+        lLowWatermark = getattr(settings, 'WEBSOCKET_SEND_QUEUE_LOW_WATERMARK', None)
+
+        self.mOutboundGuard = OutboundQueueGuard(
+            int(getattr(settings, 'WEBSOCKET_SEND_QUEUE_HIGH_WATERMARK', 1024)),
+            int(lLowWatermark) if lLowWatermark is not None else None,
+            getattr(settings, 'WEBSOCKET_SLOW_CONSUMER_POLICY', 'drop'))
+        self.mInstIdIndex = {}
+        self.mInstIdLock = Lock()
 
         if pDisableInit != True:
-            SimpleWebSocketServer.__init__(self, pBindedHost, pPort, WebsocketClient ) 
+            SimpleWebSocketServer.__init__(self, pBindedHost, pPort, TrackedWebsocketClient ) 
 
         Logger("websocket").Write( self.mServiceAlias + " -> Init server ")
 
+        from websocket.ChannelHandler.Channel import ChannelHandler
+
+        ChannelHandler.setNotifyWindow(getattr(settings, 'WEBSOCKET_NOTIFICATION_WINDOW_MS', 0))
+
+        lMetrics = MetricsRegistry.getInstance()
+
+        if getattr(settings, 'WEBSOCKET_METRICS', False) == True:
+            lMetrics.setEnabled(True)
+
+        self.bindMetrics(lMetrics)
+        ChannelHandler.bindMetrics(lMetrics)
+
         self.resetChannels()
 
     def resetChannels(self):
         Logger("websocket").Write( self.mServiceAlias + " -> Clearing channel data ")
 
+        from websocket.ChannelHandler.Channel import ChannelRegistry
+
+        ChannelRegistry.reset()
         SharedVar('Core').removePattern('Channel', '*')
         return
 
@@ -57,6 +137,8 @@ class WebsocketServer(SimpleWebSocketServer):
        
         Logger("websocket").Write( self.mServiceAlias + " -> Start server on port :  " + str(self.mPort))
 
+        self.startMetricsEndpoint()
+
         # Exec MySQL ping every 30 minutes ( 1800 secs )
         lScheduler = SharedVar("Core").get("Singleton", "Scheduler")
         lScheduledObject = ScheduledObject(self.doPingMySQL, 600) 
@@ -80,13 +162,59 @@ class WebsocketServer(SimpleWebSocketServer):
         return
         
 
+    ######################################################
+	##
+	##   Metrics, nothing is wrapped or counted unless
+	##           settings.WEBSOCKET_METRICS
+	##
+	######################################################
+
+    def bindMetrics(self, pMetrics):
+
+        self.mMetrics = pMetrics
+
+        self.mConnectCounter = pMetrics.counter('websocket_connections_total', 'Accepted websocket clients')
+        self.mRejectCounter = pMetrics.counter('websocket_rejected_total', 'Clients rejected because the server is full')
+        self.mDisconnectCounter = pMetrics.counter('websocket_disconnections_total', 'Disconnected websocket clients')
+
+        if pMetrics.enabled == False:
+            return
+
+        # read at scrape time, nothing on the hot path
+        pMetrics.gauge('websocket_clients', 'Connected websocket clients', pCallback=lambda: len(self.mClientStack))
+        pMetrics.counter('websocket_broadcasts_total', 'Broadcast messages', pCallback=lambda: self.mBroadcastStats.getStats()['broadcasts'])
+        pMetrics.counter('websocket_broadcast_recipients_total', 'Frames queued by broadcasts', pCallback=lambda: self.mBroadcastStats.getStats()['recipients'])
+        pMetrics.counter('websocket_broadcast_bytes_total', 'Bytes queued by broadcasts', pCallback=lambda: self.mBroadcastStats.getStats()['bytes_sent'])
+        pMetrics.counter('websocket_outbound_dropped_total', 'Frames dropped for slow consumers', pCallback=lambda: self.mOutboundGuard.getStats()['dropped'])
+        pMetrics.counter('websocket_outbound_evictions_total', 'Slow consumers disconnected', pCallback=lambda: self.mOutboundGuard.getStats()['evictions'])
+        pMetrics.gauge('websocket_outbound_throttled', 'Slow consumers currently throttled', pCallback=lambda: self.mOutboundGuard.getStats()['throttled'])
+
+        for lTarget, lMethod in (('channel', 'sendToChannel'), ('all', 'sendToAll'), ('instid', 'sendToInstId')):
+            setattr(self, lMethod, pMetrics.timed(getattr(self, lMethod), pMetrics.histogram('websocket_send_seconds', 'Time spent in send calls, fan-out included', { 'target' : lTarget })))
+
+        return
+
+    def startMetricsEndpoint(self, pPortOffset = 0):
+
+        lPort = int(getattr(settings, 'WEBSOCKET_METRICS_PORT', 0))
+
+        if self.mMetrics is None or self.mMetrics.enabled == False or lPort == 0 or self.mMetricsServer is not None:
+            return
+
+        self.mMetricsServer = MetricsHttpServer(self.mMetrics, lPort + pPortOffset, getattr(settings, 'WEBSOCKET_METRICS_HOST', '127.0.0.1'))
+        self.mMetricsServer.start()
+
+        Logger("websocket").Write( self.mServiceAlias + " -> Metrics on port : " + str(self.mMetricsServer.port))
+
+        return
+
     ######################################################
 	##
 	##              Return True or False
 	##
 	######################################################
     def hasClients(self):
-        return leng(self.mClientStack) > 0
+        return len(self.mClientStack) > 0
 
     ######################################################
 	##
@@ -96,12 +224,36 @@ class WebsocketServer(SimpleWebSocketServer):
          
     def sendToAll(self, pPacket, pSender):
 
-        for lSocket in self.mClientStack:
-            if lSocket.socketId != pSender.socketId:
-                lSocket.sendMessage(pPacket)
+        self.deliverToAll(pPacket, pSender.socketId)
 
+        return True
 
-        return
+    def deliverToAll(self, pPacket, pSenderId):
+        return self.broadcast(pPacket, [ lSocket for lSocket in self.mClientStack.snapshot() if lSocket.socketId != pSenderId ])
+
+    ######################################################
+	##
+	##   Frame a message once and queue the same buffer
+	##    on every recipient, slow consumers are held
+	##           back by the outbound guard
+	##
+	######################################################
+
+    def broadcast(self, pPacket, pSockets):
+
+        if len(pSockets) == 0:
+            return 0
+
+        lMessage = BroadcastMessage(pPacket)
+        lQueued = 0
+
+        for lSocket in pSockets:
+            if enqueueMessage(lSocket, lMessage, self.mOutboundGuard) != False:
+                lQueued += 1
+
+        self.mBroadcastStats.record(lQueued, len(lMessage.frame))
+
+        return lQueued
 
     ######################################################
 	##
@@ -111,18 +263,104 @@ class WebsocketServer(SimpleWebSocketServer):
 
     def sendToChannel(self, pPacket, pSender, pChannel):
         
-        from websocket.ChannelHandler.Channel import ChannelHandler
+        from websocket.ChannelHandler.Channel import ChannelRegistry
 
-        lChannelHandler = ChannelHandler(pChannel)
+        # the name comes from the client, unknown channels must not
+        # get a handler
+        lChannelHandler = ChannelRegistry.find(pChannel)
 
-        if lChannelHandler.isAlreadyMember(pSender) == False:
-            return
-       
-        for lSocketId in lChannelHandler.getMemberList():
-            if lSocketId in self.mClientStack and lSocketId != pSender.socketId:
-                self.mClientStack[ lSocketId ].sendMessage(pPacket)
+        if lChannelHandler is None or lChannelHandler.isAlreadyMember(pSender) == False:
+            return False
 
-        return
+        self.deliverToChannel(pPacket, pSender.socketId, lChannelHandler)
+
+        return True
+
+    ######################################################
+	##
+	##    Send to the local members of a channel, the
+	##      sender membership is already checked
+	##
+	######################################################
+
+    def deliverToChannel(self, pPacket, pSenderId, pChannelHandler):
+
+        lRecipients = []
+
+        for lSocketId in pChannelHandler.getMemberList():
+
+            lSocket = self.mClientStack.get(lSocketId, None)
+
+            if lSocket is not None and lSocketId != pSenderId:
+                lRecipients.append(lSocket)
+
+        return self.broadcast(pPacket, lRecipients)
+
+    ######################################################
+	##
+	##   Coalesced join / leave notifications sorted by
+	##   sequence, pJoins maps the members who joined in
+	##   the window to their join sequence. Clients
+	##   flagged supportsBatchNotification get a single
+	##   batch packet, others one packet per event
+	##
+	######################################################
+
+    def sendChannelNotifications(self, pChannelHandler, pEvents, pJoins):
+
+        self.deliverChannelNotifications(pChannelHandler, pEvents, pJoins)
+
+        return True
+
+    def deliverChannelNotifications(self, pChannelHandler, pEvents, pJoins):
+
+        lSequences = [ lSequence for lSequence, lSocketId, lEvent in pEvents ]
+        lIndexes = { lSocketId : lIndex for lIndex, (lSequence, lSocketId, lEvent) in enumerate(pEvents) }
+
+        lBatch = {}
+        lLegacy = []
+
+        for lSocketId in pChannelHandler.getMemberList():
+
+            lSocket = self.mClientStack.get(lSocketId, None)
+
+            if lSocket is None:
+                continue
+
+            lJoinSequence = pJoins.get(lSocketId, 0)
+
+            if getattr(lSocket, 'supportsBatchNotification', False) == True:
+
+                # the events a member gets are the ones from its join
+                # on but its own, members sharing both share a packet
+                lKey = (bisect_left(lSequences, lJoinSequence), lIndexes.get(lSocketId, -1))
+                lBatch.setdefault(lKey, []).append(lSocket)
+
+            else:
+                lLegacy.append((lJoinSequence, lSocket))
+
+        lCount = 0
+
+        for (lStart, lOwnIndex), lSockets in lBatch.items():
+
+            lEntries = [ (lSocketId, lEvent) for lIndex, (lSequence, lSocketId, lEvent) in enumerate(pEvents) if lIndex >= lStart and lIndex != lOwnIndex ]
+
+            if len(lEntries) > 0:
+                lCount += self.broadcast(pChannelHandler.buildBatchNotification(lEntries), lSockets)
+
+        if len(lLegacy) == 0:
+            return lCount
+
+        lPackets = {}
+
+        for lSequence, lSocketId, lEvent in pEvents:
+
+            if lEvent not in lPackets:
+                lPackets[ lEvent ] = pChannelHandler.buildNotification(lEvent)
+
+            lCount += self.broadcast(lPackets[ lEvent ], [ lSocket for lJoinSequence, lSocket in lLegacy if pChannelHandler.memberGetsEvent(lSocket.socketId, lJoinSequence, lSequence, lSocketId) == True ])
+
+        return lCount
 
     ######################################################
 	##
@@ -131,12 +369,77 @@ class WebsocketServer(SimpleWebSocketServer):
 	######################################################
 
     def sendToInstId(self, pPacket, pSender, pInstID):
-        
-        from websocket.ChannelHandler.Channel import ChannelHandler
 
-        for lSocketId in self.mClientStack:
-            if self.mClientStack[ lSocketId ].instId == pInstID and lSocketId != pSender.socketId:
-                self.mClientStack[ lSocketId ].sendMessage(pPacket)
+        self.deliverToInstId(pPacket, pSender.socketId, pInstID)
+
+        return True
+
+    def deliverToInstId(self, pPacket, pSenderId, pInstID):
+
+        lRecipients = []
+
+        with self.mInstIdLock:
+            lSocketIds = tuple(self.mInstIdIndex.get(pInstID, ()))
+
+        for lSocketId in lSocketIds:
+
+            lSocket = self.mClientStack.get(lSocketId, None)
+
+            if lSocket is not None and lSocketId != pSenderId:
+                lRecipients.append(lSocket)
+
+        return self.broadcast(pPacket, lRecipients)
+
+    ######################################################
+	##
+	##        instId -> socket ids secondary index
+	##
+	######################################################
+
+    def indexInstId(self, pSocket, pInstID):
+
+        if pInstID is None:
+            return
+
+        with self.mInstIdLock:
+            self.mInstIdIndex.setdefault(pInstID, set()).add(pSocket.socketId)
+
+        return
+
+    def unindexInstId(self, pSocket, pInstID):
+
+        with self.mInstIdLock:
+
+            lSocketIds = self.mInstIdIndex.get(pInstID, None)
+
+            if lSocketIds is None:
+                return
+
+            lSocketIds.discard(pSocket.socketId)
+
+            if len(lSocketIds) == 0:
+                self.mInstIdIndex.pop(pInstID, None)
+
+        return
+
+    ######################################################
+	##
+	##    Called by the client each time its instId
+	##   changes ( see InstIdTracking ), clients not
+	##     registered yet are indexed on connect
+	##
+	######################################################
+
+    def onClientInstIdChange(self, pSocket, pOldInstID):
+
+        if pOldInstID == pSocket.instId:
+            return
+
+        if self.mClientStack.get(getattr(pSocket, 'socketId', 0), None) is not pSocket:
+            return
+
+        self.unindexInstId(pSocket, pOldInstID)
+        self.indexInstId(pSocket, pSocket.instId)
 
         return
 
@@ -147,11 +450,11 @@ class WebsocketServer(SimpleWebSocketServer):
 	######################################################
 
     def onClientConnect(self, pSocket):
-       
-        Lock()
 
-        # if server is full
-        if len(self.mClientStack) >= settings.WEBSOCKET_SERVER_CAPACITY and settings.WEBSOCKET_SERVER_CAPACITY != 0:
+        # id allocation and capacity check are atomic
+        if self.mClientStack.register(pSocket, self.mCapacity) is None:
+
+            self.mRejectCounter.inc()
             
             from websocket.Packet import Packet
             from common.constants.Network import Opcodes, Channel, NetworkFlags
@@ -164,14 +467,8 @@ class WebsocketServer(SimpleWebSocketServer):
 
             return
 
-
-        self.mIdIterator += 1
-        pSocket.setSocketId(self.mIdIterator)
-        self.mClientStack[ pSocket.socketId ] = pSocket
-
-        time.sleep(0.10)
-
-        RLock()
+        self.mConnectCounter.inc()
+        self.indexInstId(pSocket, getattr(pSocket, 'instId', None))
 
         return
 
@@ -183,13 +480,34 @@ class WebsocketServer(SimpleWebSocketServer):
 
     def onClientDisconnect(self, pSocket):
         Logger("websocket").Write(self.mServiceAlias + " -> Client id : " + str(pSocket.socketId) + " disconnected ")
-        self.mClientStack.pop(pSocket.socketId)
+
+        from websocket.ChannelHandler.Channel import ChannelHandler
+
+        ChannelHandler.leaveAllChannels(pSocket)
+
+        self.unindexInstId(pSocket, getattr(pSocket, 'instId', None))
+        self.mOutboundGuard.release(pSocket)
+
+        if self.mClientStack.unregister(pSocket.socketId) is not None:
+            self.mDisconnectCounter.inc()
         return
 
     @property 
     def clientList(self):
         return self.mClientStack
 
+    @property
+    def capacity(self):
+        return self.mCapacity
+
+    @property
+    def broadcastStats(self):
+        return self.mBroadcastStats
+
+    @property
+    def outboundGuard(self):
+        return self.mOutboundGuard
+
 
     ######################################################
 	##
@@ -215,12 +533,96 @@ class WebsocketServer(SimpleWebSocketServer):
         return
 
 class SslWebsocketServer(WebsocketServer, SimpleSSLWebSocketServer):
+
+    mHandshakeListener = None
+    mHandshakeStats = None
+
     def __init__(self, pCertfile, pKeyfile, pPort = None, pBindedHost = ''):
 
         if pPort is None:
             pPort = int(settings.WEBSOCKET_DEFAULT_PORT)
 
         WebsocketServer.__init__(self, pPort, pBindedHost, True)
-        SimpleSSLWebSocketServer.__init__(self, pBindedHost, pPort, WebsocketClient, pCertfile, pKeyfile)
+        SimpleSSLWebSocketServer.__init__(self, pBindedHost, pPort, TrackedWebsocketClient, pCertfile, pKeyfile)
+
+        self.enableHandshakeOffload(pCertfile, pKeyfile)
+
+    ######################################################
+	##
+	##   One shared context keeps the session cache and
+	##   ticket keys, handshakes run in a worker pool
+	##   ( settings.WEBSOCKET_TLS_HANDSHAKE_WORKERS, 0
+	##        keeps them inline on the select loop )
+	##
+	######################################################
+
+    def enableHandshakeOffload(self, pCertfile, pKeyfile):
+
+        from websocket.TlsHandshake import TlsHandshakeListener, TlsHandshakeStats, createServerContext
+
+        self.context = createServerContext(pCertfile, pKeyfile, int(getattr(settings, 'WEBSOCKET_TLS_SESSION_TICKETS', 2)))
+        self.mHandshakeStats = TlsHandshakeStats()
+
+        lWorkers = int(getattr(settings, 'WEBSOCKET_TLS_HANDSHAKE_WORKERS', 4))
+
+        if lWorkers <= 0:
+            return
+
+        self.mHandshakeListener = TlsHandshakeListener(self.serversocket, self.context, lWorkers, float(getattr(settings, 'WEBSOCKET_TLS_HANDSHAKE_TIMEOUT', 10.0)), self.mHandshakeStats)
+
+        self.serversocket = self.mHandshakeListener
+        self.listeners = [ self.mHandshakeListener ]
+
+        return
+
+    def _decorateSocket(self, pSocket):
+
+        # already wrapped and handshaked by a worker
+        if self.mHandshakeListener is not None:
+            return pSocket
+
+        lStart = time.perf_counter()
+        lSslSocket = SimpleSSLWebSocketServer._decorateSocket(self, pSocket)
+
+        self.mHandshakeStats.record(time.perf_counter() - lStart, lSslSocket.session_reused)
+
+        return lSslSocket
+
+    def serveforever(self):
+
+        if self.mHandshakeListener is not None:
+            self.mHandshakeListener.start()
+
+        SimpleSSLWebSocketServer.serveforever(self)
+
+        return
+
+    @property
+    def handshakeStats(self):
+        return self.mHandshakeStats
+
+
+######################################################
+##
+##    Build the server for the configured backend,
+##      settings.WEBSOCKET_BACKEND = select | asyncio
+##
+######################################################
+
+def createWebsocketServer(pPort = None, pBindedHost = '', pCertfile = None, pKeyfile = None):
+
+    lBackend = getattr(settings, 'WEBSOCKET_BACKEND', 'select')
+
+    if lBackend == 'asyncio':
+
+        from websocket.AsyncWebsocketServer import AsyncWebsocketServer
+
+        return AsyncWebsocketServer(pPort, pBindedHost, pCertfile, pKeyfile)
+
+    if lBackend != 'select':
+        raise NameError("Invalid websocket backend : " + str(lBackend))
 
+    if pCertfile is not None:
+        return SslWebsocketServer(pCertfile, pKeyfile, pPort, pBindedHost)
 
+    return WebsocketServer(pPort, pBindedHost)
@@ -0,0 +1,22 @@
+######################################################
+##
+##   Test bootstrap : the repository root holds both
+##   the flat Vauban modules and the websocket package
+##   of the project. Project modules that live outside
+##   this tree ( django settings, common, websocket
+##   client ... ) get the in-memory stand-ins of
+##   Benchmarks/OfflineModules.py when they are not
+##                   importable
+##
+######################################################
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(ROOT, 'Benchmarks'))
+
+from OfflineModules import installOfflineModules
+
+installOfflineModules(pForceOffline=False)
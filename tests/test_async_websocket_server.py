@@ -0,0 +1,177 @@
+######################################################
+##
+##   asyncio backend : handshake, shutdown with
+##   connected clients and the close handshake
+##
+######################################################
+
+import asyncio
+import base64
+import os
+import socket
+import struct
+import threading
+import time
+
+from websocket.AsyncWebsocketServer import AsyncWebsocketServer, OPCODE_BINARY, OPCODE_CLOSE
+from websocket.Broadcast import encodeFrame
+
+
+def startServer():
+
+    lServer = AsyncWebsocketServer(0, '127.0.0.1')
+    lThread = threading.Thread(target=lServer.serveforever, daemon=True)
+    lThread.start()
+
+    for lI in range(200):
+
+        if lServer.mServer is not None and len(lServer.mServer.sockets) > 0:
+            break
+
+        time.sleep(0.01)
+
+    return lServer, lThread, lServer.mServer.sockets[0].getsockname()[1]
+
+def openClient(pPort):
+
+    lSocket = socket.create_connection(('127.0.0.1', pPort), 2.0)
+    lKey = base64.b64encode(os.urandom(16))
+
+    lSocket.sendall(b'GET / HTTP/1.1\r\nHost: localhost\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Key: ' + lKey + b'\r\nSec-WebSocket-Version: 13\r\n\r\n')
+
+    lResponse = b''
+
+    while b'\r\n\r\n' not in lResponse:
+        lResponse += lSocket.recv(4096)
+
+    assert lResponse.startswith(b'HTTP/1.1 101')
+
+    return lSocket
+
+
+def test_close_with_connected_clients():
+
+    lServer, lThread, lPort = startServer()
+    lSockets = [ openClient(lPort) for lI in range(5) ]
+
+    for lI in range(200):
+
+        if len(lServer.clientList) == 5:
+            break
+
+        time.sleep(0.01)
+
+    assert len(lServer.clientList) == 5
+
+    lServer.close()
+    lThread.join(5.0)
+
+    # serve_forever() returned and every close handler ran
+    assert lThread.is_alive() == False
+    assert len(lServer.clientList) == 0
+    assert len(lServer.mConnections) == 0
+
+    for lSocket in lSockets:
+        lSocket.close()
+
+
+######################################################
+##
+##                 Close handshake
+##
+######################################################
+
+def readUntilClosed(pSocket):
+
+    lData = b''
+
+    while True:
+
+        lChunk = pSocket.recv(4096)
+
+        if len(lChunk) == 0:
+            return lData
+
+        lData += lChunk
+
+
+def test_client_close_is_echoed():
+
+    lServer, lThread, lPort = startServer()
+
+    try:
+        for lI in range(20):
+
+            lSocket = openClient(lPort)
+
+            # masked close frame, status 1000
+            lMask = os.urandom(4)
+            lPayload = bytes(lByte ^ lMask[ lIndex % 4 ] for lIndex, lByte in enumerate(struct.pack("!H", 1000)))
+
+            lSocket.sendall(bytes([ 0x80 | OPCODE_CLOSE, 0x80 | 2 ]) + lMask + lPayload)
+
+            assert readUntilClosed(lSocket) == bytes([ 0x80 | OPCODE_CLOSE, 2 ]) + struct.pack("!H", 1000)
+
+            lSocket.close()
+    finally:
+        lServer.close()
+        lThread.join(5.0)
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+
+        self.mFrames = []
+        self.mGate = asyncio.Event()
+        self.mClosed = False
+
+    def get_extra_info(self, pName):
+        return ('127.0.0.1', 0)
+
+    def write(self, pData):
+        self.mFrames.append(bytes(pData))
+
+    async def drain(self):
+        await self.mGate.wait()
+
+    def close(self):
+        self.mClosed = True
+
+
+def test_close_is_not_dropped_by_a_full_queue():
+
+    lServer = AsyncWebsocketServer(0, '127.0.0.1')
+    lServer.mSendQueueSize = 2
+
+    async def lMain():
+
+        lServer.mLoop = asyncio.get_running_loop()
+        lServer.mLoopThreadId = threading.get_ident()
+
+        lWriter = FakeWriter()
+        lClient = lServer.mClientClass(lServer, None, lWriter)
+        lClient.mWriterTask = lServer.mLoop.create_task(lClient._writeService())
+
+        # the writer takes the first frame and waits on the slow peer
+        assert lClient.enqueueFrame(OPCODE_BINARY, b'1') == True
+        await asyncio.sleep(0)
+
+        assert lClient.enqueueFrame(OPCODE_BINARY, b'2') == True
+        assert lClient.enqueueFrame(OPCODE_BINARY, b'3') == True
+        assert lClient.enqueueFrame(OPCODE_BINARY, b'4') == False
+
+        lClient.close()
+
+        # nothing is queued after the close frame
+        assert lClient.enqueueFrame(OPCODE_BINARY, b'5') == False
+
+        lWriter.mGate.set()
+
+        await asyncio.wait_for(lClient.mWriterTask, 2.0)
+
+        assert lWriter.mFrames == [ b'1', b'2', b'3', encodeFrame(struct.pack("!H", 1000), OPCODE_CLOSE)[1] ]
+        assert lWriter.mClosed == True
+        assert lClient.droppedFrames == 1
+
+    asyncio.run(lMain())
@@ -0,0 +1,104 @@
+######################################################
+##
+##   ChannelMembership persistence to SharedVar
+##
+######################################################
+
+from common.utils import SharedVar
+from websocket.ChannelHandler.Channel import ChannelMembership
+
+
+def setup_function(pFunction):
+
+    ChannelMembership.reset()
+    SharedVar('Core').removePattern('Channel', '*')
+
+
+def test_flush_stores_a_list():
+
+    lMembership = ChannelMembership.get('LOBBY')
+
+    lMembership.add(1)
+    lMembership.add(2)
+    lMembership.flush()
+
+    lStored = SharedVar('Core').get('Channel', 'LOBBY')
+
+    assert isinstance(lStored, list)
+    assert sorted(lStored) == [1, 2]
+
+
+def test_merge_keeps_members_of_other_processes(monkeypatch):
+
+    monkeypatch.setattr(ChannelMembership, 'mMergeOnFlush', True)
+
+    lMembership = ChannelMembership.get('LOBBY')
+
+    # written by another worker since the last flush
+    SharedVar('Core').set('Channel', 'LOBBY', [ 10, 11 ])
+
+    lMembership.add(1)
+    lMembership.remove(1)
+    lMembership.add(2)
+    lMembership.flush()
+
+    lStored = SharedVar('Core').get('Channel', 'LOBBY')
+
+    assert isinstance(lStored, list)
+    assert sorted(lStored) == [2, 10, 11]
+    assert 10 in lMembership
+    assert ChannelMembership.channelsOf(11) == ('LOBBY',)
+
+
+def test_concurrent_workers_keep_every_member(monkeypatch):
+
+    import multiprocessing
+    import time
+
+    import websocket.ChannelHandler.Channel as Channel
+
+    lContext = multiprocessing.get_context('fork')
+    lManager = lContext.Manager()
+    lStore = lManager.dict()
+
+    # store shared by the worker processes, reads are slow enough for
+    # read-merge-write cycles to overlap
+    class ProcessSharedVar(object):
+
+        def __init__(self, pNamespace):
+            return
+
+        def get(self, pKey, pSubKey):
+            lValue = lStore.get(pSubKey, None)
+            time.sleep(0.002)
+            return lValue
+
+        def set(self, pKey, pSubKey, pValue):
+            lStore[ pSubKey ] = pValue
+
+    monkeypatch.setattr(Channel, 'SharedVar', ProcessSharedVar)
+    monkeypatch.setattr(ChannelMembership, 'mSaveInterval', 0)
+    monkeypatch.setattr(ChannelMembership, 'mMergeOnFlush', True)
+    monkeypatch.setattr(ChannelMembership, 'mStoreLock', lContext.Lock())
+
+    def lWorker(pIndex):
+
+        lMembership = ChannelMembership.get('LOBBY')
+
+        for lI in range(20):
+            lMembership.add(pIndex * 100 + lI)
+            lMembership.save()
+
+    try:
+        lWorkers = [ lContext.Process(target=lWorker, args=(lIndex,)) for lIndex in range(4) ]
+
+        for lProcess in lWorkers:
+            lProcess.start()
+
+        for lProcess in lWorkers:
+            lProcess.join(30.0)
+            assert lProcess.exitcode == 0
+
+        assert sorted(lStore['LOBBY']) == sorted(lIndex * 100 + lI for lIndex in range(4) for lI in range(20))
+    finally:
+        lManager.shutdown()
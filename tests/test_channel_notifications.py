@@ -0,0 +1,243 @@
+######################################################
+##
+##   Join / leave notifications, sent at once or
+##      coalesced over the notification window
+##
+######################################################
+
+import struct
+import time
+
+import pytest
+
+from common.utils import SharedVar
+from websocket.ChannelHandler.Channel import ChannelHandler, ChannelRegistry
+from websocket.WebsocketServer import WebsocketServer, TrackedWebsocketClient
+
+
+@pytest.fixture
+def server():
+
+    SharedVar('Core').removePattern('Channel', '*')
+
+    lServer = WebsocketServer(pDisableInit=True)
+
+    yield lServer
+
+    ChannelHandler.setNotifyWindow(0)
+    ChannelRegistry.reset()
+
+def connect(pServer):
+
+    lSocket = TrackedWebsocketClient(pServer, None, ('127.0.0.1', 0))
+    lSocket.handleConnected()
+
+    return lSocket
+
+def flush(pHandler):
+
+    if pHandler.mNotifyTimer is not None:
+        pHandler.mNotifyTimer.cancel()
+
+    pHandler.flushNotifications()
+
+    return
+
+
+def test_no_window_notifies_at_once(server):
+
+    lMember = connect(server)
+    lJoiner = connect(server)
+
+    ChannelRegistry.get('LOBBY').tryJoin(lMember)
+    ChannelRegistry.get('LOBBY').tryJoin(lJoiner)
+
+    assert len(lMember.sendq) == 1
+    assert len(lJoiner.sendq) == 0
+
+
+def test_joiners_do_not_get_older_events(server):
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lMember = connect(server)
+    lFirst = connect(server)
+    lSecond = connect(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+
+    # added before the window, no pending event
+    lHandler.mClientStack.add(lMember.socketId)
+
+    lHandler.tryJoin(lFirst)
+    lHandler.tryJoin(lSecond)
+
+    assert len(lMember.sendq) == 0
+
+    flush(lHandler)
+
+    assert len(lMember.sendq) == 2
+    assert len(lFirst.sendq) == 1
+    assert len(lSecond.sendq) == 0
+
+
+def test_join_and_leave_in_the_window_cancel_out(server):
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lMember = connect(server)
+    lVisitor = connect(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+    lHandler.mClientStack.add(lMember.socketId)
+
+    lHandler.tryJoin(lVisitor)
+    lHandler.leaveChannel(lVisitor)
+
+    flush(lHandler)
+
+    assert len(lMember.sendq) == 0
+
+
+def test_events_not_matching_membership_are_dropped(server):
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lMember = connect(server)
+    lJoiner = connect(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+    lHandler.mClientStack.add(lMember.socketId)
+
+    lHandler.tryJoin(lJoiner)
+
+    # removed by another worker before the flush
+    lHandler.mClientStack.remove(lJoiner.socketId)
+
+    flush(lHandler)
+
+    assert len(lMember.sendq) == 0
+
+
+def connectBatch(pServer):
+
+    lSocket = connect(pServer)
+    lSocket.supportsBatchNotification = True
+
+    return lSocket
+
+# sendq holds ( opcode, websocket frame ) entries
+def decodeBatch(pEntry):
+
+    from websocket.ChannelHandler.Channel import ChannelOpcodes
+
+    lFrame = pEntry[1]
+    lLength = lFrame[1] & 0x7F
+    pFrame = lFrame[ 2 if lLength < 126 else 4 if lLength == 126 else 10: ]
+
+    assert pFrame[0] == ChannelOpcodes.SMSG_CHANNEL_NOTIFICATION_BATCH.value
+
+    lCount = struct.unpack_from('<I', pFrame, 2)[0]
+
+    return [ struct.unpack_from('<iI', pFrame, 6 + lI * 8)[::-1] for lI in range(lCount) ]
+
+
+def test_batch_clients_get_one_packet_per_window(server):
+
+    from common.constants.Network import NetworkFlags
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lBatch = connectBatch(server)
+    lLegacy = connect(server)
+    lJoiners = [ connect(server) for lI in range(5) ]
+
+    lHandler = ChannelRegistry.get('LOBBY')
+    lHandler.mClientStack.add(lBatch.socketId)
+    lHandler.mClientStack.add(lLegacy.socketId)
+
+    for lJoiner in lJoiners:
+        lHandler.tryJoin(lJoiner)
+
+    lHandler.leaveChannel(lJoiners[0])
+
+    flush(lHandler)
+
+    # joins and leave of the first joiner cancel out
+    assert len(lBatch.sendq) == 1
+    assert decodeBatch(lBatch.sendq[0]) == [ (lJoiner.socketId, NetworkFlags.FLAG_NEW_CLIENT_CONNECTED) for lJoiner in lJoiners[1:] ]
+
+    # legacy fallback : one packet per event
+    assert len(lLegacy.sendq) == 4
+
+
+def test_batch_joiners_only_get_later_events(server):
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lFirst = connectBatch(server)
+    lSecond = connectBatch(server)
+    lThird = connectBatch(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+
+    lHandler.tryJoin(lFirst)
+    lHandler.tryJoin(lSecond)
+    lHandler.tryJoin(lThird)
+
+    flush(lHandler)
+
+    assert [ lSocketId for lSocketId, lEvent in decodeBatch(lFirst.sendq[0]) ] == [ lSecond.socketId, lThird.socketId ]
+    assert [ lSocketId for lSocketId, lEvent in decodeBatch(lSecond.sendq[0]) ] == [ lThird.socketId ]
+    assert len(lThird.sendq) == 0
+
+
+def test_reconnect_storm_frames(server):
+
+    ChannelHandler.setNotifyWindow(60000)
+
+    lMembers = [ connectBatch(server) for lI in range(50) ]
+    lHandler = ChannelRegistry.get('LOBBY')
+
+    for lMember in lMembers:
+        lHandler.mClientStack.add(lMember.socketId)
+
+    # every member drops and comes back, then 100 newcomers join
+    for lMember in lMembers:
+        lHandler.leaveChannel(lMember)
+        lHandler.tryJoin(lMember)
+
+    lNewcomers = [ connectBatch(server) for lI in range(100) ]
+
+    for lNewcomer in lNewcomers:
+        lHandler.tryJoin(lNewcomer)
+
+    flush(lHandler)
+
+    # one frame per member at most instead of one per event
+    assert all(len(lMember.sendq) == 1 for lMember in lMembers)
+    assert all(len(decodeBatch(lMember.sendq[0])) == 100 for lMember in lMembers)
+    assert sum(len(lNewcomer.sendq) for lNewcomer in lNewcomers) == 99
+
+
+def test_window_timer_flushes(server):
+
+    ChannelHandler.setNotifyWindow(20)
+
+    lMember = connectBatch(server)
+    lJoiner = connect(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+    lHandler.mClientStack.add(lMember.socketId)
+
+    lHandler.tryJoin(lJoiner)
+
+    assert len(lMember.sendq) == 0
+
+    lDeadline = time.monotonic() + 2.0
+
+    while len(lMember.sendq) == 0 and time.monotonic() < lDeadline:
+        time.sleep(0.005)
+
+    assert len(lMember.sendq) == 1
+    assert lHandler.mNotifyTimer is None
@@ -0,0 +1,107 @@
+######################################################
+##
+##   ChannelRegistry : lookups from sendToChannel and
+##       joins racing with the channel release
+##
+######################################################
+
+import pytest
+
+from common.utils import SharedVar
+from websocket.ChannelHandler.Channel import ChannelRegistry, ChannelMembership
+from websocket.WebsocketServer import WebsocketServer, TrackedWebsocketClient
+
+
+@pytest.fixture
+def server():
+
+    SharedVar('Core').removePattern('Channel', '*')
+
+    yield WebsocketServer(pDisableInit=True)
+
+    ChannelRegistry.reset()
+
+def connect(pServer):
+
+    lSocket = TrackedWebsocketClient(pServer, None, ('127.0.0.1', 0))
+    lSocket.handleConnected()
+
+    return lSocket
+
+
+def test_send_to_unknown_channel_creates_nothing(server):
+
+    lSender = connect(server)
+
+    for lI in range(100):
+        assert server.sendToChannel(b'hello', lSender, 'NO_SUCH_CHANNEL_' + str(lI)) == False
+
+    assert ChannelRegistry.channels() == ()
+    assert ChannelRegistry.find('NO_SUCH_CHANNEL_0') is None
+
+
+def test_send_to_channel_members(server):
+
+    lSender = connect(server)
+    lMember = connect(server)
+
+    ChannelRegistry.get('LOBBY').tryJoin(lSender)
+    ChannelRegistry.get('LOBBY').tryJoin(lMember)
+    lMember.sendq.clear()
+
+    assert server.sendToChannel(b'hello', lSender, 'LOBBY') == True
+    assert len(lMember.sendq) == 1
+
+
+def test_join_on_a_released_handler(server):
+
+    lFirst = connect(server)
+    lSecond = connect(server)
+
+    lHandler = ChannelRegistry.get('LOBBY')
+    lHandler.tryJoin(lFirst)
+
+    # another thread got the handler before the last member left
+    lStale = ChannelRegistry.get('LOBBY')
+    lHandler.leaveChannel(lFirst)
+
+    assert ChannelRegistry.find('LOBBY') is None
+
+    assert lStale.tryJoin(lSecond) == True
+
+    lLive = ChannelRegistry.find('LOBBY')
+
+    assert lLive is not None and lLive is not lStale
+    assert lLive.isAlreadyMember(lSecond) == True
+    assert ChannelMembership.channelsOf(lSecond.socketId) == ('LOBBY',)
+
+
+def test_legacy_join_path(server):
+
+    from websocket.ChannelHandler.Channel import ChannelHandler
+
+    lFirst = connect(server)
+    lSecond = connect(server)
+
+    # external callers build a handler per call
+    assert ChannelHandler('LOBBY').tryJoin(lFirst) == True
+    assert ChannelHandler('LOBBY').tryJoin(lSecond) == True
+
+    # the first member is told about the second one
+    assert len(lFirst.sendq) == 1
+
+    lFirst.sendq.clear()
+    lSecond.sendq.clear()
+
+    assert server.sendToChannel(b'hello', lFirst, 'LOBBY') == True
+    assert len(lSecond.sendq) == 1
+
+    lLive = ChannelRegistry.find('LOBBY')
+
+    assert lLive is not None
+    assert set(lLive.getMemberList()) == { lFirst.socketId, lSecond.socketId }
+
+    ChannelHandler('LOBBY').leaveChannel(lFirst)
+
+    assert lLive.isAlreadyMember(lFirst) == False
+    assert len(lSecond.sendq) == 2
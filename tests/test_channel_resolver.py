@@ -0,0 +1,68 @@
+######################################################
+##
+##   ChannelResolver : name <-> id lookup tables and
+##         their rebuild from the channel enum
+##
+######################################################
+
+from enum import Enum
+
+import pytest
+
+import common.constants.Network as Network
+from websocket.ChannelHandler.Channel import ChannelResolver
+
+
+class AliasedChannel(Enum):
+    GLOBAL = 0
+    LOBBY = 1
+    LOUNGE = 1
+    ARENA = 7
+
+
+@pytest.fixture
+def aliased(monkeypatch):
+
+    monkeypatch.setattr(Network, 'Channel', AliasedChannel)
+    ChannelResolver.reload()
+
+    yield
+
+    monkeypatch.undo()
+    ChannelResolver.reload()
+
+
+def test_lookups():
+
+    for lKey, lChannel in Network.Channel.__members__.items():
+        assert ChannelResolver.getIdFromString(lKey) == lChannel.value
+        assert ChannelResolver.getNameFromId(lChannel.value) == lKey
+
+
+def test_unknown_values():
+
+    assert ChannelResolver.getIdFromString('UNKNOWN') == 0
+    assert ChannelResolver.getNameFromId(9999) == ''
+
+
+def test_reload_follows_the_enum(aliased):
+
+    assert ChannelResolver.getIdFromString('ARENA') == 7
+    assert ChannelResolver.getNameFromId(7) == 'ARENA'
+    assert ChannelResolver.getIdFromString('GAME') == 0
+
+
+def test_aliases_keep_the_first_name(aliased):
+
+    assert ChannelResolver.getIdFromString('LOUNGE') == 1
+    assert ChannelResolver.getNameFromId(1) == 'LOBBY'
+
+
+def test_reload_restores_the_tables():
+
+    ChannelResolver.mNameToId = {}
+    ChannelResolver.mIdToName = {}
+
+    ChannelResolver.reload()
+
+    assert ChannelResolver.getIdFromString('LOBBY') == Network.Channel.LOBBY.value
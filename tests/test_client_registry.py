@@ -0,0 +1,162 @@
+######################################################
+##
+##   ClientRegistry : concurrent connect / disconnect
+##    threads against broadcast readers, unique ids
+##            and the capacity limit
+##
+######################################################
+
+from threading import Thread, Event, Barrier
+
+import pytest
+
+from websocket.ClientRegistry import ClientRegistry
+
+
+class FakeSocket(object):
+
+    def __init__(self):
+        self.socketId = 0
+
+    def setSocketId(self, pSocketId):
+        self.socketId = pSocketId
+
+
+def test_register_unregister():
+
+    lRegistry = ClientRegistry(pStripeCount=4)
+    lSockets = [ FakeSocket() for lI in range(10) ]
+
+    for lSocket in lSockets:
+        lRegistry.register(lSocket)
+
+    assert [ lSocket.socketId for lSocket in lSockets ] == list(range(1, 11))
+    assert len(lRegistry) == 10
+    assert lRegistry[ 3 ] is lSockets[ 2 ]
+
+    assert lRegistry.unregister(3) is lSockets[ 2 ]
+    assert lRegistry.unregister(3) is None
+    assert 3 not in lRegistry
+    assert len(lRegistry) == 9
+
+    with pytest.raises(KeyError):
+        lRegistry[ 3 ]
+
+
+def test_id_sequence():
+
+    lRegistry = ClientRegistry()
+    lRegistry.setIdSequence(2, 4)
+
+    assert [ lRegistry.register(FakeSocket()) for lI in range(3) ] == [ 6, 10, 14 ]
+
+    with pytest.raises(NameError):
+        lRegistry.setIdSequence(0, 0)
+
+
+def test_capacity():
+
+    lRegistry = ClientRegistry()
+
+    assert lRegistry.register(FakeSocket(), 1) == 1
+    assert lRegistry.register(FakeSocket(), 1) is None
+
+    lRegistry.unregister(1)
+
+    assert lRegistry.register(FakeSocket(), 1) == 2
+
+
+######################################################
+##
+##   Writers connect and drop every other client while
+##     readers walk snapshots, as broadcasts do
+##
+######################################################
+
+def stress(pCapacity, pWriters = 8, pReaders = 4, pIterations = 2000):
+
+    lRegistry = ClientRegistry()
+    lStop = Event()
+    lStart = Barrier(pWriters + pReaders)
+    lIds = [ [] for lI in range(pWriters) ]
+    lErrors = []
+    lCounts = []
+
+    def writer(pIndex):
+
+        lStart.wait()
+
+        try:
+            for lI in range(pIterations):
+
+                lSocket = FakeSocket()
+
+                if lRegistry.register(lSocket, pCapacity) is None:
+                    continue
+
+                lIds[ pIndex ].append(lSocket.socketId)
+
+                if len(lIds[ pIndex ]) % 2 == 1 and lRegistry.unregister(lSocket.socketId) is not lSocket:
+                    lErrors.append("lost client " + str(lSocket.socketId))
+
+        except Exception as lException:
+            lErrors.append(repr(lException))
+
+    def reader():
+
+        lStart.wait()
+
+        try:
+            while lStop.is_set() == False:
+
+                for lSocket in lRegistry.snapshot():
+                    if lRegistry.get(lSocket.socketId, lSocket) is not lSocket:
+                        lErrors.append("stale client " + str(lSocket.socketId))
+
+                lCounts.append(len(lRegistry))
+
+        except Exception as lException:
+            lErrors.append(repr(lException))
+
+    lReaders = [ Thread(target=reader) for lI in range(pReaders) ]
+    lWriters = [ Thread(target=writer, args=(lI,)) for lI in range(pWriters) ]
+
+    for lThread in lReaders + lWriters:
+        lThread.start()
+
+    for lThread in lWriters:
+        lThread.join()
+
+    lStop.set()
+
+    for lThread in lReaders:
+        lThread.join()
+
+    return lRegistry, lIds, lErrors, lCounts
+
+
+@pytest.mark.parametrize("pCapacity", [ 0, 1000 ])
+def test_concurrent_ids_are_unique(pCapacity):
+
+    lRegistry, lIds, lErrors, lCounts = stress(pCapacity)
+
+    lAllIds = [ lId for lList in lIds for lId in lList ]
+    lExpected = sum(len(lList) // 2 for lList in lIds)
+
+    assert lErrors == []
+    assert len(lAllIds) == len(set(lAllIds))
+    assert len(lRegistry) == lExpected
+    assert len(lRegistry.snapshot()) == lExpected
+    assert sorted(lRegistry.keys()) == sorted(lSocket.socketId for lSocket in lRegistry.values())
+
+
+def test_concurrent_capacity_is_never_exceeded():
+
+    lRegistry, lIds, lErrors, lCounts = stress(50)
+
+    assert lErrors == []
+
+    # refused connects : the limit was reached and held
+    assert sum(len(lList) for lList in lIds) < 8 * 2000
+    assert len(lRegistry) == 50
+    assert max(lCounts + [ len(lRegistry) ]) <= 50
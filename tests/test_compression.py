@@ -0,0 +1,228 @@
+######################################################
+##
+##   permessage-deflate : round trips, negotiation
+##       ( RFC 7692 ) and the inflate size limit
+##
+######################################################
+
+import zlib
+
+import pytest
+
+from websocket.Compression import PerMessageDeflate, negotiateDeflate, DEFLATE_TRAILER, RSV1
+
+
+def clientCompressor(pWindowBits = 15):
+    return zlib.compressobj(6, zlib.DEFLATED, -pWindowBits)
+
+def clientCompress(pCompressor, pPayload):
+
+    lData = pCompressor.compress(pPayload) + pCompressor.flush(zlib.Z_SYNC_FLUSH)
+
+    assert lData.endswith(DEFLATE_TRAILER)
+
+    return lData[:-4]
+
+def clientDecompress(pDecompressor, pData):
+    return pDecompressor.decompress(pData + DEFLATE_TRAILER)
+
+
+######################################################
+##
+##                   Round trips
+##
+######################################################
+
+@pytest.mark.parametrize("pServerNoContextTakeover", [ True, False ])
+@pytest.mark.parametrize("pWindowBits", [ 9, 12, 15 ])
+def test_server_to_client_round_trip(pServerNoContextTakeover, pWindowBits):
+
+    lDeflate = PerMessageDeflate(pServerNoContextTakeover=pServerNoContextTakeover, pServerWindowBits=pWindowBits)
+    lDecompressor = zlib.decompressobj(-15)
+
+    for lI in range(5):
+
+        lPayload = (b'{"channel": "LOBBY", "event": %d} ' % lI) * 50
+
+        if pServerNoContextTakeover == True:
+            lDecompressor = zlib.decompressobj(-15)
+
+        assert clientDecompress(lDecompressor, lDeflate.compress(lPayload)) == lPayload
+
+
+@pytest.mark.parametrize("pClientNoContextTakeover", [ True, False ])
+@pytest.mark.parametrize("pWindowBits", [ 9, 12, 15 ])
+def test_client_to_server_round_trip(pClientNoContextTakeover, pWindowBits):
+
+    lDeflate = PerMessageDeflate(pClientNoContextTakeover=pClientNoContextTakeover)
+    lCompressor = clientCompressor(pWindowBits)
+
+    for lI in range(5):
+
+        lPayload = (b'hello %d ' % lI) * 100
+
+        if pClientNoContextTakeover == True:
+            lCompressor = clientCompressor(pWindowBits)
+
+        assert lDeflate.decompress(clientCompress(lCompressor, lPayload), 1 << 20) == lPayload
+
+
+def test_context_takeover_shrinks_repeated_messages():
+
+    lPayload = b'repeated payload ' * 20
+
+    lStateless = PerMessageDeflate(pServerNoContextTakeover=True)
+    lStateful = PerMessageDeflate(pServerNoContextTakeover=False)
+
+    lStateful.compress(lPayload)
+
+    assert len(lStateful.compress(lPayload)) < len(lStateless.compress(lPayload))
+    assert lStateless.sharedKey is not None
+    assert lStateful.sharedKey is None
+
+
+def test_encode_frame_threshold():
+
+    lDeflate = PerMessageDeflate(pThreshold=64)
+
+    lSmall = lDeflate.encodeFrame(b'x' * 10)
+    lLarge = lDeflate.encodeFrame(b'x' * 1000)
+
+    assert lSmall[0] & RSV1 == 0
+    assert lLarge[0] & RSV1 == RSV1
+    assert lDeflate.compressionRatio < 0.1
+
+    # text payloads keep the text opcode
+    assert lDeflate.encodeFrame('y' * 1000)[0] & 0x0F == 0x1
+
+
+######################################################
+##
+##             Inflate size limit
+##
+######################################################
+
+def test_decompression_limit():
+
+    lDeflate = PerMessageDeflate()
+    lBomb = clientCompress(clientCompressor(), b'\x00' * (1 << 20))
+
+    assert len(lBomb) < 2048
+
+    with pytest.raises(NameError):
+        lDeflate.decompress(lBomb, 65536)
+
+    lDeflate = PerMessageDeflate()
+
+    assert len(lDeflate.decompress(lBomb, 1 << 20)) == 1 << 20
+
+
+def test_decompression_limit_is_exact():
+
+    lPayload = b'a' * 1000
+    lData = clientCompress(clientCompressor(), lPayload)
+
+    assert PerMessageDeflate(pClientNoContextTakeover=True).decompress(lData, 1000) == lPayload
+
+    with pytest.raises(NameError):
+        PerMessageDeflate(pClientNoContextTakeover=True).decompress(lData, 999)
+
+
+######################################################
+##
+##                  Negotiation
+##
+######################################################
+
+def test_no_offer():
+
+    assert negotiateDeflate(None) is None
+    assert negotiateDeflate('x-webkit-deflate-frame') is None
+
+
+def test_default_answer():
+
+    lDeflate = negotiateDeflate('permessage-deflate')
+
+    assert lDeflate.responseHeader == 'permessage-deflate; server_no_context_takeover'
+
+
+def test_server_context_takeover_allowed():
+
+    lDeflate = negotiateDeflate('permessage-deflate', pServerContextTakeover=True)
+
+    assert lDeflate.responseHeader == 'permessage-deflate'
+
+    # the client can still ask for it
+    lDeflate = negotiateDeflate('permessage-deflate; server_no_context_takeover', pServerContextTakeover=True)
+
+    assert lDeflate.responseHeader == 'permessage-deflate; server_no_context_takeover'
+
+
+def test_client_no_context_takeover():
+
+    lDeflate = negotiateDeflate('permessage-deflate; client_no_context_takeover')
+
+    assert 'client_no_context_takeover' in lDeflate.responseHeader.split('; ')
+
+
+def test_server_max_window_bits():
+
+    lDeflate = negotiateDeflate('permessage-deflate; server_max_window_bits=10')
+
+    assert 'server_max_window_bits=10' in lDeflate.responseHeader.split('; ')
+    assert lDeflate.sharedKey[2] == 10
+
+    # zlib can not compress with 8 bits windows : declined
+    assert negotiateDeflate('permessage-deflate; server_max_window_bits=8') is None
+
+
+@pytest.mark.parametrize("pOffer", [ 8, 9, 10, 12, 15 ])
+@pytest.mark.parametrize("pWindowBits", [ 9, 10, 12, 15 ])
+def test_client_max_window_bits_never_above_the_offer(pOffer, pWindowBits):
+
+    lDeflate = negotiateDeflate('permessage-deflate; client_max_window_bits=' + str(pOffer), pWindowBits=pWindowBits)
+
+    lAnswer = [ lParam for lParam in lDeflate.responseHeader.split('; ') if lParam.startswith('client_max_window_bits') ]
+
+    if pWindowBits < pOffer:
+        assert lAnswer == [ 'client_max_window_bits=' + str(pWindowBits) ]
+    else:
+        assert lAnswer == []
+
+
+def test_client_max_window_bits_without_value():
+
+    assert negotiateDeflate('permessage-deflate; client_max_window_bits', pWindowBits=11).responseHeader.endswith('client_max_window_bits=11')
+    assert 'client_max_window_bits' not in negotiateDeflate('permessage-deflate; client_max_window_bits').responseHeader
+
+
+def test_client_window_is_not_limited_without_the_parameter():
+
+    assert 'client_max_window_bits' not in negotiateDeflate('permessage-deflate', pWindowBits=10).responseHeader
+
+
+@pytest.mark.parametrize("pOffer", [
+    'permessage-deflate; server_max_window_bits=16',
+    'permessage-deflate; server_max_window_bits=abc',
+    'permessage-deflate; client_max_window_bits=7',
+    'permessage-deflate; server_no_context_takeover=1',
+    'permessage-deflate; server_no_context_takeover; server_no_context_takeover',
+    'permessage-deflate; unknown_parameter',
+])
+def test_invalid_offers_are_declined(pOffer):
+    assert negotiateDeflate(pOffer) is None
+
+
+def test_first_acceptable_offer_wins():
+
+    lDeflate = negotiateDeflate('permessage-deflate; unknown_parameter, permessage-deflate; server_max_window_bits=11, permessage-deflate')
+
+    assert 'server_max_window_bits=11' in lDeflate.responseHeader.split('; ')
+
+
+def test_quoted_values():
+
+    lDeflate = negotiateDeflate('permessage-deflate; server_max_window_bits="12"')
+
+    assert 'server_max_window_bits=12' in lDeflate.responseHeader.split('; ')
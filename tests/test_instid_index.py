@@ -0,0 +1,82 @@
+######################################################
+##
+##   sendToInstId delivery through the instId index,
+##        instId set before and after connect
+##
+######################################################
+
+from websocket.WebsocketServer import WebsocketServer, TrackedWebsocketClient
+
+
+def createServer():
+    return WebsocketServer(pDisableInit=True)
+
+def connect(pServer, pInstID = None):
+
+    lSocket = TrackedWebsocketClient(pServer, None, ('127.0.0.1', 0))
+
+    if pInstID is not None:
+        lSocket.instId = pInstID
+
+    lSocket.handleConnected()
+    lSocket.sendq.clear()
+
+    return lSocket
+
+
+def test_instid_set_after_connect_is_delivered():
+
+    lServer = createServer()
+
+    lSender = connect(lServer)
+    lTarget = connect(lServer)
+
+    lTarget.instId = 42
+
+    assert lServer.sendToInstId(b'hello', lSender, 42) == True
+    assert len(lTarget.sendq) == 1
+    assert len(lSender.sendq) == 0
+
+
+def test_instid_set_before_connect_is_delivered():
+
+    lServer = createServer()
+
+    lSender = connect(lServer)
+    lTarget = connect(lServer, 7)
+
+    lServer.sendToInstId(b'hello', lSender, 7)
+
+    assert len(lTarget.sendq) == 1
+
+
+def test_instid_change_moves_the_socket():
+
+    lServer = createServer()
+
+    lSender = connect(lServer)
+    lTarget = connect(lServer, 1)
+
+    lTarget.instId = 2
+
+    lServer.sendToInstId(b'old', lSender, 1)
+    assert len(lTarget.sendq) == 0
+
+    lServer.sendToInstId(b'new', lSender, 2)
+    assert len(lTarget.sendq) == 1
+
+    assert 1 not in lServer.mInstIdIndex
+
+
+def test_disconnect_unindexes():
+
+    lServer = createServer()
+
+    lSender = connect(lServer)
+    lTarget = connect(lServer)
+
+    lTarget.instId = 3
+    lTarget.handleClose()
+
+    assert lServer.deliverToInstId(b'hello', lSender.socketId, 3) == 0
+    assert 3 not in lServer.mInstIdIndex
@@ -0,0 +1,264 @@
+######################################################
+##
+##   Metrics registry, Prometheus text exposition,
+##   GET /metrics endpoint and server instrumentation
+##
+######################################################
+
+import urllib.error
+import urllib.request
+
+import pytest
+from django.conf import settings
+
+from websocket.Metrics import MetricsRegistry, MetricsHttpServer, NULL_METRIC, Counter, Gauge, Histogram, formatValue
+from websocket.ChannelHandler.Channel import ChannelHandler, ChannelRegistry
+from websocket.WebsocketServer import WebsocketServer, TrackedWebsocketClient
+
+SEND_METHODS = ('sendToChannel', 'sendToAll', 'sendToInstId')
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+
+    lRegistry = MetricsRegistry(True)
+
+    monkeypatch.setattr(MetricsRegistry, 'mInstance', lRegistry)
+    monkeypatch.setattr(settings, 'WEBSOCKET_METRICS', True, raising=False)
+
+    yield lRegistry
+
+    # class level counters of the channel handler
+    ChannelHandler.bindMetrics(MetricsRegistry(False))
+    ChannelRegistry.reset()
+
+
+def fetch(pPort, pPath):
+
+    with urllib.request.urlopen('http://127.0.0.1:%d%s' % (pPort, pPath), timeout=5.0) as lResponse:
+        return lResponse.status, lResponse.headers['Content-Type'], lResponse.read().decode('utf-8')
+
+
+######################################################
+##
+##                     Registry
+##
+######################################################
+
+def test_disabled_registry_hands_out_null_metrics():
+
+    lRegistry = MetricsRegistry()
+
+    assert lRegistry.counter('c', 'help') is NULL_METRIC
+    assert lRegistry.gauge('g', 'help') is NULL_METRIC
+    assert lRegistry.histogram('h', 'help') is NULL_METRIC
+    assert lRegistry.render() == "\n"
+
+    NULL_METRIC.inc()
+    NULL_METRIC.observe(1.0)
+
+
+def test_metrics_are_registered_once():
+
+    lRegistry = MetricsRegistry(True)
+
+    lCounter = lRegistry.counter('requests_total', 'Requests', { 'kind' : 'a' })
+
+    assert type(lCounter) is Counter
+    assert lRegistry.counter('requests_total', 'Requests', { 'kind' : 'a' }) is lCounter
+    assert lRegistry.counter('requests_total', 'Requests', { 'kind' : 'b' }) is not lCounter
+
+    with pytest.raises(NameError):
+        lRegistry.gauge('requests_total', 'Requests', { 'kind' : 'a' })
+
+
+def test_counter_and_gauge_values():
+
+    lRegistry = MetricsRegistry(True)
+
+    lCounter = lRegistry.counter('c', 'help')
+    lGauge = lRegistry.gauge('g', 'help')
+
+    lCounter.inc()
+    lCounter.inc(4)
+    lGauge.set(10)
+    lGauge.dec(3)
+    lGauge.inc()
+
+    assert (lCounter.value, lGauge.value) == (5, 8)
+    assert lRegistry.gauge('cb', 'help', pCallback=lambda: 42).value == 42
+
+
+def test_timed():
+
+    lRegistry = MetricsRegistry(True)
+    lHistogram = lRegistry.histogram('h', 'help')
+
+    def lFunction(pValue):
+
+        if pValue < 0:
+            raise ValueError(pValue)
+
+        return pValue * 2
+
+    lTimed = lRegistry.timed(lFunction, lHistogram)
+
+    assert lTimed(2) == 4
+
+    with pytest.raises(ValueError):
+        lTimed(-1)
+
+    # failed calls are observed too
+    assert lHistogram.mCount == 2
+
+    assert MetricsRegistry().timed(lFunction, NULL_METRIC) is lFunction
+
+
+######################################################
+##
+##               Prometheus text format
+##
+######################################################
+
+@pytest.mark.parametrize("pValue, pText", [ (3, "3"), (True, "1"), (False, "0"), (0.5, "0.5"), (float('inf'), "+Inf") ])
+def test_format_value(pValue, pText):
+    assert formatValue(pValue) == pText
+
+
+def test_render():
+
+    lRegistry = MetricsRegistry(True)
+
+    lRegistry.counter('b_total', 'B counter', { 'target' : 'x' }).inc(2)
+    lRegistry.counter('b_total', 'B counter', { 'target' : 'y' }).inc(3)
+    lRegistry.gauge('a_value', 'A gauge', { 'path' : 'c:\\"q"' }).set(1.5)
+
+    assert lRegistry.render().splitlines() == [
+        '# HELP a_value A gauge',
+        '# TYPE a_value gauge',
+        'a_value{path="c:\\\\\\"q\\""} 1.5',
+        '# HELP b_total B counter',
+        '# TYPE b_total counter',
+        'b_total{target="x"} 2',
+        'b_total{target="y"} 3',
+    ]
+
+
+def test_render_histogram():
+
+    lHistogram = Histogram('latency_seconds', 'Latency', { 'target' : 'all' }, (0.1, 1.0))
+
+    for lValue in (0.05, 0.1, 0.5, 2.0):
+        lHistogram.observe(lValue)
+
+    assert lHistogram.render() == [
+        'latency_seconds_bucket{target="all",le="0.1"} 2',
+        'latency_seconds_bucket{target="all",le="1.0"} 3',
+        'latency_seconds_bucket{target="all",le="+Inf"} 4',
+        'latency_seconds_sum{target="all"} 2.65',
+        'latency_seconds_count{target="all"} 4',
+    ]
+
+
+def test_failing_callback_does_not_break_the_scrape():
+
+    lRegistry = MetricsRegistry(True)
+
+    lRegistry.gauge('broken', 'Broken', pCallback=lambda: 1 / 0)
+    lRegistry.gauge('working', 'Working', pCallback=lambda: 7)
+
+    lLines = lRegistry.render().splitlines()
+
+    assert 'working 7' in lLines
+    assert not any(lLine.startswith('broken ') for lLine in lLines)
+
+
+######################################################
+##
+##                  HTTP endpoint
+##
+######################################################
+
+def test_http_endpoint():
+
+    lRegistry = MetricsRegistry(True)
+    lRegistry.counter('hits_total', 'Hits').inc()
+
+    lServer = MetricsHttpServer(lRegistry, 0)
+    lServer.start()
+
+    try:
+        lStatus, lContentType, lBody = fetch(lServer.port, '/metrics?x=1')
+
+        assert lStatus == 200
+        assert lContentType.startswith('text/plain; version=0.0.4')
+        assert lBody == lRegistry.render()
+
+        with pytest.raises(urllib.error.HTTPError) as lError:
+            fetch(lServer.port, '/other')
+
+        assert lError.value.code == 404
+    finally:
+        lServer.close()
+
+
+######################################################
+##
+##              Server instrumentation
+##
+######################################################
+
+def test_disabled_metrics_leave_send_methods_unwrapped(monkeypatch):
+
+    monkeypatch.setattr(MetricsRegistry, 'mInstance', MetricsRegistry())
+
+    lServer = WebsocketServer(pDisableInit=True)
+
+    for lMethod in SEND_METHODS:
+        assert lMethod not in vars(lServer)
+        assert getattr(lServer, lMethod).__func__ is getattr(WebsocketServer, lMethod)
+
+    assert lServer.mConnectCounter is NULL_METRIC
+
+    # no endpoint either
+    monkeypatch.setattr(settings, 'WEBSOCKET_METRICS_PORT', 1, raising=False)
+    lServer.startMetricsEndpoint()
+
+    assert lServer.mMetricsServer is None
+
+
+def test_enabled_metrics_time_send_methods(enabled, monkeypatch):
+
+    lServer = WebsocketServer(pDisableInit=True)
+
+    for lMethod in SEND_METHODS:
+        assert lMethod in vars(lServer)
+
+    lSender = TrackedWebsocketClient(lServer, None, ('127.0.0.1', 0))
+    lSender.handleConnected()
+
+    lServer.sendToAll(b'payload', lSender)
+
+    lBody = enabled.render()
+
+    assert 'websocket_send_seconds_count{target="all"} 1' in lBody
+    assert 'websocket_send_seconds_count{target="channel"} 0' in lBody
+    assert 'websocket_clients 1' in lBody
+    assert 'websocket_connections_total 1' in lBody
+
+
+def test_server_endpoint(enabled, monkeypatch):
+
+    monkeypatch.setattr(settings, 'WEBSOCKET_METRICS_PORT', 1, raising=False)
+
+    lServer = WebsocketServer(pDisableInit=True)
+
+    # port offset -1 : any free port
+    lServer.startMetricsEndpoint(-1)
+
+    try:
+        lStatus, lContentType, lBody = fetch(lServer.mMetricsServer.port, '/metrics')
+
+        assert '# TYPE websocket_connections_total counter' in lBody
+    finally:
+        lServer.mMetricsServer.close()
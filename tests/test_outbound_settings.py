@@ -0,0 +1,28 @@
+######################################################
+##
+##   Outbound queue watermarks read from settings
+##
+######################################################
+
+from django.conf import settings
+
+from websocket.WebsocketServer import WebsocketServer
+
+
+def test_watermarks_from_strings(monkeypatch):
+
+    monkeypatch.setattr(settings, 'WEBSOCKET_SEND_QUEUE_HIGH_WATERMARK', '400', raising=False)
+    monkeypatch.setattr(settings, 'WEBSOCKET_SEND_QUEUE_LOW_WATERMARK', '100', raising=False)
+
+    lGuard = WebsocketServer(pDisableInit=True).outboundGuard
+
+    assert lGuard.mHighWatermark == 400
+    assert lGuard.mLowWatermark == 100
+
+
+def test_default_low_watermark(monkeypatch):
+
+    monkeypatch.setattr(settings, 'WEBSOCKET_SEND_QUEUE_HIGH_WATERMARK', 400, raising=False)
+    monkeypatch.setattr(settings, 'WEBSOCKET_SEND_QUEUE_LOW_WATERMARK', None, raising=False)
+
+    assert WebsocketServer(pDisableInit=True).outboundGuard.mLowWatermark == 100
@@ -0,0 +1,284 @@
+######################################################
+##
+##   Byte for byte compatibility of the table-driven
+##   VaubanPacket encoder with the baseline one, kept
+##     below as LegacyVaubanPacket ( one instance
+##         state per packet, see test_no_leak )
+##
+######################################################
+
+import codecs
+from enum import Enum
+
+import pytest
+
+from Packet import VaubanPacket, VaubanOpcodes, VaubanEnrollementData, VaubanOpcodeHandler, VaubanFrameCache, encodeVaubanFrame
+
+DEVICE_IDS = (0x1, 0x9, 0xF, 0x10, 0x12, 0xAB, 0xFF, 0x100, 0x1234, 0xABCD, 0xFFFF, 0x10000, 0xABCDEF)
+
+# single digit, two digit, three digit and four digit hex values
+VALUES = (0, 1, 9, 10, 15, 16, 42, 99, 100, 128, 200, 255, 256, 500, 1000, 4095, 4096, 65535)
+
+######################################################
+##
+##     Baseline encoder ( 7f302b0:Packet.py ), only
+##       mBytes / mControlFrame are per instance
+##
+######################################################
+
+class LegacyVaubanPacket(object):
+
+    mStartFrame = 0x2
+    mEndFrame = 0x3
+
+    def __init__(self, pDevicePtr, pOpcode):
+
+        self.mBytes = bytearray()
+        self.mControlFrame = bytearray()
+        self.mDevicePtr = pDevicePtr
+        self.mOpcode = pOpcode.value
+
+    def createControlFrame(self):
+
+        lXorStr = ""
+
+        for lByte in self.mBytes:
+            lXorStr += hex(int(lByte)) + "^"
+
+        lControlFrame = hex(eval(lXorStr[:-1])).replace('0x', '').upper().zfill(2)
+
+        for lChar in lControlFrame:
+            lByte = int(codecs.encode(bytes(lChar.encode('ascii')), 'hex'))
+
+            self.mControlFrame.append(lByte)
+
+    def pushData(self, pData, pByteSize = 1):
+
+        if(issubclass(type(pData), Enum) is True):
+            pData = pData.value
+
+        if type(pData) is bytearray or type(pData) is dict:
+
+            for lByte in pData:
+                self.mBytes.append(lByte)
+
+        else:
+
+            if len(str(pData)) < 2 and  pByteSize == 2 or len(hex(pData).replace('0x', '')) < 2 and  pByteSize == 2:
+                pData = '0' + hex(pData).replace('0x', '').upper()
+            else :
+                pData = hex(pData).replace('0x', '').upper()
+
+            if len(str(pData)) >= 2:
+
+                for lData in str(pData):
+                    self.mBytes.append(int(hex(ord(str(lData).encode('ascii'))).replace('0x', '')))
+
+            else:
+                self.mBytes.append(int(hex(ord(str(pData).encode('ascii'))).replace('0x', '').zfill(pByteSize)))
+
+    def insertDeviceID(self):
+
+        lDeviceId = hex(self.mDevicePtr.deviceId).replace("0x", "").upper().zfill(4)
+
+        for lI in lDeviceId:
+            lByte = int(codecs.encode(bytes(lI.encode('ascii')), 'hex'))
+
+            self.mBytes.append(int('0x' + str(lByte), 16))
+
+    def finalizePacket(self):
+
+        lPacket = self.mBytes
+
+        self.mBytes = bytearray()
+
+        self.insertDeviceID()
+
+        self.mBytes.append(int(hex(ord(chr(self.mOpcode))).replace('0x', ''), 16))
+
+        for lByte in lPacket:
+            self.mBytes.append(int('0x'+str(lByte), 16))
+
+        self.createControlFrame()
+
+        for lByte in self.mControlFrame:
+            self.mBytes.append(int('0x'+str(lByte), 16))
+
+        self.mBytes.insert(0, self.mStartFrame)
+        self.mBytes.append(self.mEndFrame)
+
+        return self.mBytes
+
+######################################################
+##
+##     Fields pushed by each VaubanOpcodeHandler
+##                 sending method
+##
+######################################################
+
+class FakeSerialPort(object):
+
+    def __init__(self):
+        self.mWritten = []
+
+    def write(self, pData):
+        self.mWritten.append(bytes(pData))
+        return len(pData)
+
+
+class FakeDevice(object):
+
+    def __init__(self, pDeviceId):
+
+        self.deviceId = pDeviceId
+        self.device = FakeSerialPort()
+        self.metrics = None
+
+
+def legacyFrame(pDeviceId, pOpcode, pFields):
+
+    lPacket = LegacyVaubanPacket(FakeDevice(pDeviceId), pOpcode)
+
+    for lValue, lSize in pFields:
+        lPacket.pushData(lValue, lSize)
+
+    return bytes(lPacket.finalizePacket())
+
+def newFrame(pDeviceId, pOpcode, pFields):
+
+    lPacket = VaubanPacket(device=FakeDevice(pDeviceId), opcode=pOpcode)
+
+    for lValue, lSize in pFields:
+        lPacket.pushData(lValue, lSize)
+
+    return bytes(lPacket.finalizePacket())
+
+def handlerFrame(pDeviceId, pSend):
+
+    lDevice = FakeDevice(pDeviceId)
+
+    pSend(VaubanOpcodeHandler(VaubanFrameCache(64)), lDevice)
+
+    assert len(lDevice.device.mWritten) == 1
+
+    return lDevice.device.mWritten[0]
+
+
+@pytest.mark.parametrize('pDeviceId', DEVICE_IDS)
+def test_polling(pDeviceId):
+
+    lExpected = legacyFrame(pDeviceId, VaubanOpcodes.MSG_SEND_POLLING, ())
+
+    assert newFrame(pDeviceId, VaubanOpcodes.MSG_SEND_POLLING, ()) == lExpected
+    assert handlerFrame(pDeviceId, lambda pHandler, pDevice: pHandler.sendPollingPacket(pDevice)) == lExpected
+
+
+@pytest.mark.parametrize('pDeviceId', DEVICE_IDS)
+@pytest.mark.parametrize('pValue', VALUES)
+def test_led(pDeviceId, pValue):
+
+    lFields = ((pValue, 2), (255 - pValue % 256, 2), (pValue // 2, 2), (pValue, 2), (pValue % 16, 1))
+    lExpected = legacyFrame(pDeviceId, VaubanOpcodes.MSG_SEND_LED, lFields)
+
+    assert newFrame(pDeviceId, VaubanOpcodes.MSG_SEND_LED, lFields) == lExpected
+    assert handlerFrame(pDeviceId, lambda pHandler, pDevice: pHandler.sendLedPacket(*[ lValue for lValue, lSize in lFields ], pDevice)) == lExpected
+
+
+@pytest.mark.parametrize('pDeviceId', DEVICE_IDS)
+@pytest.mark.parametrize('pValue', VALUES)
+def test_buzzer(pDeviceId, pValue):
+
+    lFields = ((pValue % 2, 1), (pValue, 2), (pValue % 10, 1))
+    lExpected = legacyFrame(pDeviceId, VaubanOpcodes.MSG_SEND_BIP, lFields)
+
+    assert newFrame(pDeviceId, VaubanOpcodes.MSG_SEND_BIP, lFields) == lExpected
+    assert handlerFrame(pDeviceId, lambda pHandler, pDevice: pHandler.sendBuzzerPacket(pValue % 2, pValue, pValue % 10, pDevice)) == lExpected
+
+
+@pytest.mark.parametrize('pDeviceId', DEVICE_IDS)
+@pytest.mark.parametrize('pFingers', list(VaubanEnrollementData) + [ 1, 2, 3, 16, 255 ])
+def test_enrollment(pDeviceId, pFingers):
+
+    lExpected = legacyFrame(pDeviceId, VaubanOpcodes.MSG_SEND_ENROLLMENT, ((pFingers, 1),))
+
+    assert newFrame(pDeviceId, VaubanOpcodes.MSG_SEND_ENROLLMENT, ((pFingers, 1),)) == lExpected
+    assert handlerFrame(pDeviceId, lambda pHandler, pDevice: pHandler.sendEnrollementPacket(pFingers, pDevice)) == lExpected
+
+
+@pytest.mark.parametrize('pDeviceId', DEVICE_IDS)
+@pytest.mark.parametrize('pMode', (0, 1))
+def test_fingerprint_define(pDeviceId, pMode):
+
+    lExpected = legacyFrame(pDeviceId, VaubanOpcodes.MSG_SEND_FINGERPRINT_DEFINE, ((pMode, 1),))
+
+    assert newFrame(pDeviceId, VaubanOpcodes.MSG_SEND_FINGERPRINT_DEFINE, ((pMode, 1),)) == lExpected
+    assert handlerFrame(pDeviceId, lambda pHandler, pDevice: pHandler.sendVerificationPacket(pMode, pDevice)) == lExpected
+
+
+@pytest.mark.parametrize('pOpcode', list(VaubanOpcodes))
+@pytest.mark.parametrize('pValue', VALUES)
+@pytest.mark.parametrize('pByteSize', (1, 2, 3))
+def test_push_value(pOpcode, pValue, pByteSize):
+
+    lFields = ((pValue, pByteSize), (pValue, pByteSize))
+
+    assert newFrame(0x12, pOpcode, lFields) == legacyFrame(0x12, pOpcode, lFields)
+
+
+@pytest.mark.parametrize('pOpcode', list(VaubanOpcodes))
+def test_push_bytearray(pOpcode):
+
+    # raw bytes are decimal-coded hex ( 41 -> 0x41 ), 0 to 99 fit
+    lPayload = bytearray(range(100))
+
+    assert newFrame(0x12, pOpcode, ((lPayload, 1),)) == legacyFrame(0x12, pOpcode, ((lPayload, 1),))
+    assert newFrame(0x12, pOpcode, (({ 12 : 0, 45 : 1 }, 1),)) == legacyFrame(0x12, pOpcode, (({ 12 : 0, 45 : 1 }, 1),))
+
+
+def test_push_bytearray_out_of_range():
+
+    with pytest.raises(ValueError):
+        legacyFrame(0x12, VaubanOpcodes.MSG_SEND_LED, ((bytearray([ 100 ]), 1),))
+
+    with pytest.raises(ValueError):
+        newFrame(0x12, VaubanOpcodes.MSG_SEND_LED, ((bytearray([ 100 ]), 1),))
+
+
+def test_encode_frame_matches_packet():
+
+    lPacket = VaubanPacket(device=FakeDevice(0x12), opcode=VaubanOpcodes.MSG_SEND_LED)
+    lPacket.pushData(500, 2)
+
+    assert bytes(encodeVaubanFrame(0x12, VaubanOpcodes.MSG_SEND_LED, b'1F4')) == bytes(lPacket.finalizePacket())
+
+######################################################
+##
+##   The baseline kept mBytes / mControlFrame at
+##   class level : every packet of the process saw
+##     the control frames of the previous ones
+##
+######################################################
+
+def test_no_leak_between_packets():
+
+    lFirst = newFrame(0x12, VaubanOpcodes.MSG_SEND_LED, ((255, 2), (0, 2), (0, 2), (500, 2), (3, 1)))
+
+    for lI in range(3):
+        newFrame(0x34, VaubanOpcodes.MSG_SEND_BIP, ((1, 1), (500, 2), (2, 1)))
+
+    assert newFrame(0x12, VaubanOpcodes.MSG_SEND_LED, ((255, 2), (0, 2), (0, 2), (500, 2), (3, 1))) == lFirst
+
+    assert VaubanPacket.mBytes == bytearray()
+    assert VaubanPacket.mControlFrame == bytearray()
+
+
+def test_packets_do_not_share_buffers():
+
+    lFirst = VaubanPacket(device=FakeDevice(0x12), opcode=VaubanOpcodes.MSG_SEND_BIP)
+    lSecond = VaubanPacket(device=FakeDevice(0x12), opcode=VaubanOpcodes.MSG_SEND_BIP)
+
+    lFirst.pushData(1, 1)
+
+    assert lFirst.mBytes is not lSecond.mBytes
+    assert lFirst.mControlFrame is not lSecond.mControlFrame
+    assert len(lSecond.mBytes) == 0
@@ -0,0 +1,119 @@
+######################################################
+##
+##    ShardBus : message format, private socket
+##       directory, stalled peers never block
+##
+######################################################
+
+import os
+import threading
+
+import pytest
+
+from websocket.ShardedWebsocketServer import ShardBus, encodeShardMessage, decodeShardMessage, checkShardDirectory
+
+
+@pytest.fixture
+def directory(tmp_path):
+
+    lDirectory = tmp_path / "shards"
+    lDirectory.mkdir(mode=0o700)
+
+    return str(lDirectory)
+
+
+@pytest.mark.parametrize("pMessage", [
+    ('channel', 'LOBBY', 3, b'\x00\x01binary\xff'),
+    ('all', None, 7, b''),
+    ('inst', 42, 1, 'text payload é'),
+    ('notify', 'LOBBY', None, ([ (1, 3, 1), (4, 4, 2) ], { 5 : 2, 6 : 3 })),
+])
+def test_message_round_trip(pMessage):
+
+    lKind, lTarget, lSenderId, lPayload = decodeShardMessage(memoryview(encodeShardMessage(pMessage)))
+
+    assert (lKind, lTarget, lSenderId) == pMessage[:3]
+
+    assert lPayload == pMessage[3]
+    assert type(lPayload) is type(pMessage[3])
+
+
+def test_truncated_message_is_rejected():
+
+    with pytest.raises(NameError):
+        decodeShardMessage(encodeShardMessage(('all', None, 1, b'data'))[:6])
+
+
+def test_shared_directory_is_refused(directory):
+
+    os.chmod(directory, 0o755)
+
+    with pytest.raises(NameError):
+        checkShardDirectory(directory)
+
+    with pytest.raises(NameError):
+        ShardBus(0, 2, directory).open()
+
+
+def test_symlinked_directory_is_refused(directory, tmp_path):
+
+    lLink = str(tmp_path / "link")
+    os.symlink(directory, lLink)
+
+    with pytest.raises(NameError):
+        checkShardDirectory(lLink)
+
+
+def test_publish_between_workers(directory):
+
+    lFirst = ShardBus(0, 2, directory)
+    lSecond = ShardBus(1, 2, directory)
+
+    lFirst.open()
+    lSecond.open()
+
+    lReceived = []
+    lDone = threading.Event()
+
+    def lHandler(pMessage):
+        lReceived.append(pMessage)
+        lDone.set()
+
+    try:
+        lSecond.start(lHandler)
+
+        assert lFirst.publish(('channel', 'LOBBY', 3, b'hello')) == True
+        assert lDone.wait(2.0) == True
+        assert lReceived == [ ('channel', 'LOBBY', 3, b'hello') ]
+    finally:
+        lFirst.close()
+        lSecond.close()
+
+
+def test_stalled_peer_does_not_block_publish(directory):
+
+    lFirst = ShardBus(0, 2, directory)
+    lStalled = ShardBus(1, 2, directory)
+
+    lFirst.open()
+
+    # bound but never read
+    lStalled.open()
+
+    lDone = threading.Event()
+
+    def lPublish():
+
+        for lI in range(2000):
+            lFirst.publish(('all', None, 1, b'x' * 65536))
+
+        lDone.set()
+
+    try:
+        threading.Thread(target=lPublish, daemon=True).start()
+
+        assert lDone.wait(10.0) == True
+        assert lFirst.mDropped > 0
+    finally:
+        lFirst.close()
+        lStalled.close()
@@ -0,0 +1,65 @@
+######################################################
+##
+##   WEBSOCKET_SERVER_CAPACITY is split over shards
+##
+######################################################
+
+from django.conf import settings
+
+from websocket.ChannelHandler.Channel import ChannelRegistry
+from websocket.ShardedWebsocketServer import ShardRelay
+from websocket.WebsocketServer import WebsocketServer, TrackedWebsocketClient
+
+
+class FakeBus(object):
+
+    def start(self, pCallback):
+        return
+
+    def publish(self, pMessage):
+        return
+
+
+class LocalShard(ShardRelay, WebsocketServer):
+
+    def __init__(self):
+        WebsocketServer.__init__(self, 9000, '', True)
+
+
+def createShard(pIndex, pCount):
+
+    lServer = LocalShard()
+    lServer.initShard(pIndex, pCount, FakeBus())
+
+    return lServer
+
+def teardown_function(pFunction):
+
+    ChannelRegistry.reset()
+    ChannelRegistry.mConsistencyMode = ChannelRegistry.CONSISTENCY_LOCAL
+
+
+def test_capacity_is_split_over_shards(monkeypatch):
+
+    monkeypatch.setattr(settings, 'WEBSOCKET_SERVER_CAPACITY', 10, raising=False)
+
+    assert createShard(0, 4).capacity == 3
+    assert createShard(0, 1).capacity == 10
+
+    lServer = createShard(1, 5)
+
+    assert lServer.capacity == 2
+
+    lSockets = [ TrackedWebsocketClient(lServer, None, ('127.0.0.1', 0)) for lI in range(3) ]
+
+    for lSocket in lSockets:
+        lSocket.handleConnected()
+
+    assert len(lServer.clientList) == 2
+
+
+def test_unlimited_capacity_stays_unlimited(monkeypatch):
+
+    monkeypatch.setattr(settings, 'WEBSOCKET_SERVER_CAPACITY', 0, raising=False)
+
+    assert createShard(0, 4).capacity == 0
@@ -0,0 +1,133 @@
+######################################################
+##
+##   Off-loop TLS handshakes against a self-signed
+##     certificate, session resumption and timeout
+##
+######################################################
+
+import select
+import shutil
+import socket
+import ssl
+import subprocess
+import time
+
+import pytest
+
+from TlsHandshake import TlsHandshakeListener, TlsHandshakeStats, createServerContext
+
+
+@pytest.fixture(scope="module")
+def certificate(tmp_path_factory):
+
+    lOpenssl = shutil.which("openssl")
+
+    if lOpenssl is None:
+        pytest.skip("openssl is required to generate a test certificate")
+
+    lPath = tmp_path_factory.mktemp("tls")
+    lCertfile = str(lPath / "cert.pem")
+    lKeyfile = str(lPath / "key.pem")
+
+    subprocess.run([ lOpenssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                     "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+                     "-keyout", lKeyfile, "-out", lCertfile ],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    return lCertfile, lKeyfile
+
+
+def createListener(pCertfile, pKeyfile, pTimeout = 5.0):
+
+    lSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    lSocket.bind(("127.0.0.1", 0))
+    lSocket.listen(16)
+
+    lListener = TlsHandshakeListener(lSocket, createServerContext(pCertfile, pKeyfile), 2, pTimeout, TlsHandshakeStats())
+    lListener.start()
+
+    return lListener, lSocket.getsockname()
+
+
+def acceptReady(pListener, pTimeout = 5.0):
+
+    # the select loop only sees the wake-up socketpair
+    lReadable, _, _ = select.select([ pListener ], [], [], pTimeout)
+
+    assert lReadable == [ pListener ]
+
+    return pListener.accept()
+
+
+def waitFor(pCondition, pTimeout = 5.0):
+
+    lDeadline = time.monotonic() + pTimeout
+
+    while pCondition() == False and time.monotonic() < lDeadline:
+        time.sleep(0.01)
+
+    return pCondition()
+
+
+def test_handshake_and_resumption(certificate):
+
+    lCertfile, lKeyfile = certificate
+    lListener, lAddress = createListener(lCertfile, lKeyfile)
+
+    # TLS 1.2 sessions are usable right after the handshake
+    lContext = ssl.create_default_context(cafile=lCertfile)
+    lContext.maximum_version = ssl.TLSVersion.TLSv1_2
+
+    try:
+        lClient = lContext.wrap_socket(socket.create_connection(lAddress), server_hostname="localhost")
+        lServer, _ = acceptReady(lListener)
+
+        lClient.sendall(b'ping')
+        assert lServer.recv(4) == b'ping'
+
+        lSession = lClient.session
+
+        lClient.close()
+        lServer.close()
+
+        lClient = lContext.wrap_socket(socket.create_connection(lAddress), server_hostname="localhost", session=lSession)
+        lServer, _ = acceptReady(lListener)
+
+        assert lClient.session_reused == True
+
+        lClient.close()
+        lServer.close()
+
+        lStats = lListener.stats.getStats()
+
+        assert lStats['handshakes'] == 2
+        assert lStats['resumed'] == 1
+        assert lStats['failures'] == 0
+        assert lListener.pending == 0
+    finally:
+        lListener.close()
+
+
+def test_silent_client_times_out(certificate):
+
+    lCertfile, lKeyfile = certificate
+    lListener, lAddress = createListener(lCertfile, lKeyfile, pTimeout=0.2)
+
+    try:
+        # connects but never sends a ClientHello
+        lClient = socket.create_connection(lAddress)
+
+        assert waitFor(lambda: lListener.stats.getStats()['failures'] == 1) == True
+
+        lStats = lListener.stats.getStats()
+
+        assert lStats['handshakes'] == 0
+        assert lListener.pending == 0
+
+        # the worker closed its side of the connection
+        lClient.settimeout(2.0)
+        assert lClient.recv(1) == b''
+
+        lClient.close()
+    finally:
+        lListener.close()
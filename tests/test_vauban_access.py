@@ -0,0 +1,139 @@
+######################################################
+##
+##   VaubanAccessDispatcher slot accounting, cached
+##          None decisions and backend failures
+##
+######################################################
+
+import threading
+
+import VaubanAccess
+from VaubanAccess import VaubanAccessDispatcher
+
+
+class FakeDevice(object):
+    interface = '/dev/fake0'
+
+
+class RecordingLogger(object):
+
+    mLines = []
+
+    def __init__(self, pName):
+        return
+
+    def Write(self, pMessage):
+        RecordingLogger.mLines.append(pMessage)
+
+
+class FakeClient(object):
+
+    def __init__(self, pResult = None, pException = None):
+
+        self.mResult = pResult
+        self.mException = pException
+        self.mGate = threading.Event()
+        self.mGate.set()
+        self.mCalls = 0
+
+    def checkAccess(self, pCardId, pInterface):
+
+        self.mCalls += 1
+        self.mGate.wait(5.0)
+
+        if self.mException is not None:
+            raise self.mException
+
+        return self.mResult
+
+
+def createDispatcher(pClient, pMaxPending = 2):
+
+    lReplies = []
+    lDone = threading.Semaphore(0)
+
+    def lReply(pDevicePtr, pCardId, pResult):
+        lReplies.append((pCardId, pResult))
+        lDone.release()
+
+    return VaubanAccessDispatcher(2, pMaxPending, 30.0, pClient, lReply), lReplies, lDone
+
+def freeSlots(pDispatcher):
+
+    lCount = 0
+
+    while pDispatcher.mSlots.acquire(False) == True:
+        lCount += 1
+
+    for lI in range(lCount):
+        pDispatcher.mSlots.release()
+
+    return lCount
+
+
+def test_cached_none_keeps_slots():
+
+    lClient = FakeClient(None)
+    lDispatcher, lReplies, lDone = createDispatcher(lClient)
+
+    assert lDispatcher.checkAccess('0000002a', FakeDevice()) == True
+    assert lDone.acquire(timeout=5.0) == True
+
+    # fresh cached None : answered from the cache, no slot taken
+    for lI in range(5):
+        assert lDispatcher.checkAccess('0000002a', FakeDevice()) == True
+        assert lDone.acquire(timeout=5.0) == True
+
+    lDispatcher.shutdown()
+
+    assert lClient.mCalls == 1
+    assert lReplies == [ ('0000002a', None) ] * 6
+    assert freeSlots(lDispatcher) == 2
+
+
+def test_saturated_pool_rejects_then_recovers():
+
+    lClient = FakeClient(True)
+    lClient.mGate.clear()
+
+    lDispatcher, lReplies, lDone = createDispatcher(lClient)
+
+    assert lDispatcher.checkAccess('00000001', FakeDevice()) == True
+    assert lDispatcher.checkAccess('00000002', FakeDevice()) == True
+    assert lDispatcher.checkAccess('00000003', FakeDevice()) == False
+
+    lClient.mGate.set()
+
+    assert lDone.acquire(timeout=5.0) == True
+    assert lDone.acquire(timeout=5.0) == True
+
+    lDispatcher.shutdown()
+
+    assert freeSlots(lDispatcher) == 2
+    assert lDispatcher.getStats()['rejected'] == 1
+
+
+def test_backend_failure_is_logged_and_denied(monkeypatch):
+
+    monkeypatch.setattr(VaubanAccess, 'Logger', RecordingLogger)
+
+    lDispatcher, lReplies, lDone = createDispatcher(FakeClient(pException=IOError("backend down")))
+
+    assert lDispatcher.checkAccess('0000002a', FakeDevice()) == True
+    assert lDone.acquire(timeout=5.0) == True
+
+    lDispatcher.shutdown()
+
+    assert lReplies == [ ('0000002a', False) ]
+    assert freeSlots(lDispatcher) == 2
+    assert any('backend down' in lLine for lLine in RecordingLogger.mLines)
+
+
+def test_submit_after_shutdown_gives_the_slot_back():
+
+    lDispatcher, lReplies, lDone = createDispatcher(FakeClient(True))
+    lDispatcher.shutdown()
+
+    assert lDispatcher.checkAccess('0000002a', FakeDevice()) == False
+    assert freeSlots(lDispatcher) == 2
+    assert lDispatcher.getStats()['pending'] == 0
@@ -0,0 +1,254 @@
+######################################################
+##
+##   VaubanAccessCache TTL, LRU eviction, snapshots,
+##   preload, hit rate and stale answers of the
+##               access dispatcher
+##
+######################################################
+
+import json
+import threading
+import time
+
+import pytest
+
+from VaubanAccess import VaubanAccessCache, VaubanAccessDispatcher
+
+
+class FakeDevice(object):
+    interface = '/dev/fake0'
+
+
+class FakeClient(object):
+
+    def __init__(self, pResult):
+
+        self.mResult = pResult
+        self.mGate = threading.Event()
+        self.mGate.set()
+        self.mCalls = 0
+
+    def checkAccess(self, pCardId, pInterface):
+
+        self.mCalls += 1
+        self.mGate.wait(5.0)
+
+        return self.mResult
+
+
+def createDispatcher(pClient, pMaxPending = 2, pServeStale = 0.0):
+
+    lReplies = []
+    lDone = threading.Semaphore(0)
+
+    def lReply(pDevicePtr, pCardId, pResult):
+        lReplies.append((pCardId, pResult))
+        lDone.release()
+
+    lDispatcher = VaubanAccessDispatcher(1, pMaxPending, 30.0, pClient, lReply, pServeStale=pServeStale)
+
+    return lDispatcher, lReplies, lDone
+
+def putExpired(pCache, pCardId, pInterface, pResult, pExpiredFor):
+
+    # stored one TTL before its expiry
+    pCache.put(pCardId, pInterface, pResult, 10.0, time.time() - 10.0 - pExpiredFor)
+
+    return
+
+
+def test_fresh_stale_and_expired_entries():
+
+    lCache = VaubanAccessCache(pTTL=10.0, pMaxStale=100.0)
+
+    lCache.put(1, '/dev/fake0', True)
+    putExpired(lCache, 2, '/dev/fake0', True, 5.0)
+    putExpired(lCache, 3, '/dev/fake0', True, 200.0)
+
+    assert lCache.lookup(1, '/dev/fake0') == (True, True, 0.0)
+
+    lResult, lFresh, lExpiredFor = lCache.lookup(2, '/dev/fake0')
+
+    assert (lResult, lFresh) == (True, False)
+    assert lExpiredFor == pytest.approx(5.0, abs=1.0)
+
+    # older than mMaxStale
+    assert lCache.lookup(3, '/dev/fake0') == (None, False, None)
+    assert lCache.lookup(4, '/dev/fake0') == (None, False, None)
+
+
+def test_interface_wildcard():
+
+    lCache = VaubanAccessCache()
+    lCache.put(1, None, True)
+    lCache.put(1, '/dev/fake1', False)
+
+    assert lCache.lookup(1, '/dev/fake0')[0] == True
+    assert lCache.lookup(1, '/dev/fake1')[0] == False
+
+
+def test_lru_eviction():
+
+    lCache = VaubanAccessCache(pMaxSize=2)
+
+    lCache.put(1, None, True)
+    lCache.put(2, None, True)
+
+    # 1 becomes the most recently used
+    lCache.lookup(1, None)
+    lCache.put(3, None, True)
+
+    assert lCache.lookup(2, None)[0] is None
+    assert lCache.lookup(1, None)[0] == True
+    assert lCache.lookup(3, None)[0] == True
+    assert lCache.getStats()['evictions'] == 1
+
+
+def test_invalidate():
+
+    lCache = VaubanAccessCache()
+    lCache.put(1, None, True)
+    lCache.put(1, '/dev/fake0', True)
+    lCache.put(2, None, True)
+
+    lCache.invalidate(1)
+
+    assert lCache.getStats()['size'] == 1
+
+    lCache.invalidate()
+
+    assert lCache.getStats()['size'] == 0
+
+
+def test_save_load_round_trip(tmp_path):
+
+    lPath = str(tmp_path / "cache.json")
+
+    lCache = VaubanAccessCache(pTTL=10.0)
+    lCache.put(1, '/dev/fake0', True)
+    lCache.put(2, None, False)
+    putExpired(lCache, 3, None, True, 5.0)
+
+    assert lCache.save(lPath) == 3
+
+    lLoaded = VaubanAccessCache(pTTL=10.0)
+
+    assert lLoaded.load(lPath) == 3
+    assert lLoaded.lookup(1, '/dev/fake0')[:2] == (True, True)
+    assert lLoaded.lookup(2, '/dev/fake0')[:2] == (False, True)
+
+    # expiry survives the round trip
+    assert lLoaded.lookup(3, None)[:2] == (True, False)
+
+
+def test_preload_plain_list(tmp_path):
+
+    lPath = str(tmp_path / "preload.json")
+
+    with open(lPath, 'w') as lFile:
+        json.dump([ { 'card' : 1, 'access' : True }, { 'card' : 2, 'interface' : '/dev/fake0', 'access' : False } ], lFile)
+
+    lDispatcher, lReplies, lDone = createDispatcher(FakeClient(True))
+
+    try:
+        assert lDispatcher.preload(lPath, 60.0) == 2
+        assert lDispatcher.mCache.lookup(1, '/dev/fake0')[:2] == (True, True)
+        assert lDispatcher.mCache.lookup(2, '/dev/fake0')[:2] == (False, True)
+    finally:
+        lDispatcher.shutdown()
+
+
+def test_hit_rate():
+
+    lCache = VaubanAccessCache(pTTL=10.0)
+    lCache.put(1, None, True)
+    putExpired(lCache, 2, None, True, 1.0)
+
+    lCache.lookup(1, None)
+    lCache.lookup(2, None)
+    lCache.lookup(3, None)
+    lCache.lookup(4, None)
+
+    lStats = lCache.getStats()
+
+    assert (lStats['hits'], lStats['stale_hits'], lStats['misses']) == (1, 1, 2)
+    assert lStats['hit_rate'] == 0.5
+
+
+def test_expired_entry_waits_for_the_backend():
+
+    # the card was revoked since it was cached
+    lClient = FakeClient(False)
+    lDispatcher, lReplies, lDone = createDispatcher(lClient)
+
+    try:
+        putExpired(lDispatcher.mCache, 7, FakeDevice.interface, True, 1.0)
+
+        assert lDispatcher.checkAccess(7, FakeDevice()) == True
+        assert lDone.acquire(timeout=5.0) == True
+
+        assert lReplies == [ (7, False) ]
+        assert lClient.mCalls == 1
+    finally:
+        lDispatcher.shutdown()
+
+
+def test_expired_entry_answers_offline():
+
+    lClient = FakeClient(False)
+    lDispatcher, lReplies, lDone = createDispatcher(lClient)
+
+    try:
+        putExpired(lDispatcher.mCache, 7, FakeDevice.interface, True, 1.0)
+        lDispatcher.setOffline(True)
+
+        assert lDispatcher.checkAccess(7, FakeDevice()) == True
+        assert lReplies == [ (7, True) ]
+        assert lClient.mCalls == 0
+    finally:
+        lDispatcher.shutdown()
+
+
+def test_expired_entry_answers_on_saturated_pool():
+
+    lClient = FakeClient(True)
+    lClient.mGate.clear()
+
+    lDispatcher, lReplies, lDone = createDispatcher(lClient, pMaxPending=1)
+
+    try:
+        putExpired(lDispatcher.mCache, 7, FakeDevice.interface, True, 1.0)
+
+        # takes the only slot
+        assert lDispatcher.checkAccess(1, FakeDevice()) == True
+
+        assert lDispatcher.checkAccess(7, FakeDevice()) == True
+        assert lReplies == [ (7, True) ]
+    finally:
+        lClient.mGate.set()
+        lDispatcher.shutdown()
+
+
+def test_serve_stale_opt_in():
+
+    lClient = FakeClient(False)
+    lDispatcher, lReplies, lDone = createDispatcher(lClient, pServeStale=5.0)
+
+    try:
+        putExpired(lDispatcher.mCache, 7, FakeDevice.interface, True, 1.0)
+        putExpired(lDispatcher.mCache, 8, FakeDevice.interface, True, 60.0)
+
+        # within the bound : answered now, refreshed in background
+        assert lDispatcher.checkAccess(7, FakeDevice()) == True
+        assert lReplies == [ (7, True) ]
+
+        # past the bound : the backend answers
+        assert lDispatcher.checkAccess(8, FakeDevice()) == True
+        assert lDone.acquire(timeout=5.0) == True
+        assert lDone.acquire(timeout=5.0) == True
+
+        assert lReplies[1] == (8, False)
+    finally:
+        lDispatcher.shutdown()
+
+    assert lDispatcher.mCache.lookup(7, FakeDevice.interface)[:2] == (False, True)
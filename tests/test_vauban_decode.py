@@ -0,0 +1,150 @@
+######################################################
+##
+##   decodeVaubanFrame and the legacy packet decoder,
+##   malformed frames do not stop the read thread
+##
+######################################################
+
+import os
+import pty
+import threading
+
+import pytest
+
+import Packet
+from Packet import VaubanDevice, VaubanPacket, VaubanFrame, VaubanOpcodeHandler, decodeVaubanFrame, encodeVaubanFrame
+
+
+class RecordingLogger(object):
+
+    mLines = []
+
+    def __init__(self, pName):
+        self.mName = pName
+
+    def Write(self, pLine):
+        RecordingLogger.mLines.append((self.mName, pLine))
+
+
+@pytest.fixture
+def logger(monkeypatch):
+
+    monkeypatch.setattr(Packet, 'Logger', RecordingLogger)
+    RecordingLogger.mLines = []
+
+    return RecordingLogger
+
+
+def rawFrame(pDeviceId, pOpcode, pPayload = b''):
+
+    # any device ID bytes, with a valid control frame
+    lBody = pDeviceId + pOpcode + pPayload
+    lXor = 0
+
+    for lByte in lBody:
+        lXor ^= lByte
+
+    return b'\x02' + lBody + b'%02X' % lXor + b'\x03'
+
+
+######################################################
+##
+##                 decodeVaubanFrame
+##
+######################################################
+
+def test_decode_polling_frame():
+
+    lFrame = decodeVaubanFrame(encodeVaubanFrame(0xABCD, ord('P')))
+
+    assert (lFrame.deviceId, lFrame.opcode, lFrame.state, lFrame.cardId) == (0xABCD, 'P', None, None)
+
+
+def test_decode_enrollment_card_id():
+
+    # least significant byte first on the wire
+    lFrame = decodeVaubanFrame(encodeVaubanFrame(0x12, ord('E'), b'S2A010000'))
+
+    assert (lFrame.opcode, lFrame.state, lFrame.cardId) == ('E', 'S', '0000012a')
+
+
+def test_decode_failed_enrollment():
+
+    lFrame = decodeVaubanFrame(encodeVaubanFrame(0x12, ord('E'), b'F'))
+
+    assert (lFrame.state, lFrame.cardId) == ('F', None)
+
+
+def test_decode_invalid_card_id():
+
+    assert decodeVaubanFrame(encodeVaubanFrame(0x12, ord('E'), b'SZZ010000')).cardId is None
+
+
+@pytest.mark.parametrize("pFrame", [ b'\x02\x03', rawFrame(b'ZZ12', b'P'), rawFrame(b'00-1', b'P') ])
+def test_decode_rejects_malformed_frames(pFrame):
+
+    with pytest.raises(NameError):
+        decodeVaubanFrame(pFrame)
+
+
+######################################################
+##
+##               Legacy packet decoder
+##
+######################################################
+
+def test_legacy_decode_packet(logger):
+
+    lParser = Packet.VaubanFrameParser()
+    lLegacy = lParser.toLegacyPacket(bytes(encodeVaubanFrame(0x12, ord('E'), b'S')))
+    lPacket = VaubanPacket(packet=lLegacy)
+
+    assert lPacket.mOpcode == 'E'
+    assert logger.mLines == []
+
+
+def test_enrollment_state_goes_to_the_logger(logger):
+
+    lParser = Packet.VaubanFrameParser()
+    lLegacy = lParser.toLegacyPacket(bytes(encodeVaubanFrame(0x12, ord('E'), b'F')))
+
+    assert VaubanOpcodeHandler().handlingEnrollementPacket(VaubanPacket(packet=lLegacy)) == False
+    assert logger.mLines == [ ("vauban", "[Vauban] -> receive enrollement state : F") ]
+
+
+######################################################
+##
+##     Read thread survives frames it can not decode
+##
+######################################################
+
+def test_read_thread_survives_bad_device_id(logger):
+
+    lMaster, lSlave = pty.openpty()
+    lName = os.ttyname(lSlave)
+    os.close(lSlave)
+
+    lDevice = VaubanDevice(lName, 0x12)
+    lReceived = []
+    lDone = threading.Event()
+
+    def lCallback(pFrame):
+        lReceived.append(pFrame)
+        lDone.set()
+
+    try:
+        lDevice.startReadService(lCallback, pDecodeFrames=True)
+
+        os.write(lMaster, rawFrame(b'ZZ12', b'P'))
+        os.write(lMaster, bytes(encodeVaubanFrame(0x12, ord('P'))))
+
+        assert lDone.wait(2.0) == True
+        assert lDevice.mRunThread.is_alive() == True
+
+        assert [ (lFrame.deviceId, lFrame.opcode) for lFrame in lReceived ] == [ (0x12, 'P') ]
+        assert lDevice.mParser.framesCorrupt == 1
+        assert logger.mLines[0][1].startswith("[Vauban] -> reader 18 dropped frame")
+    finally:
+        lDevice.stopReadService()
+        lDevice.device.close()
+        os.close(lMaster)
@@ -0,0 +1,237 @@
+######################################################
+##
+##   AsyncVaubanDevice over a local pty pair : frames,
+##       hang-up ( EIO ) and end of file handling
+##
+######################################################
+
+import asyncio
+import os
+import pty
+
+import pytest
+
+import VaubanDeviceManager
+from Packet import encodeVaubanFrame
+from VaubanDeviceManager import VaubanDeviceManager as Manager
+
+
+def openPty():
+
+    lMaster, lSlave = pty.openpty()
+    lName = os.ttyname(lSlave)
+
+    # the device opens its own descriptor on the slave side
+    os.close(lSlave)
+
+    return lMaster, lName
+
+
+def test_frames_are_queued():
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager()
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+
+            os.write(lMaster, encodeVaubanFrame(0x12, ord('E'), b'S0000002A'))
+
+            lFrame = await asyncio.wait_for(lDevice.receive(), 2.0)
+
+            assert lFrame is not None
+            assert lDevice.lost == False
+        finally:
+            lManager.close()
+            os.close(lMaster)
+
+    asyncio.run(lMain())
+
+
+def test_hang_up_marks_the_device_lost():
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager()
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+            lReceiver = asyncio.ensure_future(lDevice.receive())
+
+            await asyncio.sleep(0.05)
+
+            # reads on the slave side now fail with EIO
+            os.close(lMaster)
+
+            with pytest.raises(NameError):
+                await asyncio.wait_for(lReceiver, 2.0)
+
+            assert lDevice.lost == True
+            assert lDevice.device.mDevicePtr.is_open == False
+
+            with pytest.raises(NameError):
+                lDevice.write(b'\x02')
+
+            with pytest.raises(NameError):
+                await lDevice.receive()
+        finally:
+            lManager.close()
+
+    asyncio.run(lMain())
+
+
+def test_end_of_file_stops_reading(monkeypatch):
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager()
+        lReads = []
+
+        def lRead(pDescriptor, pSize):
+            lReads.append(pDescriptor)
+            return b''
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+
+            monkeypatch.setattr(VaubanDeviceManager.os, 'read', lRead)
+
+            os.write(lMaster, b'\x02')
+
+            with pytest.raises(NameError):
+                await asyncio.wait_for(lDevice.receive(), 2.0)
+
+            # the reader is removed, no busy loop on the descriptor
+            await asyncio.sleep(0.05)
+
+            assert len(lReads) == 1
+            assert lDevice.lost == True
+        finally:
+            monkeypatch.undo()
+            lManager.close()
+            os.close(lMaster)
+
+    asyncio.run(lMain())
+
+
+######################################################
+##
+##   Closing wakes pending receivers, shutdown flushes
+##            frames already written
+##
+######################################################
+
+@pytest.mark.parametrize("pRemove", [ False, True ])
+def test_close_wakes_receivers(pRemove):
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager()
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+            lReceiver = asyncio.ensure_future(lDevice.receive())
+
+            await asyncio.sleep(0.05)
+
+            if pRemove == True:
+                assert lManager.removeDevice(0x12) is lDevice
+            else:
+                lManager.close()
+
+            with pytest.raises(NameError, match="closed"):
+                await asyncio.wait_for(lReceiver, 2.0)
+
+            assert lDevice.lost == True
+
+            with pytest.raises(NameError):
+                lDevice.write(b'\x02')
+        finally:
+            lManager.close()
+            os.close(lMaster)
+
+    asyncio.run(lMain())
+
+
+def test_close_on_a_full_queue():
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager(pQueueSize=2)
+        lFrame = encodeVaubanFrame(0x12, ord('P'))
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+
+            os.write(lMaster, lFrame + lFrame)
+
+            while lDevice.queue.full() == False:
+                await asyncio.sleep(0.01)
+
+            lManager.close()
+
+            # the oldest frame makes room for the sentinel
+            assert await lDevice.receive() == bytes(lFrame)
+
+            with pytest.raises(NameError):
+                await lDevice.receive()
+
+            assert lDevice.framesOverflow == 1
+        finally:
+            os.close(lMaster)
+
+    asyncio.run(lMain())
+
+
+def test_shutdown_flushes_pending_writes(monkeypatch):
+
+    async def lMain():
+
+        lMaster, lName = openPty()
+        lManager = Manager()
+        lWrite = os.write
+        lBusy = [ 5 ]
+        lEvents = []
+
+        # the descriptor refuses the first writes, as a full line would
+        def lSlowWrite(pDescriptor, pData):
+
+            if lBusy[0] > 0:
+                lBusy[0] -= 1
+                raise BlockingIOError()
+
+            lEvents.append('write')
+
+            return lWrite(pDescriptor, pData)
+
+        try:
+            lDevice = lManager.addDevice(lName, 0x12)
+            lClose = lDevice.mDevicePtr.close
+
+            def lTrackedClose():
+                lEvents.append('close')
+                lClose()
+
+            monkeypatch.setattr(lDevice.mDevicePtr, 'close', lTrackedClose)
+            monkeypatch.setattr(VaubanDeviceManager.os, 'write', lSlowWrite)
+
+            lDevice.write(bytes(encodeVaubanFrame(0x12, ord('P'))))
+
+            assert len(lDevice.mWriteBuffer) > 0
+
+            await lManager.shutdown(2.0)
+
+            assert lEvents == [ 'write', 'close' ]
+            assert os.read(lMaster, 64) == bytes(encodeVaubanFrame(0x12, ord('P')))
+            assert lManager.devices == {}
+        finally:
+            monkeypatch.undo()
+            os.close(lMaster)
+
+    asyncio.run(lMain())
@@ -0,0 +1,174 @@
+######################################################
+##
+##   VaubanFrameCache : hits, misses, LRU eviction and
+##   invalidation of every cache on device ID change
+##
+######################################################
+
+import os
+import pty
+from threading import Thread, Barrier
+
+import pytest
+
+from Packet import VaubanDevice, VaubanFrameCache, VaubanOpcodeHandler, VaubanOpcodes, encodeVaubanFrame
+from VaubanPollingScheduler import VaubanPollingScheduler
+
+POLLING = VaubanOpcodes.MSG_SEND_POLLING
+LED = VaubanOpcodes.MSG_SEND_LED
+
+
+class RecordingPort(object):
+
+    def __init__(self):
+        self.mWrites = []
+
+    def write(self, pData):
+        self.mWrites.append(bytes(pData))
+        return len(pData)
+
+
+@pytest.fixture
+def device():
+
+    lMaster, lSlave = pty.openpty()
+    lName = os.ttyname(lSlave)
+    os.close(lSlave)
+
+    lDevice = VaubanDevice(lName, 0x12)
+
+    yield lDevice
+
+    lDevice.mDevicePtr.close()
+    os.close(lMaster)
+
+
+def test_hit_and_miss():
+
+    lCache = VaubanFrameCache(8)
+
+    assert lCache.get(0x12, POLLING, ()) is None
+
+    lFrame = lCache.put(0x12, POLLING, (), bytearray(b'frame'))
+
+    assert lFrame == b'frame' and type(lFrame) is bytes
+    assert lCache.get(0x12, POLLING, ()) is lFrame
+    assert lCache.get(0x12, LED, (1, 2, 3, 4, 5)) is None
+
+    lStats = lCache.getStats()
+
+    assert (lStats['hits'], lStats['misses'], lStats['size']) == (1, 2, 1)
+    assert lStats['hit_rate'] == 1.0 / 3
+
+
+def test_lru_eviction():
+
+    lCache = VaubanFrameCache(2)
+
+    lCache.put(1, POLLING, (), b'1')
+    lCache.put(2, POLLING, (), b'2')
+
+    # 1 becomes the most recently used
+    lCache.get(1, POLLING, ())
+    lCache.put(3, POLLING, (), b'3')
+
+    assert lCache.get(2, POLLING, ()) is None
+    assert lCache.get(1, POLLING, ()) == b'1'
+    assert lCache.getStats()['evictions'] == 1
+
+    # evicted keys leave the device index
+    assert 2 not in lCache.mDeviceKeys
+
+
+def test_invalidate():
+
+    lCache = VaubanFrameCache()
+
+    lCache.put(1, POLLING, (), b'p1')
+    lCache.put(1, LED, (1, 2, 3, 4, 5), b'l1')
+    lCache.put(2, POLLING, (), b'p2')
+
+    lCache.invalidate(1)
+    lCache.invalidate(99)
+
+    assert lCache.get(1, POLLING, ()) is None
+    assert lCache.get(1, LED, (1, 2, 3, 4, 5)) is None
+    assert lCache.get(2, POLLING, ()) == b'p2'
+
+
+def test_invalid_size():
+
+    with pytest.raises(NameError):
+        VaubanFrameCache(0)
+
+
+def test_device_id_change_invalidates_every_cache(device):
+
+    lShared = VaubanFrameCache.getInstance()
+    lPrivate = VaubanFrameCache(16)
+
+    lShared.put(0x12, POLLING, (), b'old')
+    lPrivate.put(0x12, POLLING, (), b'old')
+
+    device.setDeviceId(0x34)
+
+    assert lShared.get(0x12, POLLING, ()) is None
+    assert lPrivate.get(0x12, POLLING, ()) is None
+
+
+def test_handler_cache_follows_device_id(device):
+
+    lHandler = VaubanOpcodeHandler(VaubanFrameCache(16))
+
+    # writes go to the port proxy when there is one
+    device.mPort = RecordingPort()
+
+    lHandler.sendPollingPacket(device)
+    device.setDeviceId(0x34)
+    lHandler.sendPollingPacket(device)
+
+    assert device.mPort.mWrites == [ bytes(encodeVaubanFrame(0x12, POLLING)), bytes(encodeVaubanFrame(0x34, POLLING)) ]
+    assert lHandler.mFrameCache.getStats()['size'] == 1
+
+
+def test_get_instance_is_shared_across_threads(monkeypatch):
+
+    monkeypatch.setattr(VaubanFrameCache, 'mInstance', None)
+
+    lStart = Barrier(16)
+    lInstances = []
+
+    def lGet():
+        lStart.wait()
+        lInstances.append(VaubanFrameCache.getInstance())
+
+    lThreads = [ Thread(target=lGet) for lI in range(16) ]
+
+    for lThread in lThreads:
+        lThread.start()
+
+    for lThread in lThreads:
+        lThread.join()
+
+    assert len(set(map(id, lInstances))) == 1
+
+
+######################################################
+##
+##   The polling scheduler builds its frames through
+##                   the cache
+##
+######################################################
+
+def test_polling_scheduler_uses_the_cache(device):
+
+    lCache = VaubanFrameCache(16)
+    lScheduler = VaubanPollingScheduler(pFrameCache=lCache)
+
+    assert lScheduler.getPollingFrame(0x12) == bytes(encodeVaubanFrame(0x12, POLLING))
+    assert lCache.get(0x12, POLLING, ()) is lScheduler.getPollingFrame(0x12)
+
+    device.setDeviceId(0x34)
+
+    assert lCache.getStats()['size'] == 0
+    assert lScheduler.getPollingFrame(0x34) == bytes(encodeVaubanFrame(0x34, POLLING))
@@ -0,0 +1,166 @@
+######################################################
+##
+##   VaubanFrameParser : resync on line noise, frames
+##   split across reads, XOR failures and frames cut
+##            before their ETX
+##
+######################################################
+
+import pytest
+
+from Packet import VaubanFrameParser, VaubanOpcodes, encodeVaubanFrame
+
+FRAME = bytes(encodeVaubanFrame(0x12, VaubanOpcodes.MSG_SEND_POLLING))
+OTHER = bytes(encodeVaubanFrame(0xABCD, VaubanOpcodes.MSG_SEND_POLLING, b'S0011223344'))
+
+
+def test_single_frame():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(FRAME) == [ FRAME ]
+    assert lParser.framesDecoded == 1
+    assert lParser.mBytesDropped == 0
+
+
+def test_back_to_back_frames():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(FRAME + OTHER + FRAME) == [ FRAME, OTHER, FRAME ]
+
+
+######################################################
+##
+##                 Line noise resync
+##
+######################################################
+
+@pytest.mark.parametrize("pNoise", [ b'garbage', b'\x00\xff\x10', b'\x03\x03', b'\x03abc\x03' ])
+def test_resync_on_garbage(pNoise):
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(pNoise + FRAME + pNoise + OTHER) == [ FRAME, OTHER ]
+    assert lParser.mBytesDropped == 2 * len(pNoise)
+    assert lParser.mFramesCorrupt == 0
+
+
+def test_garbage_only():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(b'no frame here') == []
+    assert lParser.feed(FRAME) == [ FRAME ]
+
+
+######################################################
+##
+##               Frames split across reads
+##
+######################################################
+
+@pytest.mark.parametrize("pSplit", range(1, len(FRAME)))
+def test_split_in_two_reads(pSplit):
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(FRAME[:pSplit]) == []
+    assert lParser.feed(FRAME[pSplit:] + OTHER) == [ FRAME, OTHER ]
+
+
+def test_byte_per_byte():
+
+    lParser = VaubanFrameParser()
+    lFrames = []
+
+    for lByte in b'xx' + FRAME + OTHER:
+        lFrames += lParser.feed(bytes([ lByte ]))
+
+    assert lFrames == [ FRAME, OTHER ]
+
+
+######################################################
+##
+##                 Control frame
+##
+######################################################
+
+def test_bad_xor_is_rejected():
+
+    lCorrupt = bytearray(OTHER)
+    lCorrupt[7] ^= 0x01
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(bytes(lCorrupt) + FRAME) == [ FRAME ]
+    assert lParser.mXorFailures == 1
+    assert lParser.mFramesCorrupt == 1
+
+
+def test_lowercase_control_frame_is_accepted():
+
+    lFrame = FRAME[:-3] + FRAME[-3:-1].lower() + FRAME[-1:]
+
+    assert VaubanFrameParser().feed(lFrame) == [ lFrame ]
+
+
+def test_xor_check_can_be_disabled():
+
+    lCorrupt = bytearray(FRAME)
+    lCorrupt[-2] = ord('0') if lCorrupt[-2] != ord('0') else ord('1')
+
+    assert VaubanFrameParser(pValidateControlFrame=False).feed(bytes(lCorrupt)) == [ bytes(lCorrupt) ]
+
+
+def test_short_frame_is_rejected():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(b'\x02AB\x03' + FRAME) == [ FRAME ]
+    assert lParser.mFramesCorrupt == 1
+
+
+######################################################
+##
+##                   Missing ETX
+##
+######################################################
+
+def test_missing_etx_before_next_frame():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(FRAME[:-1] + OTHER) == [ OTHER ]
+    assert lParser.mFramesDropped == 1
+
+
+def test_missing_etx_across_reads():
+
+    lParser = VaubanFrameParser()
+
+    assert lParser.feed(FRAME[:-1]) == []
+    assert lParser.feed(OTHER) == [ OTHER ]
+    assert lParser.mFramesDropped == 1
+
+
+def test_unterminated_frame_is_bounded():
+
+    lParser = VaubanFrameParser(pMaxFrameSize=32)
+
+    assert lParser.feed(b'\x02' + b'A' * 40) == []
+    assert lParser.mFramesDropped == 1
+    assert len(lParser.mBuffer) == 0
+
+    # the tail of the oversized frame is noise until the next STX
+    assert lParser.feed(b'AAAA\x03' + FRAME) == [ FRAME ]
+
+
+def test_reset_drops_the_partial_frame():
+
+    lParser = VaubanFrameParser()
+
+    lParser.feed(FRAME[:4])
+    lParser.reset()
+
+    assert lParser.feed(FRAME[4:] + OTHER) == [ OTHER ]
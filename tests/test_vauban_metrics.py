@@ -0,0 +1,124 @@
+######################################################
+##
+##   Enrollment round trip and access dispatch for
+##    legacy read callbacks, metrics log sink output
+##
+######################################################
+
+import os
+import pty
+import threading
+
+import Packet
+import VaubanMetrics
+from Packet import VaubanDevice, VaubanOpcodeHandler, VaubanPacket, encodeVaubanFrame
+
+
+class RecordingDispatcher(object):
+
+    def __init__(self):
+        self.mCalls = []
+        self.mDone = threading.Event()
+
+    def checkAccess(self, pCardId, pDevicePtr):
+        self.mCalls.append((pCardId, pDevicePtr))
+        self.mDone.set()
+
+
+class RecordingLogger(object):
+
+    mLines = []
+
+    def __init__(self, pName):
+        self.mName = pName
+
+    def Write(self, pLine):
+        RecordingLogger.mLines.append((self.mName, pLine))
+
+
+def openPty():
+
+    lMaster, lSlave = pty.openpty()
+    lName = os.ttyname(lSlave)
+
+    os.close(lSlave)
+
+    return lMaster, lName
+
+
+def test_legacy_callback_is_dispatched_with_its_device():
+
+    lMaster, lName = openPty()
+    lDevice = VaubanDevice(lName, 0x12)
+    lDispatcher = RecordingDispatcher()
+    lHandler = VaubanOpcodeHandler(pAccessDispatcher=lDispatcher)
+    lMetrics = lDevice.enableMetrics()
+
+    # legacy callers only hand the raw packet to the handler
+    def lCallback(pPacket):
+        lHandler.processPacket(VaubanPacket(packet=pPacket))
+
+    try:
+        lDevice.startReadService(lCallback)
+        lHandler.sendEnrollementPacket(1, lDevice)
+
+        os.write(lMaster, encodeVaubanFrame(0x12, ord('E'), b'S0000002A'))
+
+        assert lDispatcher.mDone.wait(2.0) == True
+        assert lDispatcher.mCalls[0][1] is lDevice
+        assert lMetrics.getStats()['enrollments_answered'] == 1
+    finally:
+        lDevice.stopReadService()
+        lDevice.device.close()
+        os.close(lMaster)
+
+
+def test_no_dispatch_outside_a_read_thread(monkeypatch):
+
+    lDispatcher = RecordingDispatcher()
+    lHandler = VaubanOpcodeHandler(pAccessDispatcher=lDispatcher)
+    lCalls = []
+
+    monkeypatch.setattr(Packet.DeciboxAPI, 'checkAccess', lambda self, pCardId, pInterface: lCalls.append(pInterface), raising=False)
+
+    # outside a read thread there is no device to dispatch to
+    lHandler.processPacket(Packet.VaubanFrame(0x12, 'E', 'S', 0x2A, b''))
+
+    assert lDispatcher.mCalls == []
+    assert lCalls == [ VaubanOpcodeHandler.mDefaultInterface ]
+
+
+def test_direct_access_check_uses_the_device_interface(monkeypatch):
+
+    lMaster, lName = openPty()
+    lDevice = VaubanDevice(lName, 0x12)
+    lCalls = []
+
+    monkeypatch.setattr(Packet.DeciboxAPI, 'checkAccess', lambda self, pCardId, pInterface: lCalls.append(pInterface), raising=False)
+
+    try:
+        # no dispatcher : the backend is asked for the reader the card was read on
+        VaubanOpcodeHandler().processPacket(Packet.VaubanFrame(0x12, 'E', 'S', 0x2A, b''), lDevice)
+
+        assert lCalls == [ lName ]
+    finally:
+        lDevice.device.close()
+        os.close(lMaster)
+
+
+def test_log_sink_writes_through_the_logger(monkeypatch):
+
+    monkeypatch.setattr(VaubanMetrics, 'Logger', RecordingLogger)
+    RecordingLogger.mLines = []
+
+    lLatency = { 'p99_ms' : 1.0 }
+
+    VaubanMetrics.VaubanLogSink().publish({
+        'device_id' : 0x12, 'interface' : '/dev/ttyUSB0',
+        'bytes_in' : 10, 'frames_in' : 1, 'bytes_out' : 20, 'frames_out' : 2,
+        'xor_failures' : 0, 'frames_dropped' : 0,
+        'decode' : lLatency, 'callback' : lLatency, 'enrollment' : lLatency })
+
+    assert len(RecordingLogger.mLines) == 1
+    assert RecordingLogger.mLines[0][0] == "vauban"
+    assert RecordingLogger.mLines[0][1].startswith("[Vauban-Metrics] -> reader 18 ( /dev/ttyUSB0 )")
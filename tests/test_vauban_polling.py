@@ -0,0 +1,122 @@
+######################################################
+##
+##    Polling scheduler : failing readers, device ID
+##          changes while registered
+##
+######################################################
+
+import time
+
+import VaubanPollingScheduler
+from VaubanPollingScheduler import VaubanPollingScheduler as Scheduler
+
+
+class FakePort(object):
+
+    def __init__(self, pFail = False):
+        self.mWrites = []
+        self.mFail = pFail
+
+    def write(self, pData):
+
+        if self.mFail == True:
+            raise OSError("device reports readiness to read but returned no data")
+
+        self.mWrites.append(bytes(pData))
+        return len(pData)
+
+
+class FakeDevice(object):
+
+    def __init__(self, pDeviceId, pFail = False):
+        self.mDeviceId = pDeviceId
+        self.mPort = FakePort(pFail)
+
+    def setDeviceId(self, pDeviceId):
+        self.mDeviceId = pDeviceId
+
+    @property
+    def deviceId(self):
+        return self.mDeviceId
+
+    @property
+    def device(self):
+        return self.mPort
+
+
+class RecordingLogger(object):
+
+    mLines = []
+
+    def __init__(self, pName):
+        self.mName = pName
+
+    def Write(self, pLine):
+        RecordingLogger.mLines.append(pLine)
+
+
+def test_failing_reader_does_not_stop_the_others(monkeypatch):
+
+    monkeypatch.setattr(VaubanPollingScheduler, 'Logger', RecordingLogger)
+    RecordingLogger.mLines = []
+
+    lScheduler = Scheduler(pRate=1000.0, pMinInterval=0.1)
+    lBroken = FakeDevice(0x11, pFail=True)
+    lHealthy = FakeDevice(0x12)
+
+    lScheduler.registerDevice(lBroken)
+    lScheduler.registerDevice(lHealthy)
+
+    lScheduler.tick(0.0)
+    lScheduler.tick(0.0)
+
+    lStats = lScheduler.getStats()
+
+    assert len(lHealthy.device.mWrites) == 1
+    assert lStats[ 0x11 ]['errors'] == 1
+    assert lStats[ 0x11 ]['last_error'] is not None
+    assert lStats[ 0x12 ]['errors'] == 0
+    assert len(RecordingLogger.mLines) == 1
+
+
+def test_poll_service_survives_write_errors(monkeypatch):
+
+    monkeypatch.setattr(VaubanPollingScheduler, 'Logger', RecordingLogger)
+
+    lScheduler = Scheduler(pRate=1000.0, pMinInterval=0.01, pMaxInterval=0.01)
+    lBroken = FakeDevice(0x11, pFail=True)
+    lHealthy = FakeDevice(0x12)
+
+    lScheduler.registerDevice(lBroken)
+    lScheduler.registerDevice(lHealthy)
+
+    lScheduler.start()
+
+    try:
+        time.sleep(0.1)
+        assert lScheduler.mRunThread.is_alive() == True
+    finally:
+        lScheduler.stop()
+
+    assert lScheduler.getStats()[ 0x11 ]['errors'] >= 2
+    assert len(lHealthy.device.mWrites) >= 2
+
+
+def test_unregister_after_device_id_change():
+
+    lScheduler = Scheduler()
+    lDevice = FakeDevice(0x11)
+
+    assert lScheduler.registerDevice(lDevice) == True
+
+    lScheduler.tick(0.0)
+    lDevice.setDeviceId(0x21)
+    lScheduler.tick(1.0)
+
+    # the frame follows the new ID
+    assert lDevice.device.mWrites[0] != lDevice.device.mWrites[1]
+    assert list(lScheduler.getStats().keys()) == [ 0x21 ]
+
+    assert lScheduler.unregisterDevice(lDevice) == True
+    assert lScheduler.getStats() == {}
+    assert lScheduler.tick(2.0) == lScheduler.mMinInterval